@@ -0,0 +1,129 @@
+"""
+请求准入控制模块，负责请求排队、浏览器槽位分配和超时淘汰
+"""
+
+import math
+from collections import Counter, deque
+from time import time as current_time
+
+from config import logger
+
+
+class QueueFullError(Exception):
+    """等待队列已满，请求被立即拒绝"""
+
+    def __init__(self, retry_after):
+        super().__init__("Request queue is full")
+        self.retry_after = retry_after  # 建议客户端重试前等待的秒数
+
+
+class QueueTimeoutError(Exception):
+    """请求在队列中等待超过截止时间"""
+
+
+class Ticket:
+    """排队请求的票据，按身份比较，同一模型的请求按票据入队顺序领取浏览器"""
+    __slots__ = ("model",)
+
+    def __init__(self, model):
+        self.model = model  # 请求的模型，None 表示不限模型
+
+
+class AdmissionController:
+    """
+    请求准入控制器
+
+    维护一个有界 FIFO 等待队列，同一模型中只有最早排队的请求可以领取空闲浏览器，
+    不同模型的请求互不阻塞；浏览器归还时通过条件变量唤醒等待者，不再忙等轮询。
+    """
+
+    def __init__(self, pool, max_queue_size, max_wait_time):
+        """
+        初始化准入控制器
+
+        参数：
+            pool: BrowserPool 实例，槽位即池中的空闲浏览器
+            max_queue_size: 允许同时排队等待的最大请求数
+            max_wait_time: 请求默认的最长排队时间（秒）
+        """
+        self.pool = pool
+        self.cond = pool.available  # 与浏览器池共用同一把锁，归还浏览器即唤醒排队请求
+        self.waiting = deque()  # 排队中的请求票据，队首优先
+        self.max_queue_size = max_queue_size
+        self.max_wait_time = max_wait_time
+        self.avg_service_time = 5.0  # 单个请求占用浏览器时间的滑动平均（秒），用于估算 Retry-After
+
+    def deadline_for(self, start_time):
+        """根据请求开始时间计算默认截止时间"""
+        return start_time + self.max_wait_time
+
+    def queue_length(self):
+        """返回当前排队请求数（无锁读取，仅用于展示）"""
+        return len(self.waiting)
+
+    def retry_after(self):
+        """估算客户端应在多少秒后重试"""
+        capacity = max(self.pool.capacity(), 1)
+        estimate = self.avg_service_time * (len(self.waiting) + 1) / capacity
+        return max(1, int(math.ceil(estimate)))
+
+    def _publish_demand_locked(self):
+        """将总排队数和各模型的排队数告知浏览器池，调用方需已持有锁"""
+        self.pool.set_demand_locked(len(self.waiting), dict(Counter(ticket.model for ticket in self.waiting)))
+
+    def _is_head_locked(self, ticket):
+        """票据是否为其模型中最早排队的请求"""
+        return next(t for t in self.waiting if t.model == ticket.model) is ticket
+
+    def acquire(self, deadline, prefer=None, exclude=(), model=None):
+        """
+        排队并领取一个空闲浏览器
+
+        参数：
+            deadline: 截止时间戳，超过该时间仍未拿到浏览器则放弃
+            prefer: 优先领取的浏览器编号（如上一轮对话所在的浏览器）
+            exclude: 不领取的浏览器编号（如重放请求时刚失败的浏览器）
+            model: 只领取服务该模型的浏览器，None 表示不限模型
+
+        返回：
+            PooledBrowser: 领取到的浏览器实例
+
+        异常：
+            QueueFullError: 队列已满
+            QueueTimeoutError: 排队超时
+        """
+        with self.cond:
+            if len(self.waiting) >= self.max_queue_size:
+                raise QueueFullError(self.retry_after())
+            ticket = Ticket(model)  # 每个请求一个唯一票据
+            self.waiting.append(ticket)
+            self._publish_demand_locked()  # 告知浏览器池当前排队压力
+            try:
+                while True:
+                    remaining = deadline - current_time()
+                    if remaining <= 0:  # 已过期的请求在接触浏览器之前就被丢弃
+                        raise QueueTimeoutError()
+                    if self._is_head_locked(ticket):
+                        browser = self.pool.checkout_locked(prefer, exclude, model)
+                        if browser is not None:
+                            return browser
+                    self.cond.wait(remaining)
+            finally:
+                self.waiting.remove(ticket)
+                self._publish_demand_locked()
+                self.cond.notify_all()  # 队首变化，唤醒下一个等待者
+
+    def release(self, browser, service_time=None):
+        """
+        归还浏览器并更新服务时间统计
+
+        参数：
+            browser: PooledBrowser 实例
+            service_time: 本次请求占用浏览器的时长（秒）
+        """
+        if service_time is not None:
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+        try:
+            self.pool.return_browser(browser)
+        except Exception as e:
+            logger.error(f"归还浏览器失败: {e}")
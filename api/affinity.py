@@ -0,0 +1,107 @@
+"""
+对话亲和模块，将消息前缀映射到产生上一轮回复的浏览器和对话，多轮对话只发送新增的消息
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from time import time as current_time
+
+from utils.text import sanitize_text, merge_messages, content_text
+
+# 可继续的对话：对话页面地址、需要发送的新增消息文本、上次所在的浏览器编号、对话页面中已有的回复数量
+Continuation = namedtuple("Continuation", ["chat_url", "message", "browser_id", "replies"])
+
+
+class ConversationAffinity:
+    """
+    对话亲和表
+
+    每次回复完成后，以“请求消息 + 本次回复”作为前缀记录对话位置；
+    下一轮请求的消息若以该前缀开头，则只需在原对话中发送新增的消息。
+    """
+
+    def __init__(self, max_entries, ttl):
+        """
+        参数：
+            max_entries: 最多记录的对话数
+            ttl: 对话记录的有效期（秒）
+        """
+        self.entries = OrderedDict()  # 前缀哈希 -> (过期时间, 对话地址, 浏览器编号, 回复数量)
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    @staticmethod
+    def prefix_key(model, messages):
+        """计算模型和消息列表的前缀哈希，内容按 merge_messages 的规则清洗后比较"""
+        digest = hashlib.sha256()
+        digest.update(model.encode("utf-8"))
+        for msg in messages:
+            content = sanitize_text(content_text(msg.get("content")).strip())
+            if not content:  # 与 merge_messages 一致，忽略空消息
+                continue
+            digest.update(b"\0")
+            digest.update(str(msg.get("role")).encode("utf-8"))
+            digest.update(b"\1")
+            digest.update(content.encode("utf-8"))
+        return digest.hexdigest()
+
+    def lookup(self, model, messages):
+        """
+        查找可继续的对话
+
+        参数：
+            model: 模型名称
+            messages: 本次请求的完整消息列表
+
+        返回：
+            Continuation，未命中时返回 None
+        """
+        # 最后一条 assistant 消息之前（含）为已有对话，之后的消息为新增内容
+        last_reply = None
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index].get("role") == "assistant":
+                last_reply = index
+                break
+        if last_reply is None or last_reply == len(messages) - 1:
+            return None
+        new_message = merge_messages(messages[last_reply + 1:])
+        if not new_message:
+            return None
+        key = self.prefix_key(model, messages[:last_reply + 1])
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, chat_url, browser_id, replies = entry
+            if expires <= current_time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return Continuation(chat_url, new_message, browser_id, replies)
+
+    def record(self, model, messages, reply_text, chat_url, browser_id, replies):
+        """
+        记录一次完成的回复，供下一轮请求继续该对话
+
+        参数：
+            model: 模型名称
+            messages: 本次请求的完整消息列表
+            reply_text: 返回给客户端的回复文本
+            chat_url: 回复所在的对话页面地址
+            browser_id: 处理本次请求的浏览器编号
+            replies: 对话页面中包括本次回复在内的回复数量，重新打开对话时等待这些回复渲染完成
+
+        返回：
+            是否已记录
+        """
+        if self.max_entries <= 0 or not reply_text or not chat_url:
+            return False
+        key = self.prefix_key(model, list(messages) + [{"role": "assistant", "content": reply_text}])
+        with self.lock:
+            self.entries[key] = (current_time() + self.ttl, chat_url, browser_id, replies)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return True
@@ -0,0 +1,129 @@
+"""
+响应缓存模块，按模型和合并后的消息文本精确匹配缓存回复，并合并并发的相同请求
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from time import time as current_time
+
+
+class Flight:
+    """
+    一次正在进行中的浏览器请求，供相同的并发请求等待共享结果
+    """
+
+    def __init__(self):
+        self.event = threading.Event()  # 结果就绪时置位
+        self.text = None  # 成功时的回复文本
+        self.error = None  # 失败时的异常
+
+    def wait(self, timeout):
+        """
+        等待领头请求完成
+
+        参数：
+            timeout: 最长等待时间（秒）
+
+        返回：
+            回复文本；领头请求失败或等待超时时返回 None，由调用方自行处理请求
+        """
+        if not self.event.wait(max(timeout, 0)):
+            return None
+        return self.text if self.error is None else None
+
+
+class ResponseCache:
+    """
+    带 LRU 和 TTL 淘汰的回复缓存，同时提供 single-flight 请求合并
+    """
+
+    def __init__(self, max_entries, ttl):
+        """
+        初始化缓存
+
+        参数：
+            max_entries: 最多缓存的回复条数
+            ttl: 缓存条目的有效期（秒）
+        """
+        self.entries = OrderedDict()  # 缓存键 -> (过期时间, 回复文本)，按最近使用排序
+        self.flights = {}  # 缓存键 -> 进行中的 Flight
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0  # 命中次数
+        self.misses = 0  # 未命中次数
+
+    @staticmethod
+    def make_key(model, merged_message, variant=""):
+        """根据模型名、合并后的消息文本和输出限制（见 ReplyLimits.signature）生成缓存键"""
+        digest = hashlib.sha256()
+        digest.update(model.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(merged_message.encode("utf-8"))
+        if variant:  # 不带限制的请求保持原有的缓存键
+            digest.update(b"\0")
+            digest.update(variant.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        读取缓存，过期条目会被删除
+
+        返回：
+            回复文本，未命中时返回 None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, text = entry
+                if expires > current_time():
+                    self.entries.move_to_end(key)  # 标记为最近使用
+                    self.hits += 1
+                    return text
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, text):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.max_entries <= 0 or not text:
+            return
+        with self.lock:
+            self.entries[key] = (current_time() + self.ttl, text)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def join(self, key):
+        """
+        加入或发起针对该键的请求
+
+        返回：
+            (flight, leader): leader 为 True 时调用方负责执行请求并调用 finish()
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self.flights[key] = Flight()
+            return flight, True
+
+    def finish(self, key, flight, text=None, error=None):
+        """
+        结束领头请求，写入缓存并唤醒等待者
+
+        参数：
+            key: 缓存键
+            flight: join() 返回的 Flight
+            text: 成功时的回复文本
+            error: 失败时的异常，失败结果不会写入缓存
+        """
+        if error is None and text:
+            self.put(key, text)
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.text = text
+        flight.error = error if error is not None or text else Exception("empty response")
+        flight.event.set()
@@ -0,0 +1,281 @@
+"""
+直连后端模块：使用从池中浏览器读取的登录凭据，直接以 HTTP 调用聊天后端的补全接口
+
+请求不占用浏览器标签页，由带连接池的 keep-alive HTTP 会话发送，按与网络流捕获相同的规则解析 SSE 响应。
+浏览器只用于定期读取凭据；凭据不可用、并发已满或在返回任何内容前失败时，请求改走浏览器。
+"""
+
+import json
+import threading
+import uuid
+from time import time as current_time
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import CONFIG, logger
+from browser.actions import harvest_credentials
+
+
+class DirectUnavailable(Exception):
+    """
+    本次请求无法直连后端，调用方改走浏览器
+    """
+
+    def __init__(self, reason, detail=""):
+        """
+        参数：
+            reason: 原因，用作指标标签：no_credentials、busy、auth、connect、status
+            detail: 详细信息，用于日志
+        """
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+
+class DirectReply:
+    """
+    一次直连请求的流式回复，接口与 ResponseStream 一致：迭代得到 (文本, 是否完成)
+
+    迭代结束、出错或调用 close() 时关闭响应并释放并发名额。
+    """
+
+    source = "direct"  # 回复的读取来源，用于 REPLY_SOURCE 指标
+
+    def __init__(self, transport, response):
+        """
+        参数：
+            transport: 发起请求的 DirectTransport
+            response: 已确认状态码和类型的流式 requests 响应
+        """
+        self.transport = transport
+        self.response = response
+        self.text = ""  # 已读取到的回复文本
+        self.done = False  # 后端是否已表示回复结束
+        self.installed_at = current_time()  # 发出请求的时间
+        self.first_text_at = None  # 首次读到回复文本的时间
+        self.finished_at = None  # 回复生成完成的时间
+        self.closed = False
+
+    def close(self):
+        """关闭响应（客户端断开时后端随之停止生成）并释放并发名额，可重复调用"""
+        if self.closed:
+            return
+        self.closed = True
+        self.response.close()
+        self.transport.finish()
+
+    def handle(self, line):
+        """
+        解析一行 SSE 数据：累加 choices[0].delta.content，思考阶段（phase 不为 answer）的内容不计入回复
+
+        参数：
+            line: 响应中的一行文本
+
+        异常：
+            Exception: 后端在流中返回错误
+        """
+        if not line.startswith("data:"):
+            return
+        data = line[5:].strip()
+        if data == "[DONE]":
+            self.done = True
+            return
+        try:
+            event = json.loads(data)
+        except ValueError:
+            return
+        if not isinstance(event, dict):
+            return
+        if event.get("error") or event.get("success") is False:
+            raise Exception(f"后端返回错误: {event.get('error') or event.get('data') or event}")
+        choices = event.get("choices") or [{}]
+        choice = choices[0]
+        delta = choice.get("delta") or choice.get("message") or {}
+        if isinstance(delta.get("content"), str) and delta.get("phase") in (None, "answer"):
+            self.text += delta["content"]
+        if choice.get("finish_reason") or delta.get("status") == "finished":
+            self.done = True
+
+    def __iter__(self):
+        """
+        迭代回复的变化，直到回复完成；少量文本增长按 stream_flush_interval / stream_flush_chars 合并后再返回
+
+        生成：
+            (text, done): 当前完整回复文本和是否已完成
+
+        异常：
+            TimeoutError: 超过 generation_timeout 仍未完成
+            Exception: 连接中断或后端返回错误
+        """
+        deadline = self.installed_at + CONFIG["generation_timeout"]
+        flushed_chars = 0  # 上次返回时的文本长度
+        flushed_at = self.installed_at
+        try:
+            for line in self.response.iter_lines(chunk_size=None, decode_unicode=True):
+                if current_time() > deadline:
+                    raise TimeoutError("等待回复生成超时")
+                self.handle(line)
+                if self.first_text_at is None and self.text:
+                    self.first_text_at = current_time()
+                if self.done:
+                    break
+                grown = len(self.text) - flushed_chars
+                if grown and (not flushed_chars or grown >= CONFIG["stream_flush_chars"]
+                              or current_time() - flushed_at >= CONFIG["stream_flush_interval"]):
+                    flushed_chars, flushed_at = len(self.text), current_time()
+                    yield self.text, False
+            self.finished_at = current_time()  # 响应流结束同样视为回复完成
+            yield self.text, True
+        finally:
+            self.close()
+
+
+class DirectTransport:
+    """
+    直连后端的传输层：管理登录凭据和 keep-alive HTTP 连接池
+
+    凭据从池中空闲浏览器读取，超过 direct_credentials_ttl 后在后台刷新，刷新期间继续使用旧凭据；
+    后端返回 401/403 时立即作废凭据并刷新。
+    """
+
+    def __init__(self, pool):
+        """
+        参数：
+            pool: BrowserPool 实例，用于借出空闲浏览器读取凭据
+        """
+        self.pool = pool
+        self.session = requests.Session()  # 复用 TCP/TLS 连接
+        self.mount()
+        self.lock = threading.Lock()  # 保护并发计数和刷新状态
+        self.credentials = None  # 最近读取的凭据，见 harvest_credentials
+        self.harvested_at = 0  # 读取凭据的时间
+        self.refreshing = False  # 是否有后台线程正在读取凭据
+        self.active = 0  # 进行中的直连请求数
+
+    def mount(self):
+        """按 direct_max_concurrency 设置连接池大小，配置热加载后重新调用，已建立的连接随旧连接池关闭"""
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CONFIG["direct_max_concurrency"])
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def api_url(self):
+        """补全接口地址，未配置 direct_api_url 时为聊天页面下的 api/chat/completions"""
+        return CONFIG["direct_api_url"] or urljoin(CONFIG["chat_url"], "api/chat/completions")
+
+    def credentials_age(self):
+        """当前凭据的年龄（秒），尚无凭据时返回 None"""
+        return current_time() - self.harvested_at if self.credentials is not None else None
+
+    def refresh(self):
+        """在后台线程中从空闲浏览器读取凭据，已有刷新在进行时直接返回"""
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self._refresh, name="direct-credentials", daemon=True).start()
+
+    def _refresh(self):
+        """后台线程：借出一个空闲浏览器读取凭据，没有空闲浏览器时留待下一次请求重试"""
+        try:
+            with self.pool.borrow_idle() as browser:
+                if browser is None:
+                    return
+                with browser.activate():
+                    credentials = harvest_credentials(browser.driver)
+            self.credentials, self.harvested_at = credentials, current_time()
+            logger.info(f"已从浏览器 {browser.id} 读取直连凭据（{len(credentials['cookies'])} 个 Cookie）")
+        except Exception as e:
+            logger.warning(f"读取直连凭据失败: {e}")
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def invalidate(self):
+        """作废当前凭据（如后端返回 401/403）并重新读取"""
+        self.credentials = None
+        self.refresh()
+
+    def finish(self):
+        """释放一个并发名额，由 DirectReply.close() 调用"""
+        with self.lock:
+            self.active -= 1
+
+    def build_request(self, model, message, credentials):
+        """
+        构造补全请求的请求头和请求体，与页面自身发出的请求保持一致
+
+        参数：
+            model: models 中的模型名称
+            message: 合并后的完整消息文本
+            credentials: harvest_credentials 返回的凭据
+
+        返回：
+            (headers, body)
+        """
+        headers = {
+            "Accept": "text/event-stream",
+            "Content-Type": "application/json",
+            "Cookie": "; ".join(f"{name}={value}" for name, value in credentials["cookies"].items()),
+        }
+        if credentials.get("user_agent"):
+            headers["User-Agent"] = credentials["user_agent"]
+        if credentials.get("origin"):
+            headers["Origin"] = credentials["origin"]
+            headers["Referer"] = credentials["origin"] + "/"
+        if credentials.get("token"):
+            headers["Authorization"] = f"Bearer {credentials['token']}"
+        chat_id = str(uuid.uuid4())
+        body = {
+            "stream": True,
+            "incremental_output": True,
+            "chat_type": "t2t",
+            "model": CONFIG["direct_model_map"].get(model) or CONFIG["models"][model],  # 后端使用的模型编号
+            "chat_id": chat_id,
+            "session_id": chat_id,
+            "id": str(uuid.uuid4()),
+            "messages": [{"role": "user", "content": message, "chat_type": "t2t", "extra": {}}],
+        }
+        return headers, body
+
+    def open(self, model, message):
+        """
+        发送补全请求，确认后端开始以 SSE 流式返回后交给调用方读取
+
+        参数：
+            model: models 中的模型名称
+            message: 合并后的完整消息文本
+
+        返回：
+            DirectReply 实例
+
+        异常：
+            DirectUnavailable: 尚无凭据、并发已满、认证失败、连接失败或响应不是 SSE 流
+        """
+        credentials = self.credentials
+        if credentials is None or current_time() - self.harvested_at > CONFIG["direct_credentials_ttl"]:
+            self.refresh()  # 过期的凭据在刷新完成前继续使用
+        if credentials is None:
+            raise DirectUnavailable("no_credentials")
+        with self.lock:
+            if self.active >= CONFIG["direct_max_concurrency"]:
+                raise DirectUnavailable("busy")
+            self.active += 1
+        headers, body = self.build_request(model, message, credentials)
+        try:
+            response = self.session.post(self.api_url(), json=body, headers=headers, stream=True,
+                                         timeout=(CONFIG["wait_timeout"], CONFIG["generation_timeout"]))
+        except requests.RequestException as e:
+            self.finish()
+            raise DirectUnavailable("connect", str(e))
+        content_type = response.headers.get("Content-Type", "")
+        if response.status_code != 200 or "text/event-stream" not in content_type:
+            response.close()
+            self.finish()
+            if response.status_code in (401, 403):
+                if self.credentials is credentials:
+                    self.invalidate()
+                raise DirectUnavailable("auth", f"HTTP {response.status_code}")
+            raise DirectUnavailable("status", f"HTTP {response.status_code} {content_type}")
+        response.encoding = "utf-8"  # SSE 响应通常不声明字符集，避免按 ISO-8859-1 解码中文
+        return DirectReply(self, response)
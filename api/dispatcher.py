@@ -0,0 +1,337 @@
+"""
+多进程调度模块：前端调度进程把请求转发给负载最低的工作进程，并汇总各工作进程的状态
+
+每个工作进程是一个完整的单进程服务（拥有自己的浏览器池、队列和缓存），只监听本机端口；
+调度进程本身不启动浏览器，也可以通过 worker_urls 转发到其他主机上的工作进程。
+"""
+
+import hashlib
+import uuid
+import json
+import os
+import subprocess
+import sys
+import threading
+from time import sleep
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+from config import CONFIG, logger
+from api.models import list_models, model_card, resolve_model
+
+dispatcher_app = Flask("dispatcher")  # 调度进程的 Flask 应用，不注册浏览器相关路由
+
+# 转发给工作进程的请求头
+FORWARD_HEADERS = ("Content-Type", "Cache-Control", "apikey", "Authorization", "X-Request-ID")
+# 工作进程返回后透传给客户端的响应头
+RETURN_HEADERS = ("Content-Type", "Retry-After", "X-Request-ID")
+
+HEALTH_TIMEOUT = 2  # 探测工作进程 /health 的超时时间（秒），与刷新间隔无关
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+class Worker:
+    """
+    一个工作进程（本机子进程或远程地址）及其状态快照
+    """
+
+    def __init__(self, index, url, port=None):
+        """
+        参数：
+            index: 工作进程编号
+            url: 工作进程的服务地址
+            port: 本机子进程监听的端口，远程工作进程为 None
+        """
+        self.index = index
+        self.url = url.rstrip("/")
+        self.port = port
+        self.process = None  # 本机子进程的 Popen 对象
+        self.session = requests.Session()  # 复用到该工作进程的连接
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=64)
+        self.session.mount("http://", adapter)
+        self.inflight = 0  # 调度进程转发给它、尚未结束的请求数
+        self.health = {}  # 最近一次 /health 的结果，整体替换
+        self.alive = False  # 最近一次健康检查是否成功
+
+    def start(self):
+        """启动本机工作子进程"""
+        self.process = subprocess.Popen([sys.executable, MAIN_SCRIPT, "--worker-port", str(self.port)],
+                                        cwd=os.getcwd())  # 工作进程各自写入带端口号的日志文件
+        logger.info(f"工作进程 {self.index} 已启动，端口 {self.port}，pid {self.process.pid}")
+
+    def load(self, model=None):
+        """
+        负载评分：转发中的请求数加上其排队数，减去空闲浏览器数
+
+        参数：
+            model: 请求的模型，工作进程报告了各模型的实例数时只计入该模型的空闲浏览器
+        """
+        idle = self.health.get("idle_browsers", 0)
+        if model is not None and "models" in self.health:
+            idle = self.health["models"].get(model, {}).get("idle", 0)
+        return self.inflight + self.health.get("queue_length", 0) - idle
+
+    def ready(self):
+        """工作进程是否可以接收请求"""
+        return self.alive and self.health.get("ready", False)
+
+class Dispatcher:
+    """
+    请求调度器
+
+    后台线程定期轮询各工作进程的 /health 并保存快照，调度和汇总都只读快照；
+    多轮对话按首条消息粘滞到同一工作进程，使其对话亲和与缓存继续生效。
+    """
+
+    def __init__(self):
+        self.workers = []
+        for index in range(CONFIG["workers"]):
+            port = CONFIG["worker_base_port"] + index
+            self.workers.append(Worker(index, f"http://127.0.0.1:{port}", port))
+        for url in CONFIG["worker_urls"]:
+            self.workers.append(Worker(len(self.workers), url))
+        self.lock = threading.Lock()  # 保护 inflight 计数
+        self.stopped = threading.Event()
+
+    def start(self):
+        """启动本机工作子进程和健康检查线程"""
+        for worker in self.workers:
+            if worker.port is not None:
+                worker.start()
+        threading.Thread(target=self._health_loop, name="dispatcher-health", daemon=True).start()
+
+    def stop(self):
+        """停止健康检查并结束本机工作子进程"""
+        self.stopped.set()
+        for worker in self.workers:
+            if worker.process is not None and worker.process.poll() is None:
+                worker.process.terminate()  # 工作进程收到信号后关闭自己的浏览器
+        for worker in self.workers:
+            if worker.process is not None:
+                try:
+                    worker.process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    worker.process.kill()
+
+    def _health_loop(self):
+        """后台线程：刷新各工作进程的状态快照，重启意外退出的本机子进程"""
+        while not self.stopped.is_set():
+            for worker in self.workers:
+                if worker.process is not None and worker.process.poll() is not None and not self.stopped.is_set():
+                    logger.error(f"工作进程 {worker.index} 已退出（返回码 {worker.process.returncode}），重新启动")
+                    worker.alive = False
+                    worker.start()
+                try:
+                    response = worker.session.get(worker.url + "/health", timeout=HEALTH_TIMEOUT)
+                    worker.health = response.json()
+                    worker.alive = True
+                except Exception:
+                    worker.alive = False
+            sleep(CONFIG["worker_health_interval"])
+
+    def candidates(self, messages, model=None):
+        """
+        按调度顺序返回工作进程列表
+
+        多轮对话（含 assistant 消息）优先粘滞到按首轮问答（第一条 user 和第一条 assistant 消息）哈希选出的工作进程，
+        不使用首条消息，避免共用同一系统提示词的对话全部集中到一个工作进程；
+        其余按负载从低到高排序，就绪的工作进程优先，有该模型空闲浏览器的工作进程负载更低。
+
+        参数：
+            messages: 请求的消息列表
+            model: 请求的模型（已按 models 解析）
+        """
+        with self.lock:
+            ordered = sorted(self.workers, key=lambda w: (not w.ready(), not w.alive, w.load(model)))
+        if any(isinstance(m, dict) and m.get("role") == "assistant" for m in messages):
+            exchange = []  # 首轮问答的内容，同一对话的后续轮次保持不变
+            for role in ("user", "assistant"):
+                message = next((m for m in messages if isinstance(m, dict) and m.get("role") == role), {})
+                exchange.append(message.get("content"))
+            first = json.dumps(exchange, sort_keys=True, ensure_ascii=False)
+            index = int(hashlib.sha256(first.encode("utf-8")).hexdigest(), 16) % len(self.workers)
+            sticky = self.workers[index]
+            if sticky.ready():
+                ordered.remove(sticky)
+                ordered.insert(0, sticky)
+        return ordered
+
+    def forward(self, body, headers):
+        """
+        依次尝试工作进程转发请求：连接失败或队列已满（429）时换下一个
+
+        参数：
+            body: 请求体字节串
+            headers: 需要转发的请求头
+
+        返回：
+            (worker, response): 选中的工作进程和其流式响应；全部失败时 worker 为 None
+        """
+        try:
+            payload = json.loads(body)
+            messages = payload.get("messages") or []
+            model = resolve_model(payload.get("model"))
+        except Exception:
+            messages = []
+            model = None
+        last = None
+        for worker in self.candidates(messages, model):
+            with self.lock:
+                worker.inflight += 1
+            try:
+                response = worker.session.post(worker.url + "/v1/chat/completions", data=body, headers=headers,
+                                               stream=True, timeout=(5, None))
+            except requests.RequestException as e:
+                logger.warning(f"转发到工作进程 {worker.index} 失败: {e}")
+                worker.alive = False
+                self.done(worker)
+                continue
+            if response.status_code == 429:  # 该工作进程队列已满，尝试下一个
+                if last is not None:
+                    last[1].close()
+                    self.done(last[0])
+                last = (worker, response)
+                continue
+            if last is not None:
+                last[1].close()
+                self.done(last[0])
+            return worker, response
+        if last is not None:
+            return last
+        return None, None
+
+    def done(self, worker):
+        """转发结束，减少工作进程的转发中请求数"""
+        with self.lock:
+            worker.inflight -= 1
+
+    def aggregate_health(self):
+        """汇总各工作进程的状态快照"""
+        totals = {"active_browsers": 0, "idle_browsers": 0, "browser_processes": 0,
+                  "queue_length": 0, "cache_entries": 0, "memory_usage": 0,
+                  "chrome_memory_usage": 0, "js_heap_usage": 0}
+        workers = []
+        for worker in self.workers:
+            health = worker.health if worker.alive else {}
+            for key in totals:
+                totals[key] += health.get(key, 0)
+            workers.append({"index": worker.index, "url": worker.url, "alive": worker.alive,
+                            "ready": worker.ready(), "inflight": worker.inflight, **health})
+        ready = any(worker.ready() for worker in self.workers)
+        return {"status": "healthy" if any(w.alive for w in self.workers) else "unhealthy",
+                "ready": ready, **totals, "workers": workers}
+
+    def aggregate_metrics(self):
+        """
+        合并各工作进程的 Prometheus 指标，为每个样本加上 worker 标签
+
+        同一指标的样本需要连续输出，因此先按指标分组再拼接。
+        """
+        families = {}  # 指标名 -> [HELP/TYPE 行, 样本行...]，按首次出现的顺序
+        for worker in self.workers:
+            if not worker.alive:
+                continue
+            try:
+                text = worker.session.get(worker.url + "/metrics", timeout=5).text
+            except requests.RequestException:
+                continue
+            family = None
+            for line in text.splitlines():
+                if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                    family = line.split(" ")[2]
+                    lines = families.setdefault(family, [])
+                    if line not in lines:
+                        lines.append(line)
+                    continue
+                if not line or family is None:
+                    continue
+                label = f'worker="{worker.index}"'
+                if "{" in line:
+                    line = line.replace("{", "{" + label + ",", 1)
+                else:
+                    name, value = line.split(" ", 1)
+                    line = f"{name}{{{label}}} {value}"
+                families[family].append(line)
+        return "\n".join(line for lines in families.values() for line in lines) + "\n"
+
+dispatcher = Dispatcher()
+
+@dispatcher_app.route("/v1/chat/completions", methods=["POST"])
+def dispatch_chat_completions():
+    """将聊天补全请求转发给负载最低的工作进程，流式响应逐块透传"""
+    body = request.get_data()
+    headers = {name: request.headers[name] for name in FORWARD_HEADERS if name in request.headers}
+    headers.setdefault("X-Request-ID", uuid.uuid4().hex)  # 工作进程沿用该编号，跨进程的日志可按编号关联
+    worker, response = dispatcher.forward(body, headers)
+    if worker is None:
+        return jsonify({"error": "No worker available"}), 503
+
+    def relay():
+        for chunk in response.iter_content(chunk_size=None):
+            yield chunk
+
+    result = Response(stream_with_context(relay()), status=response.status_code)
+    for name in RETURN_HEADERS:
+        if name in response.headers:
+            result.headers[name] = response.headers[name]
+
+    @result.call_on_close
+    def on_close():
+        response.close()  # 客户端断开时关闭到工作进程的连接，工作进程随之停止生成
+        dispatcher.done(worker)
+    return result
+
+@dispatcher_app.route("/v1/models", methods=["GET"])
+def dispatch_models():
+    """可用模型列表，由调度进程按配置直接返回"""
+    return jsonify(list_models())
+
+@dispatcher_app.route("/v1/models/<path:name>", methods=["GET"])
+def dispatch_model_detail(name):
+    """单个模型的描述，未配置的模型返回 404"""
+    if name not in CONFIG["models"]:
+        return jsonify({"error": f"Model {name} not found"}), 404
+    return jsonify(model_card(name))
+
+@dispatcher_app.route("/health", methods=["GET"])
+def dispatch_health():
+    """汇总健康检查接口，只读取各工作进程的状态快照"""
+    health = dispatcher.aggregate_health()
+    return jsonify(health), 200 if health["status"] == "healthy" else 500
+
+@dispatcher_app.route("/ready", methods=["GET"])
+def dispatch_ready():
+    """任一工作进程就绪即视为就绪"""
+    ready = any(worker.ready() for worker in dispatcher.workers)
+    body = {"ready": ready, "workers": [{"index": w.index, "ready": w.ready()} for w in dispatcher.workers]}
+    return jsonify(body), 200 if ready else 503
+
+@dispatcher_app.route("/admin/<path:path>", methods=["GET"])
+def dispatch_admin(path):
+    """将诊断接口转发给 worker 参数指定的工作进程（默认 0）"""
+    index = request.args.get("worker", 0, type=int)
+    if not 0 <= index < len(dispatcher.workers):
+        return jsonify({"error": "No such worker"}), 404
+    worker = dispatcher.workers[index]
+    headers = {name: request.headers[name] for name in FORWARD_HEADERS if name in request.headers}
+    try:
+        response = worker.session.get(f"{worker.url}/admin/{path}", params=request.args, headers=headers,
+                                      timeout=(5, None))
+    except requests.RequestException as e:
+        return jsonify({"error": f"Worker unavailable: {e}"}), 503
+    return Response(response.content, status=response.status_code,
+                    content_type=response.headers.get("Content-Type"))
+
+@dispatcher_app.route("/metrics", methods=["GET"])
+def dispatch_metrics():
+    """合并后的 Prometheus 监控指标接口"""
+    return Response(dispatcher.aggregate_metrics(), mimetype="text/plain; version=0.0.4")
+
+def run_dispatcher():
+    """启动工作进程并在前台运行调度服务，退出时结束所有本机工作进程"""
+    dispatcher.start()
+    try:
+        dispatcher_app.run(host=CONFIG["host"], port=CONFIG["port"], threaded=True)
+    finally:
+        dispatcher.stop()
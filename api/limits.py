@@ -0,0 +1,115 @@
+"""
+回复长度和停止序列限制：按请求的 max_tokens 和 stop 截断回复，达到限制时提前停止生成
+"""
+
+import json
+
+from utils.text import estimate_tokens, truncate_tokens
+
+MAX_STOP_SEQUENCES = 4  # 与 OpenAI 接口一致，最多 4 个停止序列
+
+
+class ReplyLimits:
+    """
+    一次请求的输出限制
+
+    页面本身不支持 max_tokens 和 stop，由服务在读取回复时检查：文本中出现停止序列时截断在其之前，
+    估算的 token 数超过 max_tokens 时截断到上限，之后调用方停止页面生成并立即归还浏览器。
+    """
+
+    def __init__(self, max_tokens=None, stop=()):
+        """
+        参数：
+            max_tokens: 回复的估算 token 上限，None 表示不限制
+            stop: 停止序列，空字符串会被忽略
+        """
+        self.max_tokens = max_tokens
+        self.stop = tuple(sequence for sequence in stop if sequence)
+
+    @classmethod
+    def from_request(cls, req):
+        """
+        从请求 JSON 中读取 max_tokens（或 max_completion_tokens）和 stop
+
+        参数：
+            req: 请求 JSON 字典
+
+        返回：
+            ReplyLimits 实例
+
+        异常：
+            ValueError: 参数类型或取值无效
+        """
+        max_tokens = req.get("max_completion_tokens", req.get("max_tokens"))
+        if max_tokens is not None and (isinstance(max_tokens, bool) or not isinstance(max_tokens, int)
+                                       or max_tokens < 1):
+            raise ValueError("max_tokens must be a positive integer")
+        stop = req.get("stop")
+        if stop is None:
+            stop = []
+        elif isinstance(stop, str):
+            stop = [stop]
+        elif not isinstance(stop, list) or not all(isinstance(sequence, str) for sequence in stop):
+            raise ValueError("stop must be a string or a list of strings")
+        if len(stop) > MAX_STOP_SEQUENCES:
+            raise ValueError(f"stop accepts at most {MAX_STOP_SEQUENCES} sequences")
+        return cls(max_tokens, stop)
+
+    def __bool__(self):
+        return bool(self.max_tokens or self.stop)
+
+    def signature(self):
+        """用于区分缓存键的限制描述，没有限制时为空字符串，缓存键与不带限制的请求一致"""
+        return json.dumps([self.max_tokens, sorted(self.stop)], ensure_ascii=False) if self else ""
+
+    def apply(self, text, done=False):
+        """
+        按限制处理当前回复文本
+
+        尚未完成时，末尾可能是停止序列开头的部分暂不输出，等后续文本确认后再输出或截断。
+
+        参数：
+            text: 当前完整回复文本
+            done: 回复是否已生成完成
+
+        返回：
+            (visible, finish_reason)：visible 为可以输出给客户端的文本；
+            finish_reason 为 "stop"（遇到停止序列或正常完成）或 "length"（达到 max_tokens），
+            回复应继续生成时为 None
+        """
+        if not self:
+            return text, "stop" if done else None
+        cut, reason = len(text), None
+        for sequence in self.stop:
+            index = text.find(sequence)
+            if index != -1 and index < cut:  # 截断在最早出现的停止序列之前
+                cut, reason = index, "stop"
+        if self.max_tokens:
+            limited = truncate_tokens(text[:cut], self.max_tokens)
+            if len(limited) < cut:
+                cut, reason = len(limited), "length"
+        if reason is not None:
+            return text[:cut], reason
+        if done:
+            return text, "stop"
+        hold = 0  # 末尾可能是停止序列开头的字符数
+        for sequence in self.stop:
+            for size in range(min(len(sequence) - 1, len(text)), hold, -1):
+                if text.endswith(sequence[:size]):
+                    hold = size
+                    break
+        return text[:len(text) - hold], None
+
+    def finish_reason(self, text):
+        """
+        推断已按本限制截断的回复（如缓存中的回复）的结束原因
+
+        参数：
+            text: 已截断的回复文本
+
+        返回：
+            估算 token 数达到 max_tokens 时为 "length"，否则为 "stop"
+        """
+        if self.max_tokens and estimate_tokens(text) >= self.max_tokens:
+            return "length"
+        return "stop"
@@ -0,0 +1,25 @@
+"""
+模型列表和模型名称解析，供单进程服务和调度进程共用
+"""
+
+from config import CONFIG
+
+def resolve_model(name):
+    """
+    将请求中的模型名称解析为 models 中配置的模型，未配置的名称（如 gpt-3.5-turbo）使用 default_model
+
+    参数：
+        name: 请求中的 model 字段
+
+    返回：
+        models 中的模型名称，浏览器按该名称分组
+    """
+    return name if isinstance(name, str) and name in CONFIG["models"] else CONFIG["default_model"]
+
+def model_card(name):
+    """OpenAI 格式的单个模型描述"""
+    return {"id": name, "object": "model", "created": 0, "owned_by": "qwen"}
+
+def list_models():
+    """OpenAI 格式的模型列表"""
+    return {"object": "list", "data": [model_card(name) for name in CONFIG["models"]]}
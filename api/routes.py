@@ -2,23 +2,248 @@
 API路由定义模块，包含所有API接口路由
 """
 
-import json
+import hmac
+import itertools
+import re
 import uuid
-import threading
 import psutil
-from time import sleep, time as current_time
-from flask import request, Response, jsonify
-from selenium.webdriver.common.by import By
+from urllib.parse import urlparse
+from time import time as current_time
+from flask import request, Response, jsonify, g
 
-from config import CONFIG, MAX_QUEUE_SIZE, MAX_WAIT_TIME, logger
-from utils.text import merge_messages
+from config import CONFIG, logger, on_config_change, patch_config, reload_config, pending_restart, last_reload
+from utils.logs import REQUEST_ID
+from utils.profiler import ProfilerBusyError, sample_stacks, top_functions
+from utils.recorder import CURRENT_TIMELINE, FlightRecorder, mark, phase, record_phase
+from utils.text import merge_messages, estimate_tokens, trim_messages
+from utils.metrics import (Gauge, OUTPUT_CHARS_PER_SECOND, REQUESTS, BROWSER_REQUESTS, ABANDONED, REPLAYS,
+                           REPLY_SOURCE, DIRECT_REQUESTS, render as render_metrics)
 from browser import browser_pool
-from browser.actions import new_chat, clear_auto_greeting, send_message, get_response_non_stream
+from browser.actions import new_chat, open_chat, clear_auto_greeting, send_message, stop_generation
+from browser.stream import ResponseStream
 from api import app
+from api.admission import AdmissionController, QueueFullError, QueueTimeoutError
+from api.cache import ResponseCache
+from api.direct import DirectTransport, DirectUnavailable
+from api.limits import ReplyLimits
+from api.affinity import ConversationAffinity
+from api.models import list_models, model_card, resolve_model
+from api.sse import ChunkEncoder, DeltaTracker
 
-# 初始化请求队列和队列锁
-request_queue = []  # 初始化请求队列，用于存放请求的唯一 ID
-queue_lock = threading.Lock()  # 创建线程锁，确保对请求队列操作时的线程安全
+# 初始化请求准入控制器，队列等待与浏览器槽位绑定
+admission = AdmissionController(browser_pool, CONFIG["max_queue_size"], CONFIG["max_wait_time"])
+# 初始化回复缓存，相同模型和消息的请求直接返回缓存结果
+response_cache = ResponseCache(CONFIG["cache_max_entries"], CONFIG["cache_ttl"])
+# 初始化对话亲和表，多轮对话在原对话中只发送新增消息
+conversation_affinity = ConversationAffinity(CONFIG["affinity_max_entries"], CONFIG["affinity_ttl"])
+
+# 直连后端的传输层，开启 direct_transport 时请求不经过浏览器
+direct_transport = DirectTransport(browser_pool)
+
+# 慢请求飞行记录仪，保留最近请求的逐阶段时间线
+flight_recorder = FlightRecorder(CONFIG["recorder_capacity"])
+
+def apply_service_config(changed):
+    """配置热加载后，将新的队列、缓存、对话亲和和记录仪容量应用到已创建的对象"""
+    admission.max_queue_size = CONFIG["max_queue_size"]
+    admission.max_wait_time = CONFIG["max_wait_time"]
+    response_cache.max_entries = CONFIG["cache_max_entries"]
+    response_cache.ttl = CONFIG["cache_ttl"]
+    conversation_affinity.max_entries = CONFIG["affinity_max_entries"]
+    conversation_affinity.ttl = CONFIG["affinity_ttl"]
+    if "recorder_capacity" in changed:
+        flight_recorder.resize(CONFIG["recorder_capacity"])
+    if "direct_max_concurrency" in changed:
+        direct_transport.mount()
+
+on_config_change(apply_service_config)
+
+# 浏览器池和队列的仪表指标，抓取时只读取无锁快照
+Gauge("qwen_pool_browsers", "Pooled browser tabs by state", ["state"],
+      callback=lambda: {(state,): browser_pool.stats[state] for state in ("idle", "busy", "starting")})
+Gauge("qwen_model_browsers", "Pooled browser tabs pinned to each model by state", ["model", "state"],
+      callback=lambda: {(model, state): count for model, counts in browser_pool.stats["models"].items()
+                        for state, count in counts.items()})
+Gauge("qwen_browser_processes", "Running Chrome processes",
+      callback=lambda: {(): browser_pool.stats["processes"]})
+Gauge("qwen_queue_length", "Requests waiting for a browser",
+      callback=lambda: {(): admission.queue_length()})
+Gauge("qwen_chrome_rss_bytes", "Resident memory of each Chrome process tree", ["process"],
+      callback=lambda: {(process_id,): rss for process_id, rss in browser_pool.process_rss.items()})
+Gauge("qwen_browser_js_heap_bytes", "Used JS heap of each pooled browser tab after its last memory maintenance",
+      ["browser"], callback=lambda: {(browser_id,): heap for browser_id, heap in browser_pool.js_heap.items()})
+
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")  # 接受的外部请求编号格式
+
+@app.before_request
+def assign_request_id():
+    """为每个请求分配编号：沿用合法的 X-Request-ID 请求头（如调度进程转发时带上的），否则新生成"""
+    incoming = request.headers.get("X-Request-ID", "")
+    g.request_id = incoming if REQUEST_ID_PATTERN.fullmatch(incoming) else uuid.uuid4().hex
+    REQUEST_ID.set(g.request_id)  # 本线程此后的日志都带上该编号
+
+@app.after_request
+def return_request_id(response):
+    """在响应头中返回请求编号，便于按编号检索日志"""
+    if "request_id" in g:
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
+def build_usage(prompt_text, response_text):
+    """按估算的 token 数构造 usage 字典"""
+    prompt_tokens = estimate_tokens(prompt_text)
+    completion_tokens = estimate_tokens(response_text)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+def build_completion(chat_id, created_ts, model, response_text, usage, finish_reason="stop"):
+    """构造非流式响应的完整 JSON 对象"""
+    return {
+        "id": chat_id,
+        "object": "chat.completion",
+        "created": created_ts,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": response_text},
+            "finish_reason": finish_reason
+        }],
+        "usage": usage
+    }
+
+def cached_response(chat_id, created_ts, model, merged_message, response_text, stream, include_usage,
+                    finish_reason="stop"):
+    """
+    使用已有的回复文本直接构造响应，不占用浏览器
+
+    流式请求按正常格式输出角色、内容和结束 chunk。
+    """
+    usage = build_usage(merged_message, response_text)
+    if not stream:
+        return jsonify(build_completion(chat_id, created_ts, model, response_text, usage, finish_reason))
+
+    encoder = ChunkEncoder(chat_id, created_ts, model)
+    def generate():
+        yield encoder.role()
+        if response_text:
+            yield encoder.content(response_text)
+        yield encoder.finish(finish_reason)
+        if include_usage:
+            yield encoder.usage(usage)
+        yield encoder.done()
+    return Response(generate(), mimetype="text/event-stream")
+
+def start_reply(browser, merged_message, continuation=None):
+    """
+    在浏览器中发送消息并开始生成回复
+
+    命中对话亲和时只在原对话中发送新增消息，打开原对话失败则退回新建对话发送完整消息。
+    浏览器归还时已预先打开空白新对话的，直接发送消息。
+
+    参数：
+        browser: PooledBrowser 实例
+        merged_message: 合并后的完整消息文本
+        continuation: 可继续的对话，为 None 时新建对话
+
+    返回：
+        已安装回复监听的 ResponseStream
+    """
+    driver, wait = browser.driver, browser.wait
+    response_stream = ResponseStream(browser)
+    staged, browser.staged = browser.staged, False  # 本次发送后页面不再是空白对话
+    browser.keep_chat = False  # 本次回复记录到对话亲和表后才保留对话页面
+    checkout_start = current_time()
+    with browser.activate():  # 整个发送阶段独占所属进程的活动窗口
+        record_phase("browser_checkout", checkout_start, current_time() - checkout_start, browser=browser.id)
+        if continuation is not None:
+            try:
+                with phase("open_chat"):
+                    open_chat(driver, wait, continuation.chat_url, continuation.replies)  # 打开上一轮所在的对话
+                response_stream.install()  # 发送前在页面中安装回复监听
+                with phase("send_message"):
+                    send_message(driver, wait, continuation.message, browser.elements)  # 只发送新增的消息
+                return response_stream
+            except Exception as e:
+                logger.warning(f"继续对话失败，改为新建对话: {e}")
+                staged = False
+        if not staged:  # 归还时未能预先打开新对话（或刚被调配给其他模型），在此新建
+            with phase("new_chat"):
+                new_chat(driver, wait)  # 创建新对话
+            with phase("select_model"):
+                browser.select_model()  # 确认页面选中浏览器固定的模型
+            with phase("clear_auto_greeting"):
+                clear_auto_greeting(driver, wait)  # 清除自动问候消息
+        response_stream.install()  # 发送前在页面中安装回复监听
+        with phase("send_message"):
+            send_message(driver, wait, merged_message, browser.elements)  # 发送合并后的消息
+    return response_stream
+
+def cancel_reply(browser):
+    """
+    停止页面中仍在生成的回复，等待页面回到空闲状态后才允许归还浏览器
+
+    页面无法回到空闲状态时标记浏览器异常，归还时回收重建，避免下一个请求拿到仍在生成的页面。
+
+    参数：
+        browser: PooledBrowser 实例
+    """
+    try:
+        with phase("cancel"):
+            with browser.activate():
+                if stop_generation(browser.driver, browser.wait):
+                    logger.info(f"浏览器 {browser.id} 已停止生成")
+    except Exception as e:
+        logger.warning(f"浏览器 {browser.id} 停止生成失败: {e}")
+        browser.broken = True
+
+def open_direct(model, merged_message):
+    """
+    通过直连后端开始生成回复，读到首段文本后返回；此前的任何失败都改走浏览器，客户端不会察觉
+
+    参数：
+        model: models 中的模型名称
+        merged_message: 合并后的完整消息文本
+
+    返回：
+        (reply, items)：reply 为 DirectReply，items 为从首段文本开始的 (文本, 是否完成) 迭代器；
+        直连不可用或失败时返回 None
+    """
+    try:
+        with phase("direct_connect"):
+            reply = direct_transport.open(model, merged_message)
+        items = iter(reply)
+        first = next(items)
+        if first == ("", True):
+            raise Exception("响应内容为空")
+    except DirectUnavailable as e:
+        DIRECT_REQUESTS.inc(result=e.reason)
+        mark("direct_fallback", reason=e.reason)
+        if e.reason not in ("no_credentials", "busy"):
+            logger.warning(f"直连后端不可用，改走浏览器: {e}")
+        return None
+    except Exception as e:
+        DIRECT_REQUESTS.inc(result="error")
+        mark("direct_fallback", reason="error", error=str(e))
+        logger.warning(f"直连后端失败，改走浏览器: {e}")
+        return None
+    return reply, itertools.chain([first], items)
+
+def observe_reply(response_stream, start_time, response_text):
+    """记录一次完成回复的首字延迟、生成耗时、输出速度和读取来源"""
+    if response_stream.source is not None:
+        REPLY_SOURCE.inc(source=response_stream.source)
+    if response_stream.first_text_at is not None:
+        record_phase("first_token", start_time, response_stream.first_text_at - start_time)
+    if response_stream.finished_at is not None and response_stream.installed_at is not None:
+        record_phase("generation", response_stream.installed_at,
+                     response_stream.finished_at - response_stream.installed_at, source=response_stream.source)
+        if response_stream.first_text_at is not None:
+            elapsed = response_stream.finished_at - response_stream.first_text_at
+            if elapsed > 0:
+                OUTPUT_CHARS_PER_SECOND.observe(len(response_text) / elapsed)
 
 @app.route("/v1/chat/completions", methods=["POST"])
 def chat_completions():
@@ -28,168 +253,510 @@ def chat_completions():
     接收 JSON 格式请求，处理消息并返回聊天响应。
     支持流式响应和非流式响应。
     """
-    start_time = current_time()
-    my_id = uuid.uuid4().hex
-    
-    # 等待队列处理
-    while True:
-        with queue_lock:
-            if len(request_queue) >= MAX_QUEUE_SIZE:
-                if current_time() - start_time > MAX_WAIT_TIME:
-                    logger.warning(f"请求 {my_id} 等待超时")
-                    return jsonify({"error": "Request timeout in queue"}), 408
-                sleep(0.1)
-                continue
-            request_queue.append(my_id)
-            break
-    
+    my_id = g.request_id
+    timeline = flight_recorder.start(my_id)  # 本线程此后的阶段和重试事件都写入该时间线
+    start_time = timeline.started_at
+
+    def outcome(name):
+        """记录请求结果"""
+        REQUESTS.inc(outcome=name)
+        timeline.outcome = name
+
+    # 解析并校验请求参数；客户端传入的内容无法解析时返回 400，并结束本请求的时间线
     try:
-        req = request.get_json(force=True)  # 强制解析请求 JSON 数据
+        req = request.get_json(force=True, silent=True)  # 强制解析请求 JSON 数据，无法解析时为 None
+        if not isinstance(req, dict):
+            raise ValueError("Request body must be a JSON object")
         model = req.get("model", "gpt-3.5-turbo")  # 获取模型名称，默认 "gpt-3.5-turbo"
+        target_model = resolve_model(model)  # 实际使用的模型，未配置的名称使用 default_model
         messages = req.get("messages", [])  # 获取消息列表
         stream = req.get("stream", False)  # 获取是否使用流式响应
 
         _ = req.get("temperature")  # 获取温度参数（未使用）
         _ = req.get("top_p")  # 获取 top_p 参数（未使用）
-        _ = req.get("stream_options")  # 获取流选项（未使用）
+        stream_options = req.get("stream_options") or {}  # 获取流选项
+        if not isinstance(stream_options, dict):
+            raise ValueError("stream_options must be an object")
+        include_usage = bool(stream and stream_options.get("include_usage"))  # 流式响应末尾是否附带用量 chunk
+        limits = ReplyLimits.from_request(req)  # max_tokens 和 stop：达到限制时截断回复并提前停止生成
 
         _ = request.headers.get("apikey", "")  # 获取请求头中的 API key（未使用）
         _ = request.args.get("base_url", "")  # 获取查询参数 base_url（未使用）
 
-        merged_message = merge_messages(messages)  # 合并消息列表，构造待发送文本
-        if not merged_message:  # 如果合并后的文本为空
-            return jsonify({"error": "No valid content in messages"}), 400  # 返回错误和 400 状态码
+        # 按上下文预算裁剪较早的对话后合并消息列表，构造待发送文本
+        merged_message = merge_messages(trim_messages(messages, CONFIG["context_max_tokens"]))
+    except Exception as e:
+        outcome("bad_request")
+        flight_recorder.finish(timeline)
+        return jsonify({"error": str(e) if isinstance(e, ValueError) else f"Invalid request: {e}"}), 400
+    if not merged_message:  # 如果合并后的文本为空
+        outcome("bad_request")
+        flight_recorder.finish(timeline)
+        return jsonify({"error": "No valid content in messages"}), 400  # 返回错误和 400 状态码
+
+    chat_id = "chatcmpl-" + uuid.uuid4().hex  # 生成聊天会话 ID
+    created_ts = int(current_time())  # 获取当前时间戳
+
+    # 查询回复缓存；相同请求正在处理时等待其结果，而不是再占用一个浏览器
+    cache_key = None
+    flight = None
+    if CONFIG["cache_enabled"] and "no-cache" not in request.headers.get("Cache-Control", ""):
+        cache_key = ResponseCache.make_key(target_model, merged_message, limits.signature())
+        cached_text = response_cache.get(cache_key)
+        if cached_text is None:
+            flight, leader = response_cache.join(cache_key)
+            if not leader:
+                with phase("cache_wait"):
+                    cached_text = flight.wait(CONFIG["max_wait_time"] + CONFIG["generation_timeout"])
+                flight = None  # 领头请求失败时本请求自行处理，不再参与合并
+        if cached_text is not None:
+            outcome("cached")
+            flight_recorder.finish(timeline)
+            return cached_response(chat_id, created_ts, model, merged_message, cached_text, stream, include_usage,
+                                   limits.finish_reason(cached_text))
 
-        chat_id = "chatcmpl-" + uuid.uuid4().hex  # 生成聊天会话 ID
-        created_ts = int(current_time())  # 获取当前时间戳
-        
-        # 从浏览器池中获取一个浏览器实例
-        driver, wait = browser_pool.get_browser()
-        
+    def settle(response_text=None, error=None):
+        """结束本请求发起的合并请求，成功时写入缓存，可重复调用"""
+        nonlocal flight
+        if flight is not None:
+            response_cache.finish(cache_key, flight, response_text, error)
+            flight = None
+
+    # 直连后端：不占用浏览器，读到首段文本前失败则继续走下面的浏览器流程
+    direct = open_direct(target_model, merged_message) if CONFIG["direct_transport"] else None
+    if direct is not None and not stream:
+        reply, items = direct
+        try:
+            response_text = ""
+            for current_text, done in items:  # 等待回复生成完成或达到输出限制，取最终文本
+                response_text, finish_reason = limits.apply(current_text, done)
+                if finish_reason:
+                    break
+            reply.close()  # 达到限制时关闭连接，后端随之停止生成
+        except Exception as e:
+            DIRECT_REQUESTS.inc(result="error")
+            timeline.mark("direct_fallback", reason="error", error=str(e))
+            logger.warning(f"直连后端读取回复失败，改走浏览器: {e}")
+            direct = None  # 客户端尚未收到内容，改走浏览器重新生成
+        else:
+            DIRECT_REQUESTS.inc(result="ok")
+            settle(response_text)
+            observe_reply(reply, start_time, response_text)
+            outcome("ok")
+            flight_recorder.finish(timeline)
+            usage = build_usage(merged_message, response_text)
+            return jsonify(build_completion(chat_id, created_ts, model, response_text, usage, finish_reason))
+    if direct is not None:
+        reply, items = direct
+        encoder = ChunkEncoder(chat_id, created_ts, model)
+        direct_state = {"completed": False, "failed": False}
+
+        def generate_direct():
+            """流式输出直连后端的回复，首段文本已读到，此后的失败只能中止响应"""
+            REQUEST_ID.set(my_id)  # WSGI 服务器可能在其他上下文中迭代响应
+            CURRENT_TIMELINE.set(timeline)
+            yield encoder.role()
+            try:
+                tracker = DeltaTracker()
+                for current_text, done in items:
+                    visible, finish_reason = limits.apply(current_text, done)
+                    delta = tracker.update(visible)
+                    if delta:
+                        yield encoder.content(delta)
+                    if finish_reason:
+                        reply.close()  # 达到限制时关闭连接，后端随之停止生成
+                        direct_state["completed"] = True
+                        response_text = tracker.sent_text
+                        DIRECT_REQUESTS.inc(result="ok")
+                        settle(response_text)
+                        observe_reply(reply, start_time, response_text)
+                        outcome("ok")
+                        yield encoder.finish(finish_reason)
+                        if include_usage:
+                            yield encoder.usage(build_usage(merged_message, response_text))
+                        yield encoder.done()
+                        break
+            except Exception as e:
+                direct_state["failed"] = True
+                DIRECT_REQUESTS.inc(result="error")
+                settle(error=e)
+                outcome("error")
+                timeline.mark("error", error=str(e))
+                logger.error(f"请求 {my_id} 直连流式响应失败: {e}")
+                raise
+
+        response = Response(generate_direct(), mimetype="text/event-stream")
+        @response.call_on_close
+        def on_close_direct():
+            if not direct_state["completed"]:
+                settle(error=Exception("stream closed before completion"))
+                if not direct_state["failed"]:  # 客户端提前断开
+                    outcome("abandoned")
+                    ABANDONED.inc(stage="generating")
+                    logger.info(f"请求 {my_id} 的客户端已断开")
+            reply.close()  # 关闭后端连接，后端随之停止生成
+            flight_recorder.finish(timeline)
+        return response
+
+    # 查找可继续的多轮对话，优先领取上一轮所在的浏览器
+    continuation = None
+    if CONFIG["affinity_enabled"]:
+        continuation = conversation_affinity.lookup(target_model, messages)
+
+    # 排队领取固定服务该模型的浏览器，队列已满立即返回 429，超过截止时间返回 408
+    try:
+        prefer = continuation.browser_id if continuation is not None else None
+        browser = admission.acquire(admission.deadline_for(start_time), prefer, model=target_model)
+    except QueueFullError as e:
+        settle(error=e)
+        outcome("rejected")
+        flight_recorder.finish(timeline)
+        logger.warning(f"请求 {my_id} 被拒绝，队列已满")
+        response = jsonify({"error": "Request queue is full"})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+    except QueueTimeoutError as e:
+        settle(error=e)
+        outcome("queue_timeout")
+        flight_recorder.finish(timeline)
+        logger.warning(f"请求 {my_id} 等待超时")
+        return jsonify({"error": "Request timeout in queue"}), 408
+
+    checkout_time = current_time()  # 记录领取浏览器的时间，用于统计服务时长
+    record_phase("queue_wait", start_time, checkout_time - start_time, browser=browser.id, model=target_model)
+    BROWSER_REQUESTS.inc(browser=browser.id)
+    timeline.browsers.append(browser.id)
+    handed_off = False  # 浏览器是否已交由流式响应负责归还
+    sending = False  # 流式响应是否已开始发送消息
+    completed = False  # 流式响应是否已完整发送
+    failed = False  # 流式响应是否因异常中止
+    truncated = False  # 回复是否因达到输出限制而提前结束，页面可能仍在生成
+    replays = 0  # 已换浏览器重放的次数
+
+    def remember(response_text, response_stream):
+        """记录本轮回复所在的对话，供下一轮请求继续"""
+        if not CONFIG["affinity_enabled"]:
+            return
+        try:
+            with browser.activate():
+                chat_url = browser.driver.current_url
+            if not urlparse(chat_url).path.strip("/"):  # 仍在首页说明没有独立的对话地址，无法继续
+                return
+            # 对话中已有的回复加上本次回复；记录后归还时不预先新建对话，下一轮请求可直接继续该对话
+            browser.keep_chat = conversation_affinity.record(target_model, messages, response_text, chat_url,
+                                                             browser.id, response_stream.baseline + 1)
+        except Exception as e:
+            logger.warning(f"记录对话亲和失败: {e}")
+
+    def release():
+        """归还浏览器并输出队列状态，可重复调用"""
+        nonlocal browser
+        if browser is None:
+            return
+        admission.release(browser, current_time() - checkout_time)
+        timeline.mark("release", browser=browser.id)
+        browser = None
+        logger.info(f"请求 {my_id} 已处理完成，当前队列长度：{admission.queue_length()}")
+
+    def replay(error, allowed=True):
+        """
+        本次尝试失败：上报熔断器；客户端尚未收到内容时停止页面生成并归还浏览器，
+        再领取另一个浏览器重放整个请求，而不是在出错的浏览器上重复同一步骤
+
+        参数：
+            error: 本次尝试的异常
+            allowed: 是否允许重放，客户端已收到部分内容时为 False
+
+        返回：
+            是否已领取到新的浏览器；不允许重放、次数用尽或排队失败时返回 False，调用方按失败处理
+        """
+        nonlocal browser, checkout_time, replays
+        kind = browser_pool.report_failure(browser, error)
+        if not allowed or replays >= CONFIG["request_replays"]:
+            return False
+        replays += 1
+        failed_id = browser.id
+        if kind != "session":
+            cancel_reply(browser)  # 页面可能仍在生成，停止后再归还
+        release()
+        logger.warning(f"请求 {my_id} 在浏览器 {failed_id} 上失败（{kind}），换浏览器重放: {error}")
+        REPLAYS.inc(kind=kind)
+        timeline.mark("replay", kind=kind, browser=failed_id)
+        try:
+            browser = admission.acquire(admission.deadline_for(current_time()), exclude=(failed_id,),
+                                        model=target_model)
+        except (QueueFullError, QueueTimeoutError):
+            return False
+        checkout_time = current_time()
+        BROWSER_REQUESTS.inc(browser=browser.id)
+        timeline.browsers.append(browser.id)
+        return True
+
+    try:
         if stream:  # 如果请求流式响应
+            encoder = ChunkEncoder(chat_id, created_ts, model)  # 信封前后缀只序列化一次
+
             def generate():
                 """
                 生成器函数，用于流式发送响应数据
                 """
-                first_chunk = {
-                    "id": chat_id,
-                    "object": "chat.completion.chunk",
-                    "created": created_ts,
-                    "model": model,
-                    "choices": [{
-                        "delta": {"role": "assistant"},
-                        "index": 0,
-                        "finish_reason": None
-                    }]
-                }
+                nonlocal sending, completed, failed, truncated
+                REQUEST_ID.set(my_id)  # WSGI 服务器可能在其他上下文中迭代响应
+                CURRENT_TIMELINE.set(timeline)
                 # 发送首个 chunk，标记角色为 assistant
-                yield "data: " + json.dumps(first_chunk) + "\n\n"
+                yield encoder.role()
+
+                sending = True  # 此后页面可能已开始生成，提前断开时需要停止生成
+                try:
+                    tracker = DeltaTracker()  # 计算相对客户端已收到内容的增量，兼容页面改写前文
+                    while not completed:
+                        try:
+                            response_stream = start_reply(browser, merged_message, continuation)
+                            for current_text, done in response_stream:  # 页面内容变化（经页面内合并）时返回
+                                visible, finish_reason = limits.apply(current_text, done)  # 按 max_tokens 和 stop 截断
+                                delta = tracker.update(visible)
+                                if delta:
+                                    yield encoder.content(delta)  # 发送新增部分的响应 chunk
+
+                                if finish_reason:  # 发送按钮恢复禁用状态（响应结束）或达到输出限制
+                                    completed = True
+                                    truncated = not done  # 页面仍在生成，响应关闭后停止生成再归还
+                                    browser_pool.report_success(browser)
+                                    response_text = tracker.sent_text  # 以客户端实际收到的内容为准
+                                    settle(response_text)  # 写入缓存并唤醒等待相同请求的调用方
+                                    if truncated:
+                                        timeline.mark("truncated", finish_reason=finish_reason)
+                                    else:
+                                        remember(response_text, response_stream)  # 截断的回复与页面中的对话不一致，不继续该对话
+                                    observe_reply(response_stream, start_time, response_text)
+                                    outcome("ok")
+                                    yield encoder.finish(finish_reason)  # 发送结束标识的 chunk
+                                    if include_usage:
+                                        yield encoder.usage(build_usage(merged_message, response_text))
+                                    yield encoder.done()  # 发送结束标识
+                                    break
+                        except Exception as e:
+                            if not replay(e, allowed=not tracker.sent_text):  # 已输出部分内容时无法重放
+                                raise
+                except Exception as e:
+                    failed = True
+                    settle(error=e)
+                    outcome("error")
+                    timeline.mark("error", error=str(e))
+                    logger.error(f"请求 {my_id} 流式响应失败: {e}")
+                    raise
 
-                new_chat(driver, wait)  # 创建新对话
-                clear_auto_greeting(driver, wait)  # 清除自动问候消息
-                send_message(driver, wait, merged_message)  # 发送合并后的消息
-
-                last_text = ""  # 初始化记录上一次响应文本为空
-                while True:
-                    # 查找所有响应内容容器
-                    responses = driver.find_elements(By.CSS_SELECTOR, "div#response-content-container")
-                    if not responses:  # 如果未找到响应内容
-                        sleep(CONFIG["poll_interval"])  # 等待轮询间隔后继续
-                        continue
-                    latest_response = responses[-1]  # 获取最新的响应容器
-                    paragraphs = latest_response.find_elements(By.TAG_NAME, "p")  # 查找段落元素
-                    current_text = "\n".join(p.text for p in paragraphs if p.text)  # 拼接当前响应文本
-                    if current_text != last_text:  # 如果响应内容更新
-                        new_text = current_text[len(last_text):]  # 提取新增部分
-                        chunk = {
-                            "id": chat_id,
-                            "object": "chat.completion.chunk",
-                            "created": created_ts,
-                            "model": model,
-                            "choices": [{
-                                "delta": {"content": new_text},
-                                "index": 0,
-                                "finish_reason": None
-                            }]
-                        }
-                        yield "data: " + json.dumps(chunk) + "\n\n"  # 发送新增部分的响应 chunk
-                        last_text = current_text  # 更新记录的响应文本
-
-                    # 检查发送按钮是否处于禁用状态（响应结束标志）
-                    send_button = driver.find_elements(
-                        By.XPATH,
-                        "//button[@id='send-message-button' and @disabled and contains(@class, 'disabled')]"
-                    )
-                    if send_button:  # 如果找到禁用状态的发送按钮
-                        final_chunk = {
-                            "id": chat_id,
-                            "object": "chat.completion.chunk",
-                            "created": created_ts,
-                            "model": model,
-                            "choices": [{
-                                "delta": {},
-                                "index": 0,
-                                "finish_reason": "stop"
-                            }]
-                        }
-                        yield "data: " + json.dumps(final_chunk) + "\n\n"  # 发送结束标识的 chunk
-                        yield "data: [DONE]\n\n"  # 发送结束标识
-                        break  # 跳出循环，结束流式响应
-                    sleep(CONFIG["poll_interval"])  # 等待一段时间后继续轮询
-            
             response = Response(generate(), mimetype="text/event-stream")  # 构造流式响应
             @response.call_on_close  # 注册响应关闭时的回调函数
             def on_close():
-                browser_pool.return_browser(driver, wait)  # 将浏览器实例归还到池中
+                if not completed:
+                    settle(error=Exception("stream closed before completion"))  # 未完成即断开时不写缓存
+                    if not failed:  # 客户端提前断开
+                        outcome("abandoned")
+                        ABANDONED.inc(stage="generating" if sending else "before_send")
+                        logger.info(f"请求 {my_id} 的客户端已断开")
+                    if sending and browser is not None:
+                        cancel_reply(browser)  # 停止生成并等待页面空闲后再归还
+                elif truncated and browser is not None:
+                    cancel_reply(browser)  # 回复已按输出限制截断，停止页面中仍在进行的生成
+                release()  # 将浏览器实例归还到池中
+                flight_recorder.finish(timeline)
+            handed_off = True
             return response  # 返回流式响应
         else:
             # 非流式响应处理流程
-            new_chat(driver, wait)  # 创建新对话
-            clear_auto_greeting(driver, wait)  # 清除自动问候消息
-            send_message(driver, wait, merged_message)  # 发送合并后的消息
-            response_text = get_response_non_stream(driver, wait)  # 获取完整响应文本
-            full_response = {
-                "id": chat_id,
-                "object": "chat.completion",
-                "created": created_ts,
-                "model": model,
-                "choices": [{
-                    "index": 0,
-                    "message": {"role": "assistant", "content": response_text},
-                    "finish_reason": "stop"
-                }],
-                "usage": {
-                    "prompt_tokens": 0,
-                    "completion_tokens": 0,
-                    "total_tokens": 0
-                }
-            }
-            browser_pool.return_browser(driver, wait)  # 将浏览器实例归还到池中
-            return jsonify(full_response)  # 返回完整的响应 JSON
+            while True:
+                try:
+                    response_stream = start_reply(browser, merged_message, continuation)  # 安装回复监听并发送消息
+                    page_text = response_text = ""
+                    for page_text, done in response_stream:  # 等待回复生成完成或达到输出限制，取最终文本
+                        response_text, finish_reason = limits.apply(page_text, done)
+                        if finish_reason:
+                            truncated = not done
+                            break
+                    if not page_text:  # 页面回复为空；回复以停止序列开头时截断后的文本可以为空
+                        raise Exception("响应内容为空")
+                    break
+                except Exception as e:
+                    if not replay(e):
+                        raise
+            browser_pool.report_success(browser)
+            settle(response_text)  # 写入缓存并唤醒等待相同请求的调用方
+            if not truncated:
+                remember(response_text, response_stream)
+            observe_reply(response_stream, start_time, response_text)
+            outcome("ok")
+            usage = build_usage(merged_message, response_text)
+            response = jsonify(build_completion(chat_id, created_ts, model, response_text, usage, finish_reason))
+            if truncated:  # 先返回截断的回复，响应关闭后再停止页面生成并归还浏览器
+                timeline.mark("truncated", finish_reason=finish_reason)
+                @response.call_on_close
+                def on_close_truncated():
+                    cancel_reply(browser)
+                    release()
+                    flight_recorder.finish(timeline)
+                handed_off = True
+            return response  # 返回完整的响应 JSON
     except Exception as e:
+        settle(error=e)
+        outcome("error")
+        timeline.mark("error", error=str(e))
+        if browser is not None:
+            cancel_reply(browser)  # 页面可能仍在生成（如等待超时），停止后再归还
         return jsonify({"error": str(e)}), 500  # 捕获异常并返回 500 状态码及错误信息
     finally:
-        # 请求处理完成后，从队列中移除当前请求，并输出队列状态
-        with queue_lock:
-            if request_queue and request_queue[0] == my_id:
-                request_queue.pop(0)  # 移除队首请求
-            print(f"请求 {my_id} 已处理完成，当前队列长度：{len(request_queue)}")
+        # 非流式请求或出错时在此归还浏览器，流式请求在响应关闭时归还
+        if not handed_off:
+            release()
+            flight_recorder.finish(timeline)
+
+@app.route("/v1/models", methods=["GET"])
+def models():
+    """可用模型列表，即 models 中配置的模型"""
+    return jsonify(list_models())
+
+@app.route("/v1/models/<path:name>", methods=["GET"])
+def model_detail(name):
+    """单个模型的描述，未配置的模型返回 404"""
+    if name not in CONFIG["models"]:
+        return jsonify({"error": f"Model {name} not found"}), 404
+    return jsonify(model_card(name))
 
 @app.route("/health", methods=["GET"])
 def health_check():
-    """健康检查接口"""
+    """健康检查接口，只读取浏览器池的状态快照，不占用池锁"""
     try:
-        # 检查浏览器池状态
-        with browser_pool.lock:
-            active_browsers = len(browser_pool.pool)
-            queue_length = len(request_queue)
-        
+        stats = browser_pool.stats  # 读取浏览器池状态快照
         return jsonify({
             "status": "healthy",
-            "active_browsers": active_browsers,
-            "queue_length": queue_length,
-            "memory_usage": psutil.Process().memory_info().rss / 1024 / 1024  # MB
+            "ready": stats["ready"],
+            "active_browsers": stats["total"],
+            "idle_browsers": stats["idle"],
+            "browser_processes": stats["processes"],
+            "models": stats["models"],  # 各模型的空闲、使用中和启动中实例数
+            "direct_active": direct_transport.active,  # 进行中的直连请求数
+            "direct_credentials_age": direct_transport.credentials_age(),  # 直连凭据的年龄（秒），尚无凭据时为 null
+            "queue_length": admission.queue_length(),
+            "cache_entries": len(response_cache.entries),
+            "memory_usage": psutil.Process().memory_info().rss / 1024 / 1024,  # MB
+            "chrome_memory_usage": sum(browser_pool.process_rss.values()) / 1024 / 1024,  # 所有 Chrome 进程树，MB
+            "js_heap_usage": sum(browser_pool.js_heap.values()) / 1024 / 1024  # 所有标签页的 JS 堆，MB
         })
     except Exception as e:
         logger.error(f"健康检查失败: {e}")
-        return jsonify({"status": "unhealthy", "error": str(e)}), 500 
\ No newline at end of file
+        return jsonify({"status": "unhealthy", "error": str(e)}), 500
+
+@app.route("/ready", methods=["GET"])
+def readiness_check():
+    """就绪检查接口，已预热的可用浏览器达到 ready_min_browsers 前返回 503"""
+    stats = browser_pool.stats  # 读取浏览器池状态快照
+    body = {
+        "ready": stats["ready"],
+        "browsers": stats["total"],
+        "starting": stats["starting"],
+        "required": browser_pool.ready_target(),
+    }
+    return jsonify(body), 200 if stats["ready"] else 503
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus 监控指标接口"""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+PROFILE_MAX_SECONDS = 60  # 单次采样分析的最长时间（秒）
+
+def admin_denied(mutating=False):
+    """
+    配置了 admin_token 时校验请求头 Authorization: Bearer <token>，不通过时返回 401 响应
+
+    参数：
+        mutating: 是否为修改服务状态的请求；未配置 admin_token 时一律拒绝，只允许只读查询
+
+    返回：
+        拒绝时的响应，允许时返回 None
+    """
+    token = CONFIG["admin_token"]
+    if not token:
+        if mutating:
+            return jsonify({"error": "Set admin_token to enable this endpoint"}), 403
+        return None
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if hmac.compare_digest(supplied.encode("utf-8"), token.encode("utf-8")):
+        return None
+    return jsonify({"error": "Unauthorized"}), 401
+
+@app.route("/admin/timelines", methods=["GET"])
+def slowest_timelines():
+    """
+    返回最近请求中耗时最长的若干条时间线
+
+    查询参数：
+        n: 返回的条数，默认 10
+        active: 为 0 时不包含仍在进行中的请求
+    """
+    denied = admin_denied()
+    if denied:
+        return denied
+    count = request.args.get("n", 10, type=int)
+    include_active = request.args.get("active", "1") != "0"
+    return jsonify({"timelines": flight_recorder.slowest(count, include_active)})
+
+@app.route("/admin/profile", methods=["GET"])
+def profile():
+    """
+    对服务进程做限时的采样分析，采样期间本请求阻塞
+
+    查询参数：
+        seconds: 采样时长（秒），默认 5，最长 PROFILE_MAX_SECONDS
+        interval: 采样间隔（秒），默认 0.01
+        format: json（默认，热点函数和折叠栈）或 collapsed（折叠栈文本，可直接生成火焰图）
+        idle: 为 1 时保留停在等待调用上的空闲线程栈
+    """
+    denied = admin_denied()
+    if denied:
+        return denied
+    seconds = min(max(request.args.get("seconds", 5, type=float), 0.1), PROFILE_MAX_SECONDS)
+    interval = max(request.args.get("interval", 0.01, type=float), 0.001)
+    try:
+        stacks, samples = sample_stacks(seconds, interval, include_idle=request.args.get("idle") == "1")
+    except ProfilerBusyError as e:
+        return jsonify({"error": str(e)}), 409
+    if request.args.get("format") == "collapsed":
+        text = "\n".join(f"{stack} {hits}" for stack, hits in stacks.most_common()) + "\n"
+        return Response(text, mimetype="text/plain")
+    return jsonify({
+        "seconds": seconds,
+        "interval": interval,
+        "samples": samples,
+        "top": top_functions(stacks, 30),
+        "stacks": [{"stack": stack, "samples": hits} for stack, hits in stacks.most_common(100)],
+    })
+
+@app.route("/admin/config", methods=["GET"])
+def effective_config():
+    """返回当前生效的配置、需重启才生效的修改和最近一次热加载的结果"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    config = dict(CONFIG, admin_token="***" if CONFIG["admin_token"] else "")
+    return jsonify({"config": config, "pending_restart": dict(pending_restart), "last_reload": dict(last_reload)})
+
+@app.route("/admin/config", methods=["POST"])
+def update_config():
+    """
+    热更新配置：请求体为 {配置项: 新值} 时在当前配置上修改这些项（不写入配置文件），
+    请求体为空时重新读取配置文件。校验失败时整份修改都不生效并返回 400。未配置 admin_token 时返回 403
+    """
+    denied = admin_denied(mutating=True)
+    if denied:
+        return denied
+    values = request.get_json(force=True, silent=True)
+    if values is None:
+        result = reload_config(source="admin")
+    elif isinstance(values, dict):
+        result = patch_config(values)
+    else:
+        return jsonify({"errors": ["请求体必须是 {配置项: 新值} 形式的 JSON 对象"]}), 400
+    if "admin_token" in result["applied"]:
+        result["applied"]["admin_token"] = "***"
+    return jsonify(result), 400 if result["errors"] else 200
@@ -0,0 +1,92 @@
+"""
+SSE 流式输出模块，负责增量计算和 chunk 编码
+"""
+
+import json
+from difflib import SequenceMatcher
+
+
+class ChunkEncoder:
+    """
+    预先序列化的 chunk 编码器
+
+    同一响应的 id、created、model 不变，构造时一次性序列化信封的前后缀，
+    之后每个增量只需序列化一次内容字符串。
+    """
+
+    def __init__(self, chat_id, created_ts, model):
+        """
+        参数：
+            chat_id: 聊天会话 ID
+            created_ts: 创建时间戳
+            model: 模型名称
+        """
+        head = json.dumps({"id": chat_id, "object": "chat.completion.chunk", "created": created_ts, "model": model})
+        self.prefix = "data: " + head[:-1] + ', "choices": [{"delta": '  # 去掉结尾的 }，拼接 choices
+        self.suffix = ', "index": 0, "finish_reason": null}]}\n\n'
+        self.usage_prefix = "data: " + head[:-1] + ', "choices": [], "usage": '
+
+    def role(self):
+        """首个 chunk，标记角色为 assistant"""
+        return self.prefix + '{"role": "assistant"}' + self.suffix
+
+    def content(self, text):
+        """内容增量 chunk"""
+        return self.prefix + '{"content": ' + json.dumps(text) + "}" + self.suffix
+
+    def finish(self, finish_reason="stop"):
+        """结束 chunk"""
+        return self.prefix + '{}, "index": 0, "finish_reason": ' + json.dumps(finish_reason) + "}]}\n\n"
+
+    def usage(self, usage):
+        """stream_options.include_usage 要求的用量 chunk，choices 为空"""
+        return self.usage_prefix + json.dumps(usage) + "}\n\n"
+
+    @staticmethod
+    def done():
+        """流结束标识"""
+        return "data: [DONE]\n\n"
+
+
+class DeltaTracker:
+    """
+    页面文本的增量计算器
+
+    客户端收到的内容只能追加。页面重新渲染前文（如 markdown 收尾时）导致文本不再以
+    上次的文本开头时，在改写区域内对齐新旧文本，找到客户端已收到内容在新文本中的结束位置，
+    只输出其后的部分，避免重复或错位。
+    """
+
+    def __init__(self):
+        self.page_text = ""  # 上次看到的页面文本，客户端已收到与之对应的全部内容
+        self.sent_text = ""  # 客户端实际收到的完整内容
+
+    def update(self, current_text):
+        """
+        根据最新页面文本计算需要发送的增量
+
+        参数：
+            current_text: 页面当前的完整回复文本
+
+        返回：
+            需要追加发送给客户端的文本，可能为空字符串
+        """
+        old = self.page_text
+        if current_text.startswith(old):  # 普通追加
+            delta = current_text[len(old):]
+        else:
+            if not current_text:  # 页面临时清空重绘，等待下次更新
+                return ""
+            common = 0
+            limit = min(len(old), len(current_text))
+            while common < limit and old[common] == current_text[common]:
+                common += 1
+            # 已发送部分被改写：只在改写区域内对齐，定位已发送内容在新文本中的结束位置
+            matcher = SequenceMatcher(None, old[common:], current_text[common:], autojunk=False)
+            blocks = [block for block in matcher.get_matching_blocks() if block.size]
+            if not blocks:  # 无法对齐，多半是重绘中的中间状态，等待下次更新
+                return ""
+            delta = current_text[common + blocks[-1].b + blocks[-1].size:]
+        self.page_text = current_text
+        self.sent_text += delta
+        return delta
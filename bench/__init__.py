@@ -0,0 +1,3 @@
+"""
+离线基准测试包，包含模拟聊天页面和压测脚本
+"""
@@ -0,0 +1,283 @@
+"""
+模拟 chat.qwen.ai 页面的本地服务，用于离线压测
+
+页面遵循 browser/actions.py 依赖的 DOM 约定：
+    - button#sidebar-new-chat-button：新建对话
+    - textarea#chat-input：输入框
+    - button#send-message-button：输入为空且空闲时带 disabled 属性和 disabled 类
+    - div#response-content-container：每条回复一个容器，内容按行渲染为 <p>
+    - button#model-selector-0-button：显示当前模型，点击后展开 button[aria-label="model-item"] 模型菜单
+页面通过 fetch 调用本服务的 /api/chat/completions（带上当前模型），按配置的速率以 SSE 流式返回回复。
+打开页面时下发会话 Cookie（fake_session），使用 --require-session 时补全接口只接受带有效会话 Cookie 的请求，
+可用于验证直连后端（direct_transport）读取和刷新凭据；POST /api/logout 作废所有会话。
+
+用法：
+    python -m bench.fake_site --port 8000 --token-rate 50 --tokens 200
+然后在 config.yaml 中设置 chat_url: "http://127.0.0.1:8000/"
+"""
+
+import argparse
+import json
+import random
+import threading
+import uuid
+from time import sleep
+
+from flask import Flask, Response, request, abort
+
+app = Flask(__name__)
+
+# 回复生成参数，由命令行参数覆盖
+SETTINGS = {
+    "token_rate": 50.0,  # 每秒输出的 token 数
+    "tokens": 200,  # 每条回复的 token 数
+    "first_token_delay": 0.3,  # 首个 token 之前的延迟（秒）
+    "paragraph_tokens": 40,  # 每多少个 token 换行成一个新段落
+    "require_session": False,  # 补全接口是否要求有效的会话 Cookie
+}
+
+WORDS = ("qwen", "browser", "latency", "token", "stream", "answer", "model", "cache", "queue",
+         "request", "response", "page", "tab", "pool", "metric", "profile", "session", "chat")
+
+MODELS = ("Qwen2.5-Plus", "Qwen2.5-Max", "Qwen2.5-Turbo", "QwQ-32B")  # 页面模型菜单，第一个为默认模型
+model_requests = {}  # 模型 -> 收到的补全请求数，便于核对模型路由
+
+chats = {}  # 对话编号 -> [(用户消息, 回复), ...]
+chats_lock = threading.Lock()
+sessions = set()  # 有效的会话 Cookie
+SESSION_COOKIE = "fake_session"
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Fake Qwen Chat</title></head>
+<body>
+<button id="sidebar-new-chat-button">New Chat</button>
+<button id="model-selector-0-button" data-value=""></button>
+<div id="model-menu"></div>
+<div id="messages"></div>
+<textarea id="chat-input"></textarea>
+<button id="send-message-button" class="send disabled" disabled>Send</button>
+<script>
+var HISTORY = __HISTORY__;
+var chatId = __CHAT_ID__;
+var busy = false;
+var controller = null;
+var input = document.getElementById('chat-input');
+var button = document.getElementById('send-message-button');
+var messages = document.getElementById('messages');
+var modelButton = document.getElementById('model-selector-0-button');
+var modelMenu = document.getElementById('model-menu');
+var MODELS = __MODELS__;
+
+function setModel(model) {
+    modelButton.textContent = model;
+    modelButton.setAttribute('data-value', model);
+    modelMenu.innerHTML = '';
+}
+modelButton.addEventListener('click', function () {
+    if (modelMenu.children.length) { modelMenu.innerHTML = ''; return; }
+    MODELS.forEach(function (model) {
+        var item = document.createElement('button');
+        item.setAttribute('aria-label', 'model-item');
+        item.setAttribute('data-value', model);
+        item.textContent = model;
+        item.addEventListener('click', function () { setTimeout(function () { setModel(model); }, 50); });
+        modelMenu.appendChild(item);
+    });
+});
+
+function setIdle(idle) {
+    if (idle && !input.value) {
+        button.setAttribute('disabled', '');
+        button.className = 'send disabled';
+    } else {
+        button.removeAttribute('disabled');
+        button.className = idle ? 'send' : 'stop';
+    }
+}
+function render(container, text) {
+    container.innerHTML = '';
+    text.split('\\n').forEach(function (line) {
+        if (!line) { return; }
+        var p = document.createElement('p');
+        p.textContent = line;
+        container.appendChild(p);
+    });
+}
+function addTurn(question, answer) {
+    var user = document.createElement('div');
+    user.className = 'user-message';
+    user.textContent = question;
+    messages.appendChild(user);
+    var container = document.createElement('div');
+    container.id = 'response-content-container';
+    messages.appendChild(container);
+    render(container, answer || '');
+    return container;
+}
+function reset() {
+    messages.innerHTML = '<div class="greeting">Hi, I am Qwen. Complete your profile to get started.</div>';
+}
+function send() {
+    var question = input.value;
+    if (busy || !question) { return; }
+    busy = true;
+    input.value = '';
+    setIdle(false);
+    if (!chatId) { chatId = Math.random().toString(16).slice(2); }
+    var container = addTurn(question, '');
+    var answer = '';
+    controller = new AbortController();
+    fetch('/api/chat/completions', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({chat_id: chatId, stream: true, model: modelButton.getAttribute('data-value'),
+                              messages: [{role: 'user', content: question}]}),
+        signal: controller.signal
+    }).then(function (response) {
+        var reader = response.body.getReader();
+        var decoder = new TextDecoder();
+        var buffer = '';
+        function pump() {
+            return reader.read().then(function (result) {
+                if (result.done) { return; }
+                buffer += decoder.decode(result.value, {stream: true});
+                var events = buffer.split('\\n\\n');
+                buffer = events.pop();
+                events.forEach(function (event) {
+                    var data = event.replace(/^data: /, '');
+                    if (!data || data === '[DONE]') { return; }
+                    var delta = JSON.parse(data).choices[0].delta;
+                    if (delta.content) {
+                        answer += delta.content;
+                        render(container, answer);
+                    }
+                });
+                return pump();
+            });
+        }
+        return pump();
+    }).catch(function () {}).then(function () {
+        busy = false;
+        controller = null;
+        history.pushState({}, '', '/c/' + chatId);
+        setIdle(true);
+    });
+}
+input.addEventListener('input', function () { if (!busy) { setIdle(true); } });
+button.addEventListener('click', function () {
+    if (busy) { if (controller) { controller.abort(); } return; }
+    send();
+});
+document.getElementById('sidebar-new-chat-button').addEventListener('click', function () {
+    if (controller) { controller.abort(); }
+    chatId = null;
+    history.pushState({}, '', '/');
+    reset();
+});
+setModel(MODELS[0]);
+reset();
+HISTORY.forEach(function (turn) { addTurn(turn[0], turn[1]); });
+</script>
+</body>
+</html>
+"""
+
+def render_page(chat_id=None):
+    """渲染聊天页面，已有对话时带上历史消息"""
+    with chats_lock:
+        history = list(chats.get(chat_id, [])) if chat_id else []
+    page = PAGE.replace("__HISTORY__", json.dumps(history))
+    page = page.replace("__CHAT_ID__", json.dumps(chat_id))
+    page = page.replace("__MODELS__", json.dumps(MODELS))
+    response = Response(page, mimetype="text/html")
+    with chats_lock:
+        if request.cookies.get(SESSION_COOKIE) not in sessions:  # 首次访问或会话已作废时下发新会话
+            session_id = uuid.uuid4().hex
+            sessions.add(session_id)
+            response.set_cookie(SESSION_COOKIE, session_id, httponly=True)
+    return response
+
+@app.route("/")
+def index():
+    """首页，即新对话"""
+    return render_page()
+
+@app.route("/c/<chat_id>")
+def chat_page(chat_id):
+    """已有对话页面"""
+    with chats_lock:
+        if chat_id not in chats:
+            abort(404)
+    return render_page(chat_id)
+
+def make_reply(question):
+    """根据问题生成确定长度的回复 token 列表"""
+    rng = random.Random(question)  # 相同问题得到相同回复
+    tokens = [f"Echo: {question[:40]}\n"]
+    for index in range(SETTINGS["tokens"]):
+        word = rng.choice(WORDS)
+        if index and index % SETTINGS["paragraph_tokens"] == 0:
+            word = "\n" + word
+        tokens.append(word + " ")
+    return tokens
+
+@app.route("/api/chat/completions", methods=["POST"])
+def completions():
+    """模拟后端接口，以 OpenAI 风格的 SSE 流式返回回复"""
+    with chats_lock:
+        if SETTINGS["require_session"] and request.cookies.get(SESSION_COOKIE) not in sessions:
+            return {"error": "unauthorized"}, 401
+    body = request.get_json(force=True)
+    chat_id = body.get("chat_id") or uuid.uuid4().hex
+    model = body.get("model") or MODELS[0]
+    with chats_lock:
+        model_requests[model] = model_requests.get(model, 0) + 1
+    question = body["messages"][-1]["content"]
+    tokens = make_reply(question)
+    interval = 1.0 / SETTINGS["token_rate"] if SETTINGS["token_rate"] > 0 else 0
+
+    def generate():
+        sleep(SETTINGS["first_token_delay"])
+        answer = []
+        for token in tokens:
+            answer.append(token)
+            chunk = {"choices": [{"delta": {"content": token}, "index": 0, "finish_reason": None}]}
+            yield "data: " + json.dumps(chunk) + "\n\n"
+            if interval:
+                sleep(interval)
+        with chats_lock:
+            chats.setdefault(chat_id, []).append((question, "".join(answer)))
+        yield "data: " + json.dumps({"choices": [{"delta": {}, "index": 0, "finish_reason": "stop"}]}) + "\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(generate(), mimetype="text/event-stream")
+
+@app.route("/api/logout", methods=["POST"])
+def logout():
+    """作废所有会话，模拟登录过期；重新打开页面后获得新会话"""
+    with chats_lock:
+        sessions.clear()
+    return {"ok": True}
+
+@app.route("/api/stats")
+def stats():
+    """各模型收到的补全请求数，用于核对请求是否被路由到选中了对应模型的页面"""
+    with chats_lock:
+        return {"model_requests": dict(model_requests)}
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟 chat.qwen.ai 页面的本地服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--token-rate", type=float, default=SETTINGS["token_rate"], help="每秒输出的 token 数，0 表示不限速")
+    parser.add_argument("--tokens", type=int, default=SETTINGS["tokens"], help="每条回复的 token 数")
+    parser.add_argument("--first-token-delay", type=float, default=SETTINGS["first_token_delay"], help="首个 token 前的延迟（秒）")
+    parser.add_argument("--require-session", action="store_true", help="补全接口只接受带有效会话 Cookie 的请求")
+    args = parser.parse_args()
+    SETTINGS.update(token_rate=args.token_rate, tokens=args.tokens, first_token_delay=args.first_token_delay,
+                    require_session=args.require_session)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+压测脚本，以指定并发调用 /v1/chat/completions 并统计延迟、首字延迟和吞吐
+
+用法：
+    python -m bench.run --url http://127.0.0.1:5000 --concurrency 4 --requests 40 --mode both
+"""
+
+import argparse
+import json
+import threading
+import uuid
+from time import perf_counter
+
+import requests
+
+def percentile(values, pct):
+    """按最近秩法计算百分位数，无数据时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+def run_one(session, url, payload, stream):
+    """
+    发送一次请求
+
+    返回：
+        (总耗时, 首字耗时, 回复字符数)，失败时抛出异常
+    """
+    start = perf_counter()
+    payload = dict(payload, stream=stream)
+    response = session.post(url, json=payload, stream=stream, timeout=600)
+    response.raise_for_status()
+    if not stream:
+        content = response.json()["choices"][0]["message"]["content"]
+        elapsed = perf_counter() - start
+        return elapsed, elapsed, len(content)
+    first_token = None
+    chars = 0
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data: "):
+            continue
+        data = line[len("data: "):]
+        if data == "[DONE]":
+            break
+        choices = json.loads(data).get("choices") or [{}]  # include_usage 的最后一个 chunk 没有 choices
+        delta = choices[0].get("delta", {})
+        if delta.get("content"):
+            if first_token is None:
+                first_token = perf_counter() - start
+            chars += len(delta["content"])
+    return perf_counter() - start, first_token, chars
+
+def run_mode(args, stream):
+    """以指定并发运行一组请求并返回统计结果"""
+    url = args.url.rstrip("/") + "/v1/chat/completions"
+    results = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+    models = [name.strip() for name in args.model.split(",") if name.strip()]
+
+    def worker():
+        session = requests.Session()
+        headers = {} if args.cache else {"Cache-Control": "no-cache"}
+        session.headers.update(headers)
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            prompt = args.prompt if args.cache else f"{args.prompt} [{uuid.uuid4().hex[:8]}]"
+            model = models[index % len(models)]  # 多个模型时轮流使用
+            payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+            if args.max_tokens:
+                payload["max_tokens"] = args.max_tokens
+            try:
+                result = run_one(session, url, payload, stream)
+                with lock:
+                    results.append(result)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    start = perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = perf_counter() - start
+
+    latencies = [r[0] for r in results]
+    ttfts = [r[1] for r in results if r[1] is not None]
+    chars = sum(r[2] for r in results)
+    return {
+        "mode": "stream" if stream else "non-stream",
+        "ok": len(results),
+        "errors": len(errors),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p95": percentile(ttfts, 95),
+        "ttft_p99": percentile(ttfts, 99),
+        "requests_per_second": len(results) / wall if wall else 0,
+        "chars_per_second": chars / wall if wall else 0,
+        "sample_errors": errors[:3],
+    }
+
+def print_report(report):
+    """输出一组统计结果"""
+    def fmt(value):
+        return "-" if value is None else f"{value:.3f}"
+    print(f"[{report['mode']}] ok={report['ok']} errors={report['errors']}")
+    print(f"  latency  p50={fmt(report['latency_p50'])}s p95={fmt(report['latency_p95'])}s p99={fmt(report['latency_p99'])}s")
+    print(f"  ttft     p50={fmt(report['ttft_p50'])}s p95={fmt(report['ttft_p95'])}s p99={fmt(report['ttft_p99'])}s")
+    print(f"  throughput {report['requests_per_second']:.2f} req/s, {report['chars_per_second']:.1f} chars/s")
+    for error in report["sample_errors"]:
+        print(f"  error: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description="chat completions 压测脚本")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="被测服务地址")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发数")
+    parser.add_argument("--requests", type=int, default=20, help="每种模式的请求总数")
+    parser.add_argument("--mode", choices=["stream", "non-stream", "both"], default="both")
+    parser.add_argument("--model", default="qwen-plus", help="请求的模型，多个模型用逗号分隔时轮流使用")
+    parser.add_argument("--prompt", default="你是谁？")
+    parser.add_argument("--max-tokens", type=int, default=0,
+                        help="请求的 max_tokens，用于测量提前停止生成对浏览器占用的影响，0 表示不限制")
+    parser.add_argument("--cache", action="store_true", help="允许命中回复缓存（默认每个请求使用不同的提示词并跳过缓存）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果，便于与历史结果比较")
+    args = parser.parse_args()
+
+    modes = {"stream": [True], "non-stream": [False], "both": [True, False]}[args.mode]
+    reports = [run_mode(args, stream) for stream in modes]
+    if args.json:
+        print(json.dumps(reports, indent=2, ensure_ascii=False))
+    else:
+        for report in reports:
+            print_report(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+文本处理流水线的微基准：逐阶段测量超长提示词（如 RAG 拼接的 10 万字符）的处理耗时
+
+用法：
+    python -m bench.text_pipeline --chars 100000 --repeat 20
+"""
+
+import argparse
+import json
+import random
+import timeit
+
+from config import CONFIG
+from utils.text import (sanitize_text, content_text, merge_messages, estimate_tokens, trim_messages,
+                        split_chunks)
+
+def legacy_sanitize(text):
+    """改写前的逐字符过滤实现，作为对照"""
+    return ''.join(char for char in text if ord(char) < 0x10000)
+
+def legacy_estimate(text):
+    """改写前的逐字符统计实现，作为对照"""
+    cjk = sum(1 for char in text if '\u2e80' <= char <= '\u9fff' or '\uac00' <= char <= '\ud7af')
+    return cjk + (len(text) - cjk + 3) // 4
+
+def make_text(chars, seed=0):
+    """生成中英文混合、夹带少量 emoji 的文本"""
+    rng = random.Random(seed)
+    pieces = ["检索到的文档片段：", "The quick brown fox jumps over the lazy dog. ", "数据库连接池配置说明。",
+              "def handler(request):\n    return response\n", "\U0001F600", "性能优化 "]
+    result = []
+    length = 0
+    while length < chars:
+        piece = rng.choice(pieces)
+        result.append(piece)
+        length += len(piece)
+    return "".join(result)[:chars]
+
+def make_messages(chars, turns):
+    """生成 turns 轮对话，最后一条用户消息为列表格式、包含超长检索内容"""
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": make_text(2000, seed=turn)})
+        messages.append({"role": "assistant", "content": make_text(1000, seed=turn + 1000)})
+    messages.append({"role": "user", "content": [
+        {"type": "text", "text": make_text(chars, seed=42)},
+        {"type": "image_url", "image_url": {"url": "https://example.com/a.png"}},
+        {"type": "text", "text": "请根据以上内容回答。"},
+    ]})
+    return messages
+
+def measure(func, repeat):
+    """返回单次调用的最佳耗时（毫秒）"""
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="文本处理流水线微基准")
+    parser.add_argument("--chars", type=int, default=100000, help="最后一条消息的字符数")
+    parser.add_argument("--turns", type=int, default=20, help="历史对话轮数")
+    parser.add_argument("--budget", type=int, default=32000, help="trim_messages 的 token 预算")
+    parser.add_argument("--repeat", type=int, default=20, help="每个阶段重复测量的次数")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    messages = make_messages(args.chars, args.turns)
+    text = content_text(messages[-1]["content"])
+    merged = merge_messages(messages)
+    chunk_size = CONFIG["input_chunk_chars"] or len(merged)
+
+    stages = [
+        ("sanitize (legacy generator)", lambda: legacy_sanitize(text)),
+        ("sanitize (regex)", lambda: sanitize_text(text)),
+        ("content_text (list parts)", lambda: content_text(messages[-1]["content"])),
+        ("merge_messages", lambda: merge_messages(messages)),
+        ("estimate_tokens (legacy)", lambda: legacy_estimate(merged)),
+        ("estimate_tokens (regex)", lambda: estimate_tokens(merged)),
+        ("trim_messages", lambda: trim_messages(messages, args.budget)),
+        ("webdriver payload (single)", lambda: json.dumps({"script": "", "args": [merged]})),
+        ("webdriver payload (chunked)",
+         lambda: [json.dumps({"script": "", "args": [chunk, False]}) for chunk in split_chunks(merged, chunk_size)]),
+    ]
+    results = [{"stage": name, "ms": measure(func, args.repeat)} for name, func in stages]
+    if args.json:
+        print(json.dumps({"chars": len(merged), "tokens": estimate_tokens(merged), "stages": results}, indent=2))
+        return
+    print(f"merged prompt: {len(merged)} chars, ~{estimate_tokens(merged)} tokens, chunk size {chunk_size}")
+    for result in results:
+        print(f"  {result['stage']:<30} {result['ms']:8.3f} ms")
+
+if __name__ == "__main__":
+    main()
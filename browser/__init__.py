@@ -2,8 +2,10 @@
 浏览器模块，包含浏览器操作和管理相关功能
 """
 
+from config import CONFIG, on_config_change
 from browser.pool import BrowserPool
-from browser.actions import init_browser, new_chat, clear_auto_greeting, send_message, get_response_non_stream
+from browser.actions import init_browser, install_network_tap, block_resources, maintain_memory, new_chat, open_chat, clear_auto_greeting, send_message, stop_generation, extract_response, get_response_non_stream
 
 # 创建浏览器池实例
-browser_pool = BrowserPool(size=1) 
\ No newline at end of file
+browser_pool = BrowserPool(min_size=CONFIG["pool_min_size"], max_size=CONFIG["pool_max_size"])
+on_config_change(browser_pool.apply_config)  # 配置热加载后调整池大小和等待超时
@@ -2,8 +2,8 @@
 浏览器操作相关函数，包括初始化浏览器、页面交互等
 """
 
-import os
-from time import sleep
+import json
+from urllib.parse import urlsplit
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -12,15 +12,32 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.keys import Keys
+from selenium.common.exceptions import StaleElementReferenceException
 
-from config import CONFIG
+from config import CONFIG, logger
+from browser.scripts import (EXTRACT_RESPONSE_JS, STOP_GENERATION_JS, IDLE_BUTTON_SELECTOR, FRESH_CHAT_JS,
+                             OPENED_CHAT_JS, GREETING_GUARD_JS, SET_INPUT_JS, APPEND_INPUT_JS, NETWORK_TAP_JS,
+                             MEMORY_PRUNE_JS, SELECT_MODEL_JS, MODEL_BUTTON_SELECTOR, MODEL_ITEM_SELECTOR,
+                             HARVEST_CREDENTIALS_JS)
 from utils.retry import retry_on_failure
-from utils.text import sanitize_text
+from utils.text import sanitize_text, split_chunks
 
-def init_browser():
+# 可按类别屏蔽的第三方资源，值为 CDP Network.setBlockedURLs 的通配符模式
+BLOCKED_RESOURCE_PATTERNS = {
+    "analytics": ["*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*sentry.io*",
+                  "*mmstat.com*", "*arms-retcode*", "*hm.baidu.com*"],
+    "fonts": ["*.woff", "*.woff2", "*.ttf", "*.otf", "*fonts.googleapis.com*", "*fonts.gstatic.com*"],
+    "media": ["*.mp4", "*.webm", "*.mp3", "*.ogg", "*.wav", "*.m3u8"],
+    "images": ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico"],
+}
+
+def init_browser(user_data_dir):
     """
     初始化 Chrome 浏览器实例，并返回浏览器对象及其对应的 WebDriverWait 对象
 
+    Args:
+        user_data_dir: Chrome 用户数据目录，同一目录同一时刻只能被一个 Chrome 进程使用
+
     Returns:
         driver: 初始化后的 Chrome WebDriver 对象
         wait: 关联的 WebDriverWait 对象，用于显式等待
@@ -29,10 +46,6 @@ def init_browser():
     if CONFIG.get("headless", False):  # 根据配置判断是否启用无头模式
         chrome_options.add_argument("--headless=new")  # 添加无头模式参数（新版 Chrome 可能需要）
     
-    user_data_dir = os.path.join(os.getcwd(), "selenium_user_data")  # 构造用户数据目录路径
-    if not os.path.exists(user_data_dir):  # 如果目录不存在
-        os.makedirs(user_data_dir)  # 则创建该目录
-    
     chrome_options.add_argument(f'--user-data-dir={user_data_dir}')  # 指定用户数据目录
     chrome_options.add_argument('--disable-gpu')  # 禁用 GPU 加速
     chrome_options.add_argument('--no-sandbox')  # 禁用沙盒模式
@@ -55,6 +68,9 @@ def init_browser():
     chrome_options.add_argument('--blink-settings=imagesEnabled=false')  # 禁用图片加载以加快加载速度
     chrome_options.add_argument('--js-flags=--expose-gc')  # 启用垃圾回收
     chrome_options.add_argument('--disable-default-apps')  # 禁用默认应用
+    chrome_options.add_argument('--disable-background-timer-throttling')  # 后台标签页的定时器不降频
+    chrome_options.add_argument('--disable-renderer-backgrounding')  # 后台标签页的渲染进程不降低优先级
+    chrome_options.add_argument('--disable-backgrounding-occluded-windows')  # 被遮挡的窗口不进入后台模式
     
     # 添加更多性能优化参数
     chrome_options.add_argument('--disable-javascript')  # 如果不需要JS可以禁用
@@ -65,10 +81,97 @@ def init_browser():
     
     service = Service()  # 创建 ChromeDriver 服务对象（使用默认设置）
     driver = webdriver.Chrome(service=service, options=chrome_options)  # 使用指定服务和配置选项启动 Chrome 浏览器
-    driver.set_page_load_timeout(CONFIG["page_load_timeout"])  # 设置页面加载超时时间
-    wait = WebDriverWait(driver, CONFIG["wait_timeout"], poll_frequency=CONFIG["poll_interval"])  # 创建 WebDriverWait 对象
+    wait = configure_timeouts(driver)
     return driver, wait  # 返回浏览器和等待对象
 
+def configure_timeouts(driver):
+    """
+    按当前配置设置浏览器的超时时间，并创建对应的 WebDriverWait 对象
+
+    启动时和配置热加载后调用；WebDriverWait 在创建时固定了超时和轮询间隔，因此热加载后需重新创建。
+
+    参数：
+        driver: Chrome WebDriver 对象
+
+    返回：
+        新的 WebDriverWait 对象
+    """
+    driver.set_page_load_timeout(CONFIG["page_load_timeout"])  # 设置页面加载超时时间
+    driver.set_script_timeout(CONFIG["stream_long_poll_timeout"] + CONFIG["wait_timeout"])  # 异步脚本超时需长于长轮询时间
+    return WebDriverWait(driver, CONFIG["wait_timeout"], poll_frequency=CONFIG["poll_interval"])  # 创建 WebDriverWait 对象
+
+def install_network_tap(driver):
+    """
+    为当前标签页注册网络流捕获脚本，之后打开的每个页面都会在页面自身脚本之前安装捕获
+
+    CDP 命令只作用于当前标签页，因此每个标签页都需在打开聊天页面前、在 activate() 内调用一次。
+
+    参数：
+        driver: Chrome WebDriver 对象
+
+    返回：
+        是否注册成功；浏览器不支持 CDP 时返回 False，回复读取回退到 DOM
+    """
+    source = f"window.__qwenTapPattern = {json.dumps(CONFIG['network_capture_pattern'])};\n" + NETWORK_TAP_JS
+    try:
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": source})
+        return True
+    except Exception as e:
+        logger.warning(f"注册网络流捕获失败，回退到读取页面内容: {e}")  # 记录错误信息
+        return False
+
+def block_resources(driver):
+    """
+    为当前标签页屏蔽 blocked_resources 类别和 blocked_url_patterns 中的资源请求
+
+    与网络流捕获一样按标签页生效，需在打开聊天页面前、在 activate() 内调用。
+
+    参数：
+        driver: Chrome WebDriver 对象
+
+    返回：
+        屏蔽的模式数量；浏览器不支持 CDP 时返回 0
+    """
+    patterns = []
+    for name in CONFIG["blocked_resources"]:
+        patterns.extend(BLOCKED_RESOURCE_PATTERNS.get(name, []))
+    patterns.extend(CONFIG["blocked_url_patterns"])
+    if not patterns:
+        return 0
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+        return len(patterns)
+    except Exception as e:
+        logger.warning(f"屏蔽资源请求失败: {e}")  # 记录错误信息
+        return 0
+
+def maintain_memory(driver):
+    """
+    请求间隙整理当前标签页的内存
+
+    清空较早回复的 DOM 内容并触发 JS 垃圾回收，按 memory_clear_storage 清理页面来源下会持续增长的存储
+    （登录状态所在的 Cookie 和 localStorage 不在默认清理范围内），最后读取 JS 堆的使用量。
+
+    参数：
+        driver: Chrome WebDriver 对象
+
+    返回：
+        JS 堆已使用的字节数，浏览器不支持 CDP 时返回 None
+    """
+    driver.execute_script(MEMORY_PRUNE_JS, CONFIG["memory_keep_replies"])
+    try:
+        storage_types = CONFIG["memory_clear_storage"]
+        if storage_types:
+            parts = urlsplit(driver.current_url)
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {
+                "origin": f"{parts.scheme}://{parts.netloc}", "storageTypes": storage_types})
+        driver.execute_cdp_cmd("HeapProfiler.collectGarbage", {})  # 未启用 --expose-gc 时同样有效
+        return driver.execute_cdp_cmd("Runtime.getHeapUsage", {})["usedSize"]
+    except Exception as e:
+        logger.warning(f"清理浏览器存储或读取堆内存失败: {e}")  # 记录错误信息
+        return None
+
 @retry_on_failure  # 应用重试装饰器
 def new_chat(driver, wait):
     """
@@ -82,9 +185,31 @@ def new_chat(driver, wait):
         # 等待新对话按钮可点击，并点击
         new_chat_button = wait.until(EC.element_to_be_clickable((By.ID, "sidebar-new-chat-button")))  # 等待新对话按钮可点击
         new_chat_button.click()  # 点击新对话按钮
-        sleep(0.3)  # 等待 0.3 秒
+        wait.until(lambda d: d.execute_script(FRESH_CHAT_JS))  # 等待输入框出现且旧对话的回复已清空
+    except Exception as e:
+        logger.warning(f"创建新对话失败: {e}")  # 记录错误信息
+        raise  # 抛出异常以便重试
+
+@retry_on_failure  # 应用重试装饰器
+def open_chat(driver, wait, chat_url, replies=0):
+    """
+    打开已有对话，用于在原对话中继续发送新一轮消息
+
+    页面加载完成后已有回复可能尚未渲染，需等到回复数量达到 replies，
+    否则安装回复监听时统计的基线偏少，会把旧回复当作新回复读取。
+
+    参数：
+        driver: Chrome WebDriver 对象
+        wait: WebDriverWait 对象
+        chat_url: 对话页面地址
+        replies: 对话中已有的回复数量
+    """
+    try:
+        if driver.current_url != chat_url:  # 浏览器已离开该对话时重新打开
+            driver.get(chat_url)
+        wait.until(lambda d: d.execute_script(OPENED_CHAT_JS, replies))  # 等待输入框出现且已有回复渲染完成
     except Exception as e:
-        print(f"创建新对话失败: {e}")  # 输出错误信息
+        logger.warning(f"打开对话失败: {e}")  # 记录错误信息
         raise  # 抛出异常以便重试
 
 @retry_on_failure  # 应用重试装饰器
@@ -92,44 +217,153 @@ def clear_auto_greeting(driver, wait):
     """
     清除自动问候消息
 
+    一次脚本往返移除已渲染的问候语，并在页面中持续清除之后才渲染出的问候语，直到安装回复监听为止，
+    因此无需固定等待页面渲染完成。
+
     参数：
         driver: Chrome WebDriver 对象
         wait: WebDriverWait 对象
     """
     try:
-        sleep(0.5)  # 等待 0.5 秒以确保页面加载完成
-        # 查找包含 "profile" 和 "Qwen" 的元素，认为是自动问候消息
-        greetings = driver.find_elements(By.XPATH, "//*[contains(text(), 'profile') and contains(text(), 'Qwen')]")  # 查找自动问候消息元素
-        for elem in greetings:  # 遍历所有找到的元素
-            driver.execute_script("arguments[0].remove();", elem)  # 使用 JavaScript 移除该元素
+        driver.execute_script(GREETING_GUARD_JS)  # 移除文本包含 "profile" 和 "Qwen" 的自动问候消息
     except Exception as e:
-        print(f"清除自动问候失败: {e}")  # 输出错误信息
+        logger.warning(f"清除自动问候失败: {e}")  # 记录错误信息
+
+def select_model(driver, wait, label):
+    """
+    在页面的模型菜单中选择模型，当前已是该模型时只需一次脚本往返
+
+    浏览器固定服务一个模型，只在实例启动、预先新建对话和被调配给其他模型时调用。
+
+    参数：
+        driver: Chrome WebDriver 对象
+        wait: WebDriverWait 对象
+        label: 页面模型菜单中的模型名称，为空表示沿用页面默认模型
+
+    返回：
+        是否已确认选中该模型；页面没有模型选择按钮时返回 False，沿用页面默认模型
+
+    异常：
+        ValueError: 页面模型菜单中没有该模型
+        TimeoutException: 超过 wait_timeout 仍未切换成功
+    """
+    if not label:
+        return False
+
+    def step(d):
+        status = d.execute_script(SELECT_MODEL_JS, label, MODEL_BUTTON_SELECTOR, MODEL_ITEM_SELECTOR)
+        return status if status in ("selected", "missing", "none") else False  # 菜单展开和切换生效需要等待渲染
+
+    status = wait.until(step)
+    if status == "missing":
+        raise ValueError(f"页面模型菜单中没有 {label}")
+    if status == "none":
+        logger.warning(f"页面没有模型选择按钮，无法选择 {label}，沿用页面默认模型")
+        return False
+    return True
+
+def harvest_credentials(driver):
+    """
+    读取页面调用聊天后端所需的登录凭据，供不经过浏览器的直连请求使用
+
+    参数：
+        driver: Chrome WebDriver 对象，需已打开聊天页面
+
+    返回：
+        字典，包含 cookies（名称 -> 值，含 HttpOnly Cookie）、token（localStorage 中的令牌，可能为 None）、
+        user_agent 和 origin
+    """
+    info = driver.execute_script(HARVEST_CREDENTIALS_JS)
+    cookies = {cookie["name"]: cookie["value"] for cookie in driver.get_cookies()}  # WebDriver 可读取 HttpOnly Cookie
+    return {"cookies": cookies, "token": info.get("token"), "user_agent": info.get("userAgent"),
+            "origin": info.get("origin")}
+
+def locate_chat_elements(driver, wait, elements):
+    """
+    查找输入框和发送按钮并写入缓存
+
+    参数：
+        driver: Chrome WebDriver 对象
+        wait: WebDriverWait 对象
+        elements: 元素缓存字典，写入 input 和 send 两项
+    """
+    # 等待聊天输入框出现
+    elements["input"] = wait.until(EC.presence_of_element_located((By.XPATH, "//textarea[@id='chat-input']")))
+    elements["send"] = driver.find_element(By.XPATH, "//button[@id='send-message-button']")
 
 @retry_on_failure  # 应用重试装饰器
-def send_message(driver, wait, message):
+def send_message(driver, wait, message, elements=None):
     """
     发送消息到聊天输入框
 
+    优先使用缓存的输入框和发送按钮，元素已失效（页面重新渲染）时重新查找。
+    超过 input_chunk_chars 的消息分块传入页面，避免单个 WebDriver 请求过大。
+
     参数：
         driver: Chrome WebDriver 对象
         wait: WebDriverWait 对象
         message: 需要发送的消息文本
+        elements: 元素缓存字典，为 None 时每次重新查找
     """
+    if elements is None:
+        elements = {}
     try:
-        # 等待聊天输入框出现
-        input_box = wait.until(EC.presence_of_element_located((By.XPATH, "//textarea[@id='chat-input']")))
-        # 设置输入框的值，先进行文本清洗
-        driver.execute_script("arguments[0].value = arguments[1]", input_box, sanitize_text(message))
-        # 触发输入事件，确保前端能检测到变化
-        driver.execute_script("arguments[0].dispatchEvent(new Event('input', { bubbles: true }))", input_box)
-        
-        # 等待发送按钮可点击
-        send_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[@id='send-message-button']")))
+        text = sanitize_text(message)  # 先进行文本清洗
+        chunk_size = CONFIG["input_chunk_chars"]
+        if chunk_size and len(text) > chunk_size:  # 超长消息分块暂存到页面，最后一次写入
+            for index, chunk in enumerate(split_chunks(text, chunk_size)):
+                driver.execute_script(APPEND_INPUT_JS, chunk, index == 0)
+            text = None
+        if "input" not in elements:
+            locate_chat_elements(driver, wait, elements)
+        try:
+            # 设置输入框的值并触发输入事件，确保前端能检测到变化
+            ready = driver.execute_script(SET_INPUT_JS, elements["input"], text, elements["send"])
+        except StaleElementReferenceException:
+            locate_chat_elements(driver, wait, elements)
+            ready = driver.execute_script(SET_INPUT_JS, elements["input"], text, elements["send"])
+        send_button = elements["send"]
+        if not ready:  # 等待发送按钮可点击
+            send_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[@id='send-message-button']")))
+            elements["send"] = send_button
         driver.execute_script("arguments[0].click();", send_button)  # 点击发送按钮
     except Exception as e:
-        print(f"发送消息失败: {e}")  # 输出错误信息
+        elements.clear()  # 重试时重新查找元素
+        logger.warning(f"发送消息失败: {e}")  # 记录错误信息
         raise  # 抛出异常以便重试
 
+def stop_generation(driver, wait):
+    """
+    停止正在生成的回复，并等待页面回到空闲状态
+
+    参数：
+        driver: Chrome WebDriver 对象
+        wait: WebDriverWait 对象
+
+    返回：
+        是否点击了停止按钮（回复已生成完成时为 False）
+
+    异常：
+        TimeoutException: 超过 wait_timeout 页面仍未回到空闲状态
+    """
+    stopped = driver.execute_script(STOP_GENERATION_JS, IDLE_BUTTON_SELECTOR)
+    if stopped:
+        wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, IDLE_BUTTON_SELECTOR)))  # 等待发送按钮恢复禁用状态
+    return stopped
+
+def extract_response(driver):
+    """
+    一次 WebDriver 往返提取页面中最新回复
+
+    参数：
+        driver: Chrome WebDriver 对象
+
+    返回：
+        字典，包含 text（拼接后的文本）、blocks（段落、代码块、列表等结构）、
+        started（是否已出现新回复）和 done（是否生成完成）；已安装流式监听时还包含 source（network 或 dom）
+    """
+    return driver.execute_script(EXTRACT_RESPONSE_JS)
+
 @retry_on_failure  # 应用重试装饰器
 def get_response_non_stream(driver, wait):
     """
@@ -143,24 +377,20 @@ def get_response_non_stream(driver, wait):
         response_text: 获取到的响应文本
     """
     try:
-        # 等待发送按钮处于禁用状态（带有 disabled 属性和类），表示响应已生成
-        wait.until(EC.presence_of_element_located(
-            (By.XPATH, "//button[@id='send-message-button' and @disabled and contains(@class, 'disabled')]")
-        ))
-        
-        # 查找所有响应内容的容器
-        responses = wait.until(EC.presence_of_all_elements_located((By.CSS_SELECTOR, "div#response-content-container")))
-        if not responses:  # 如果未找到响应容器
-            raise Exception("未找到响应内容")
-            
-        latest_response = responses[-1]  # 获取最新的响应容器
-        paragraphs = latest_response.find_elements(By.TAG_NAME, "p")  # 查找所有段落元素
-        response_text = "\n".join(p.text for p in paragraphs if p.text)  # 拼接段落文本
-        
+        def finished_response(d):
+            """回复完成时返回提取结果，否则返回 False 继续等待"""
+            result = extract_response(d)
+            return result if result["done"] else False
+
+        # 每次轮询一次往返同时读取文本和完成状态，直到回复生成完成
+        generation_wait = WebDriverWait(driver, CONFIG["generation_timeout"], poll_frequency=CONFIG["poll_interval"])
+        result = generation_wait.until(finished_response)
+        response_text = result["text"]  # 拼接好的回复文本
+
         if not response_text:  # 如果响应文本为空
             raise Exception("响应内容为空")
             
         return response_text  # 返回响应文本
     except Exception as e:
-        print(f"获取响应失败: {e}")  # 输出错误信息
-        raise  # 抛出异常以便重试 
\ No newline at end of file
+        logger.warning(f"获取响应失败: {e}")  # 记录错误信息
+        raise  # 抛出异常以便重试
@@ -2,94 +2,753 @@
 浏览器池管理模块，用于管理和复用 Selenium 浏览器实例
 """
 
+import itertools
 import threading
-from time import sleep, time as current_time
+from collections import Counter
+from contextlib import contextmanager
+from time import time as current_time
+
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 
-from browser.actions import init_browser
+from config import CONFIG, logger
+from browser.actions import (init_browser, install_network_tap, block_resources, maintain_memory, new_chat,
+                             clear_auto_greeting, send_message, locate_chat_elements, select_model)
+from browser.profiles import profile_manager
+from browser.stream import ResponseStream
+from browser.tabs import BrowserProcess
+from utils.metrics import BROWSER_REQUESTS, MODEL_SWITCHES, PHASE_SECONDS, QUARANTINED
+from utils.retry import classify_error
+
+class PooledBrowser:
+    """
+    池中的单个工作单元：某个 Chrome 进程中的一个标签页，固定服务一个模型，记录使用次数和活跃时间
+    """
+    _ids = itertools.count(1)  # 工作单元编号生成器
+
+    def __init__(self, process, handle, model):
+        """
+        参数：
+            process: 所属的 BrowserProcess
+            handle: 标签页的窗口句柄
+            model: 固定服务的模型（models 中的名称）
+        """
+        self.id = next(self._ids)  # 编号，便于日志和统计
+        self.process = process
+        self.handle = handle
+        self.driver = process.driver  # 与同进程其他标签页共用的 WebDriver，使用前需 activate()
+        self.created_at = current_time()  # 创建时间
+        self.last_used = self.created_at  # 最近一次归还时间
+        self.requests = 0  # 已处理的请求数
+        self.broken = False  # 页面状态无法恢复时置为 True，归还时回收重建
+        self.staged = False  # 是否已停在清除了问候语的空白新对话上
+        self.keep_chat = False  # 当前对话已记录到对话亲和表，归还时不预先新建对话，下一轮可直接继续
+        self.elements = {}  # 缓存的输入框和发送按钮元素
+        self.failures = 0  # 连续失败的请求数，达到 breaker_failure_threshold 时熔断
+        self.maintained = 0  # 上次内存维护时的已处理请求数
+        self.js_heap = None  # 最近一次内存维护后 JS 堆已使用的字节数
+        self.model = model  # 固定服务的模型，被调配给其他模型时更新
+        self.model_selectable = True  # 页面没有模型选择按钮时置为 False，不再尝试选择
+
+    @property
+    def wait(self):
+        """所属进程的 WebDriverWait 对象，配置热加载后会被替换"""
+        return self.process.wait
+
+    def activate(self):
+        """独占所属进程并切换到本标签页，返回上下文管理器"""
+        return self.process.activate(self.handle)
+
+    def shared(self):
+        """所属进程是否同时承载多个标签页"""
+        return self.process.tabs > 1
+
+    def rss_mb(self):
+        """所属 Chrome 进程树的常驻内存（MB）"""
+        return self.process.rss_mb()
+
+    def needs_maintenance(self):
+        """距上次内存维护处理的请求数是否已达到 memory_maintenance_interval"""
+        interval = CONFIG["memory_maintenance_interval"]
+        return bool(interval) and self.requests - self.maintained >= interval
+
+    def maintain_memory(self):
+        """
+        执行一次内存维护并记录 JS 堆使用量
+
+        异常：
+            Exception: 页面脚本执行失败
+        """
+        with self.activate():
+            heap = maintain_memory(self.driver)
+        self.maintained = self.requests
+        if heap is not None:
+            self.js_heap = heap
+
+    def select_model(self):
+        """
+        确认页面选中的是本实例固定的模型，调用方需已 activate()；模型已选中时只需一次脚本往返
+
+        异常：
+            Exception: 页面模型菜单中没有该模型或切换超时
+        """
+        label = CONFIG["models"].get(self.model, "")
+        if label and self.model_selectable:
+            self.model_selectable = select_model(self.driver, self.wait, label)
+
+    def prepare(self):
+        """
+        打开一个空白新对话、选中固定的模型、清除问候语并缓存输入框和发送按钮，供下一个请求直接发送消息
+
+        异常：
+            Exception: 新建对话或选择模型失败
+        """
+        self.staged = False
+        with self.activate():
+            new_chat(self.driver, self.wait)
+            self.select_model()
+            clear_auto_greeting(self.driver, self.wait)
+            locate_chat_elements(self.driver, self.wait, self.elements)
+        self.staged = True
+
+    def is_alive(self):
+        """检查标签页是否仍然可用"""
+        try:
+            with self.activate():
+                self.driver.current_url  # 测试浏览器是否还活着
+            return True
+        except Exception:
+            return False
+
+    def quit(self):
+        """关闭标签页，所属进程没有其他标签页时一并退出"""
+        try:
+            return self.process.close_tab(self.handle)
+        except Exception as e:
+            logger.warning(f"关闭浏览器 {self.id} 失败: {e}")
+            return False
 
 class BrowserPool:
     """
     浏览器池管理类，用于管理和复用 Selenium 浏览器实例
+
+    池大小在 min_size 和 max_size 之间弹性伸缩：后台维护线程负责预热空闲备用实例、
+    在排队压力下扩容、在长时间空闲时缩容，并回收处理过多请求或内存过高的实例。
+    池的基本单元是标签页，每个 Chrome 进程最多承载 tabs_per_browser 个标签页。
+    实例在后台线程中并行启动，打开聊天页面并完成一次预热对话后才加入池；
+    池中实例数达到 ready_min_browsers 时视为就绪。
+
+    每个实例固定服务一个模型，请求只领取所请求模型的实例，避免每次请求都在页面中切换模型。
+    常驻和备用实例属于 default_model，排队请求的模型没有空闲实例时按排队数为其启动新实例；
+    池已达到最大大小时，将其他模型最久未用的空闲实例调配给该模型，只在调配时切换一次模型。
     """
-    def __init__(self, size=1):
+    def __init__(self, min_size=1, max_size=1):
         """
         初始化浏览器池
 
         参数：
-            size: 池中浏览器实例数量，默认为 1
+            min_size: 池中常驻浏览器实例（标签页）的最小数量，默认为 1
+            max_size: 池中浏览器实例（标签页）的最大数量，默认为 1
         """
-        self.pool = []  # 初始化存储浏览器实例的列表
+        self.pool = []  # 空闲浏览器实例列表
+        self.browsers = {}  # 所有存活实例，编号 -> PooledBrowser
+        self.processes = []  # 所有 Chrome 进程
+        self.retiring = []  # 待关闭的实例，由维护线程在锁外关闭
+        self.starting = 0  # 正在启动中的实例数
+        self.launching = []  # 正在启动的 Chrome 进程占位，启动完成前即可为其预留标签页名额
+        self.demand = 0  # 排队等待浏览器的请求数，由准入控制器更新
+        self.model_demand = {}  # 模型 -> 排队等待该模型浏览器的请求数，由准入控制器整体替换
+        self.starting_models = Counter()  # 模型 -> 正在为其启动的实例数
         self.lock = threading.Lock()  # 创建线程锁，确保池操作线程安全
-        self.size = size  # 保存池的大小
-        self.active_browsers = 0  # 添加活跃浏览器计数
-        self.last_cleanup = current_time()  # 添加最后清理时间
-        self.initialize()  # 初始化池中的浏览器实例
+        self.available = threading.Condition(self.lock)  # 有浏览器归还时通知等待者
+        self.min_size = min_size  # 最小池大小
+        self.max_size = max(max_size, min_size)  # 最大池大小
+        self.stats = {}  # 池状态快照，每次变化时整体替换，供监控无锁读取
+        self.process_rss = {}  # 进程编号 -> Chrome 进程树内存（字节），由维护线程定期刷新
+        self.js_heap = {}  # 实例编号 -> JS 堆已使用的字节数，内存维护后整体替换
+        self.wakeup = threading.Event()  # 唤醒维护线程
+        self.stopped = threading.Event()  # 池关闭标志
+        self.launch_slots = threading.BoundedSemaphore(CONFIG["pool_startup_workers"])  # 限制同时启动的实例数
+        self._publish_locked()
+        profile_manager.collect_garbage()  # 清理上次异常退出遗留的用户数据副本
+        self.initialize()  # 在后台启动最小数量的浏览器实例，不阻塞服务启动
+        self.maintainer = threading.Thread(target=self._maintain_loop, name="browser-pool", daemon=True)
+        self.maintainer.start()  # 启动后台维护线程
 
     def initialize(self):
         """
-        初始化浏览器池，创建指定数量的浏览器实例
+        初始化浏览器池，在后台并行启动最小数量的浏览器实例后立即返回
         """
-        for _ in range(self.size):  # 根据池大小循环创建实例
-            driver, wait = init_browser()  # 初始化浏览器和等待对象
-            driver.get("https://chat.qwen.ai/")  # 打开目标网站
-            try:
-                # 等待页面加载完成，直到新对话按钮出现
-                WebDriverWait(driver, 30).until(
-                    EC.presence_of_element_located((By.ID, "sidebar-new-chat-button"))
-                )
-            except Exception as e:
-                print(f"初始化浏览器失败: {e}")  # 输出错误信息
-            self.pool.append((driver, wait))  # 将浏览器实例添加到池中
+        models = [CONFIG["default_model"]] * self.min_size
+        with self.lock:
+            self.starting += len(models)
+            self.starting_models.update(models)
+            self._publish_locked()
+        self._launch(models)
 
-    def get_browser(self):
+    def _launch(self, models):
         """
-        从池中获取一个浏览器实例
+        为每个实例启动一个后台线程，同时进行的启动数量受 launch_slots 限制，
+        调用方需已将 self.starting 和 self.starting_models 按 models 增加
+
+        参数：
+            models: 每个待启动实例服务的模型
+        """
+        for model in models:
+            threading.Thread(target=self._launch_one, args=(model,), name="browser-start", daemon=True).start()
+
+    def _launch_one(self, model):
+        """占用一个启动名额后启动实例，池已关闭时直接放弃"""
+        with self.launch_slots:
+            if self.stopped.is_set():
+                with self.lock:
+                    self._started_locked(model)
+                    self._publish_locked()
+                return
+            self._spawn(model)
+
+    def _started_locked(self, model):
+        """一个实例启动结束（成功或失败），更新启动中计数，调用方需已持有 self.lock"""
+        self.starting -= 1
+        self.starting_models[model] -= 1
+        if self.starting_models[model] <= 0:
+            del self.starting_models[model]
+
+    def _reserve_process(self):
+        """
+        选择一个还有空余标签页名额的进程（含正在启动的进程）并预留一个名额
+
+        返回：
+            (process, launching): process 为 BrowserProcess 或正在启动的进程占位，
+            都没有空余名额时新建一个占位并返回 (占位, True)，由调用方负责启动该进程
+        """
+        with self.lock:
+            for process in self.processes:
+                if not process.draining and process.tabs < CONFIG["tabs_per_browser"]:
+                    process.tabs += 1
+                    return process, False
+            for pending in self.launching:
+                if pending["tabs"] < CONFIG["tabs_per_browser"]:
+                    pending["tabs"] += 1
+                    return pending, False
+            pending = {"tabs": 1, "process": None, "ready": threading.Event()}
+            self.launching.append(pending)
+            return pending, True
+
+    def _start_process(self, pending):
+        """
+        启动 Chrome 进程并替换占位，占位上预留的名额转移到新进程
+
+        参数：
+            pending: _reserve_process 新建的进程占位
+
+        返回：
+            BrowserProcess，启动失败时返回 None
+        """
+        process = None
+        profile = None
+        try:
+            with PHASE_SECONDS.time(phase="browser_start"):
+                profile, version = profile_manager.acquire()  # 复制登录模板，每个进程独占一个用户数据目录
+                driver, wait = init_browser(profile)  # 初始化浏览器和等待对象
+            process = BrowserProcess(driver, wait, profile, version)
+            if self.stopped.is_set():  # 启动期间池已关闭
+                process.quit()
+                process = None
+        except Exception:
+            if profile is not None:
+                profile_manager.release(profile)  # Chrome 启动失败，删除刚复制的副本
+            raise
+        finally:
+            with self.lock:
+                self.launching.remove(pending)
+                if process is not None:
+                    process.tabs = pending["tabs"]
+                    self.processes.append(process)
+                    self._publish_locked()
+                pending["process"] = process
+                pending["ready"].set()  # 唤醒在该进程上预留了名额的其他启动任务
+        return process
+
+    def _spawn(self, model):
+        """
+        启动一个新的标签页，打开聊天页面、选择模型并预热，成功后加入空闲列表
+
+        优先在已有（或正在启动的）进程中打开新标签页，进程均已满时启动新的 Chrome 进程。
+        调用前需已将 self.starting 加一，本方法在后台启动线程中执行耗时的启动过程。
+
+        参数：
+            model: 新实例固定服务的模型
+        """
+        browser = None
+        process, owner = self._reserve_process()
+        handle = None
+        try:
+            if owner:
+                process = self._start_process(process)
+            elif isinstance(process, dict):  # 等待其他任务启动的进程
+                pending = process
+                pending["ready"].wait()
+                process = pending["process"]
+                if process is None:
+                    raise Exception("所属浏览器进程启动失败")
+            handle = process.open_tab()
+            with process.activate(handle) as driver:
+                if CONFIG["network_capture"]:
+                    install_network_tap(driver)  # 须在打开页面前注册，才能先于页面脚本包装 fetch
+                block_resources(driver)
+                with PHASE_SECONDS.time(phase="page_load"):
+                    driver.get(CONFIG["chat_url"])  # 打开目标网站
+                    # 等待页面加载完成，直到新对话按钮出现
+                    WebDriverWait(driver, 30).until(
+                        EC.presence_of_element_located((By.ID, "sidebar-new-chat-button"))
+                    )
+            browser = PooledBrowser(process, handle, model)
+            with browser.activate(), PHASE_SECONDS.time(phase="select_model"):
+                browser.select_model()
+            if CONFIG["warmup_message"]:
+                with PHASE_SECONDS.time(phase="warmup"):
+                    self._warmup(browser)
+            if CONFIG["pool_prestage_chat"]:
+                self._stage(browser)
+        except Exception as e:
+            logger.error(f"初始化浏览器失败: {e}")
+            if process is not None and not isinstance(process, dict):
+                self._release_tab(process, handle)
+            browser = None
+        with self.lock:
+            self._started_locked(model)
+            stopped = self.stopped.is_set()
+            if browser is not None and not stopped:
+                self.browsers[browser.id] = browser
+                self.pool.append(browser)  # 将浏览器实例添加到池中
+                self.available.notify_all()  # 唤醒等待空闲浏览器的请求
+            self._publish_locked()
+        if browser is not None and stopped:  # 启动期间池已关闭
+            browser.process.quit()
+            return None
+        return browser
+
+    def _warmup(self, browser):
+        """
+        完成一次真实的发送和接收，使页面脚本、输入框和回复渲染路径在接收请求前都已就绪
+
+        参数：
+            browser: 刚打开聊天页面的 PooledBrowser
+
+        异常：
+            Exception: 预热对话失败
+        """
+        driver, wait = browser.driver, browser.wait
+        response_stream = ResponseStream(browser)
+        with browser.activate():
+            new_chat(driver, wait)
+            clear_auto_greeting(driver, wait)
+            response_stream.install()
+            send_message(driver, wait, CONFIG["warmup_message"], browser.elements)
+        for text, done in response_stream:
+            if done and not text:
+                raise Exception("预热回复为空")
+        logger.info(f"浏览器 {browser.id} 预热完成")
+
+    def _release_tab(self, process, handle):
+        """关闭标签页，进程因此退出时将其移出进程列表"""
+        if process.close_tab(handle):
+            with self.lock:
+                if process in self.processes:
+                    self.processes.remove(process)
+                self._publish_locked()
+
+    def _publish_locked(self):
+        """生成新的池状态快照，调用方需已持有 self.lock"""
+        models = {}  # 模型 -> 各状态的实例数
+        for browser in self.browsers.values():
+            models.setdefault(browser.model, {"idle": 0, "busy": 0, "starting": 0})["busy"] += 1
+        for browser in self.pool:
+            counts = models.setdefault(browser.model, {"idle": 0, "busy": 1, "starting": 0})
+            counts["idle"] += 1
+            counts["busy"] -= 1
+        for model, starting in self.starting_models.items():
+            models.setdefault(model, {"idle": 0, "busy": 0, "starting": 0})["starting"] = starting
+        self.stats = {
+            "total": len(self.browsers),
+            "idle": len(self.pool),
+            "busy": len(self.browsers) - len(self.pool),
+            "starting": self.starting,
+            "processes": len(self.processes),
+            "demand": self.demand,
+            "ready": len(self.browsers) >= self.ready_target(),
+            "models": models,
+        }
+
+    def ready_target(self):
+        """就绪所需的实例数量，不超过池的最大大小"""
+        return min(CONFIG["ready_min_browsers"], self.max_size)
+
+    def capacity(self):
+        """返回池中当前存活的浏览器实例数量，至少为 1"""
+        return max(len(self.browsers), 1)
+
+    def checkout_locked(self, prefer=None, exclude=(), model=None):
+        """
+        取出一个空闲浏览器实例，调用方需已持有 self.lock
+
+        参数：
+            prefer: 优先取出的浏览器编号，该实例不空闲时取其他实例
+            exclude: 不取出的浏览器编号（如重放请求时刚失败的实例）；池中没有其他实例时忽略
+            model: 只取出服务该模型的实例，为 None 时不限模型；池已满且没有实例在为该模型启动时，
+                   调配其他模型最久未用的空闲实例
 
         Returns:
-            (driver, wait): 浏览器实例和关联的 WebDriverWait 对象
+            PooledBrowser 或 None（当前没有空闲实例）
         """
-        with self.lock:  # 获取线程锁
-            if not self.pool:  # 如果池为空
-                driver, wait = init_browser()  # 新建一个浏览器实例
-                driver.get("https://chat.qwen.ai/")  # 打开目标网站
-                return driver, wait  # 返回新实例
-            return self.pool.pop()  # 弹出并返回一个已有实例
+        candidates = self.pool
+        if exclude and len(self.browsers) + self.starting > len(exclude):
+            candidates = [b for b in self.pool if b.id not in exclude]
+        if model is not None:
+            pinned = [b for b in candidates if b.model == model]
+            if not pinned and not self.starting_models[model] and len(self.browsers) + self.starting >= self.max_size:
+                pinned = candidates[:1]  # 空闲列表按归还先后排列，第一个是最久未用的
+            candidates = pinned
+        if not candidates:
+            return None
+        browser = next((b for b in candidates if b.id == prefer), None)
+        if browser is None:
+            browser = candidates[-1]  # 后进先出，优先使用最近用过的实例
+        self.pool.remove(browser)
+        if model is not None and browser.model != model:
+            logger.info(f"浏览器 {browser.id} 由 {browser.model} 调配给 {model}")
+            MODEL_SWITCHES.inc(model=model)
+            browser.model = model
+            browser.staged = False  # 由领取它的请求新建对话并切换模型
+        browser.requests += 1
+        self._publish_locked()
+        return browser
+
+    def set_demand_locked(self, demand, model_demand=None):
+        """
+        更新排队请求数，调用方需已持有 self.lock
+
+        参数：
+            demand: 当前排队等待浏览器的请求数
+            model_demand: 各模型的排队请求数，为 None 时保持不变
+        """
+        previous, self.demand = self.demand, demand
+        if model_demand is not None:
+            self.model_demand = model_demand
+        self._publish_locked()
+        if demand > previous:  # 排队增加且所需模型没有空闲实例时立即唤醒维护线程扩容
+            idle_models = {browser.model for browser in self.pool}
+            if not self.pool or any(model not in idle_models for model in self.model_demand):
+                self.wakeup.set()
+
+    def get_browser(self, timeout=None):
+        """
+        从池中获取一个浏览器实例，池为空时阻塞等待归还
+
+        参数：
+            timeout: 最长等待时间（秒），None 表示一直等待
+
+        Returns:
+            PooledBrowser: 浏览器实例
+        """
+        with self.available:  # 获取线程锁
+            self.set_demand_locked(self.demand + 1)
+            try:
+                if not self.available.wait_for(lambda: self.pool, timeout):  # 等待有空闲实例
+                    raise TimeoutError("等待空闲浏览器超时")
+                return self.checkout_locked()  # 弹出并返回一个已有实例
+            finally:
+                self.set_demand_locked(self.demand - 1)
+
+    @contextmanager
+    def borrow_idle(self):
+        """
+        暂时借出一个空闲实例做与请求无关的短操作（如读取登录凭据），结束后直接放回空闲列表，
+        不计入实例处理的请求数，也不触发归还时的预先新建对话
+
+        生成：
+            PooledBrowser，没有空闲实例时为 None
+        """
+        with self.lock:
+            browser = self.pool.pop() if self.pool else None
+            self._publish_locked()
+        try:
+            yield browser
+        finally:
+            if browser is not None:
+                with self.lock:
+                    kept = browser.id in self.browsers
+                    if kept:
+                        self._checkin_locked(browser)
+                    else:
+                        self.retiring.append(browser)  # 借出期间池已关闭或实例已被移出
+                if not kept:
+                    self.wakeup.set()
 
-    def return_browser(self, driver, wait):
+    def return_browser(self, browser):
         """
         将使用完的浏览器实例归还到池中
 
+        达到最大请求数的实例不再放回池中，交由维护线程关闭并补充新实例。
+        到期需要内存维护或启用 pool_prestage_chat 时，先在后台完成内存维护和打开空白新对话，完成后才放回空闲列表；
+        当前对话已记录到对话亲和表（keep_chat）的实例保留对话页面，不预先新建对话。
+
         参数：
-            driver: 浏览器实例
-            wait: 关联的 WebDriverWait 对象
+            browser: PooledBrowser 实例
         """
+        browser.last_used = current_time()
+        max_requests = CONFIG["pool_max_requests"]
         with self.lock:  # 获取线程锁
-            if len(self.pool) < self.size:  # 如果池中实例数量未达到上限
-                self.pool.append((driver, wait))  # 将实例归还到池中
+            if browser.id not in self.browsers:  # 实例已被移出池（如池已关闭）
+                self.retiring.append(browser)
+            elif browser.process.draining:
+                self._retire_locked(browser)
+            elif browser.broken:
+                logger.info(f"浏览器 {browser.id} 页面状态异常，回收重建")
+                self._retire_locked(browser)
+            elif max_requests and browser.requests >= max_requests:
+                logger.info(f"浏览器 {browser.id} 已处理 {browser.requests} 个请求，回收重建")
+                self._retire_locked(browser)
+            elif len(self.browsers) > self.max_size:
+                logger.info(f"池已缩容到 {self.max_size}，回收浏览器 {browser.id}")
+                self._retire_locked(browser)
+            elif browser.model not in CONFIG["models"]:
+                logger.info(f"模型 {browser.model} 已从配置中移除，回收浏览器 {browser.id}")
+                self._retire_locked(browser)
+            elif (CONFIG["pool_prestage_chat"] and not browser.keep_chat) or browser.needs_maintenance():
+                threading.Thread(target=self._stage_and_return, args=(browser,),
+                                 name="browser-stage", daemon=True).start()
+                return
             else:
-                driver.quit()  # 否则关闭该实例
+                self._checkin_locked(browser)
+                return
+        self.wakeup.set()
+
+    def _checkin_locked(self, browser):
+        """将实例放回空闲列表并唤醒等待者，调用方需已持有 self.lock"""
+        self.pool.append(browser)  # 将实例归还到池中
+        self.available.notify_all()  # 唤醒等待空闲浏览器的请求
+        self._publish_locked()
+
+    def _stage(self, browser):
+        """
+        预先打开空白新对话，失败时保持未就绪状态，由领取它的请求自行新建对话
+
+        参数：
+            browser: PooledBrowser 实例
+        """
+        try:
+            with PHASE_SECONDS.time(phase="prestage"):
+                browser.prepare()
+        except Exception as e:
+            logger.warning(f"浏览器 {browser.id} 预先新建对话失败: {e}")
+
+    def _maintain_memory(self, browser):
+        """
+        执行内存维护并更新 JS 堆快照，失败时只记录日志，内存超限由进程级 pool_max_rss_mb 兜底
+
+        参数：
+            browser: PooledBrowser 实例
+        """
+        try:
+            with PHASE_SECONDS.time(phase="memory"):
+                browser.maintain_memory()
+        except Exception as e:
+            logger.warning(f"浏览器 {browser.id} 内存维护失败: {e}")
+            return
+        if browser.js_heap is not None:
+            with self.lock:
+                if browser.id in self.browsers:  # 维护期间已回收的实例不再加入快照
+                    self.js_heap = dict(self.js_heap, **{str(browser.id): browser.js_heap})
+
+    def _stage_and_return(self, browser):
+        """后台线程：在空闲期间执行到期的内存维护、预先打开新对话，完成后放回空闲列表"""
+        if browser.needs_maintenance():
+            self._maintain_memory(browser)
+        if CONFIG["pool_prestage_chat"] and not browser.keep_chat:
+            self._stage(browser)
+        with self.lock:
+            if browser.id in self.browsers:
+                self._checkin_locked(browser)
+                return
+            self.retiring.append(browser)  # 预备期间池已关闭或实例已被移出
+        self.wakeup.set()
+
+    def apply_config(self, changed):
+        """
+        配置热加载后调整池大小，并为所有进程按新配置重建等待对象和超时
+
+        缩容时多出的空闲实例立即回收，使用中的实例在归还时回收；扩容由维护线程按需补充。
+
+        参数：
+            changed: 本次变化的 {配置项: 新值}
+        """
+        if "pool_min_size" in changed or "pool_max_size" in changed:
+            with self.lock:
+                self.min_size = CONFIG["pool_min_size"]
+                self.max_size = max(CONFIG["pool_max_size"], self.min_size)
+                for browser in list(self.pool):
+                    if len(self.browsers) <= self.max_size:
+                        break
+                    logger.info(f"池已缩容到 {self.max_size}，回收浏览器 {browser.id}")
+                    self._retire_locked(browser)
+            logger.info(f"浏览器池大小调整为 {self.min_size}-{self.max_size}")
+        if "models" in changed:
+            with self.lock:
+                for browser in list(self.pool):
+                    if browser.model not in CONFIG["models"]:
+                        logger.info(f"模型 {browser.model} 已从配置中移除，回收浏览器 {browser.id}")
+                        self._retire_locked(browser)
+        if {"wait_timeout", "poll_interval", "page_load_timeout", "stream_long_poll_timeout"} & set(changed):
+            with self.lock:
+                processes = list(self.processes)
+            for process in processes:
+                try:
+                    process.reconfigure()
+                except Exception as e:
+                    logger.warning(f"浏览器进程 {process.id} 应用新超时配置失败: {e}")
+        self.wakeup.set()  # 由维护线程按新配置补充或回收实例
+
+    def report_success(self, browser):
+        """请求成功，重置实例的连续失败计数"""
+        browser.failures = 0
+
+    def report_failure(self, browser, error):
+        """
+        记录实例上的一次请求失败，由熔断器决定是否隔离
+
+        会话失效立即隔离；其他错误连续达到 breaker_failure_threshold 次时隔离。
+        被隔离的实例在归还时移出池，由维护线程关闭并在后台补充新实例。
+
+        参数：
+            browser: PooledBrowser 实例
+            error: 失败的异常
+
+        返回：
+            错误类型，见 utils.retry.classify_error
+        """
+        kind = classify_error(error)
+        browser.failures += 1
+        if kind == "session" or browser.failures >= CONFIG["breaker_failure_threshold"]:
+            if not browser.broken:
+                logger.warning(f"浏览器 {browser.id} 熔断隔离（{kind}，连续失败 {browser.failures} 次）: {error}")
+                QUARANTINED.inc(kind=kind)
+            browser.broken = True
+        return kind
+
+    def _retire_locked(self, browser):
+        """将实例移出池并加入待关闭列表，同时删除其按实例编号统计的指标序列，调用方需已持有 self.lock"""
+        self.browsers.pop(browser.id, None)
+        BROWSER_REQUESTS.remove(browser=browser.id)
+        if str(browser.id) in self.js_heap:
+            self.js_heap = {key: value for key, value in self.js_heap.items() if key != str(browser.id)}
+        if browser in self.pool:
+            self.pool.remove(browser)
+        self.retiring.append(browser)
+        self._publish_locked()
 
     def close_all(self):
         """
         关闭池中所有浏览器实例
         """
+        self.stopped.set()
+        self.wakeup.set()
         with self.lock:  # 获取线程锁
-            for driver, _ in self.pool:  # 遍历所有实例
-                driver.quit()  # 关闭每个浏览器实例
+            processes = self.processes
+            self.processes = []
+            for browser_id in self.browsers:
+                BROWSER_REQUESTS.remove(browser=browser_id)
+            self.browsers = {}
+            self.js_heap = {}
+            self.retiring = []
             self.pool = []  # 清空池列表
+            self._publish_locked()
+        for process in processes:  # 遍历所有进程
+            process.quit()  # 关闭每个浏览器进程
 
     def cleanup_inactive(self):
-        """定期清理长时间未使用的浏览器实例"""
-        current = current_time()
-        if current - self.last_cleanup > 3600:  # 每小时检查一次
+        """
+        清理失效、内存超限、登录状态过期或长时间空闲的浏览器实例
+
+        只检查空闲实例；空闲超时的实例仅在超出最小池大小和备用数量时才会被缩容。
+        内存按进程统计，超限的进程不再分配新标签页，其标签页在空闲时逐个回收。
+        登录模板更新后，使用旧副本的进程同样不再分配新标签页，新进程使用新副本，从而逐个轮换。
+        """
+        now = current_time()
+        max_rss = CONFIG["pool_max_rss_mb"]
+        idle_timeout = CONFIG["pool_idle_timeout"]
+        with self.lock:
+            idle = list(self.pool)
+            processes = list(self.processes)
+        process_rss = {}
+        for process in processes:  # 内存检查在锁外进行
+            rss = process.rss_mb()
+            process_rss[process.id] = rss * 1024 * 1024
+            if max_rss and not process.draining and rss > max_rss:
+                logger.info(f"浏览器进程 {process.id} 内存超过 {max_rss} MB，回收重建")
+                process.draining = True
+            elif not process.draining and profile_manager.is_stale(process.profile_version):
+                logger.info(f"登录模板已更新，浏览器进程 {process.id} 换用新的用户数据副本")
+                process.draining = True
+        self.process_rss = process_rss  # 整体替换，监控读取时无需加锁
+        for browser in idle:  # 健康检查在锁外进行
+            reason = None
+            if browser.process.draining:
+                reason = "所属进程待回收"
+            elif not browser.is_alive():
+                reason = "会话失效"
             with self.lock:
-                for driver, _ in self.pool:
-                    try:
-                        driver.current_url  # 测试浏览器是否还活着
-                    except:
-                        driver.quit()
-                        self.pool.remove((driver, _))
-                self.last_cleanup = current 
\ No newline at end of file
+                if browser not in self.pool:  # 检查期间已被取走
+                    continue
+                if reason is None and now - browser.last_used > idle_timeout \
+                        and len(self.browsers) > self.min_size \
+                        and len(self.pool) > CONFIG["pool_warm_spares"]:
+                    reason = "长时间空闲"
+                if reason is not None:
+                    logger.info(f"回收浏览器 {browser.id}: {reason}")
+                    self._retire_locked(browser)
+
+    def _spawn_models(self):
+        """
+        计算需要新启动的实例，并决定各自服务的模型
+
+        排队请求的模型缺少空闲和启动中的实例时优先为其启动，其余常驻和备用实例属于 default_model。
+
+        返回：
+            每个待启动实例服务的模型列表
+        """
+        with self.lock:
+            total = len(self.browsers) + self.starting
+            busy = len(self.browsers) - len(self.pool)
+            idle = Counter(browser.model for browser in self.pool)
+            deficits = []  # 每个缺口一项
+            for model, waiting in self.model_demand.items():
+                deficits += [model] * max(waiting - idle[model] - self.starting_models[model], 0)
+            target = max(self.min_size, busy + CONFIG["pool_warm_spares"] + self.demand)
+            count = min(max(target - total, len(deficits)), self.max_size - total)
+            count = max(count, 0)
+            models = (deficits + [CONFIG["default_model"]] * count)[:count]
+            self.starting += count
+            self.starting_models.update(models)
+            self._publish_locked()
+            return models
+
+    def _maintain_loop(self):
+        """后台维护线程：回收失效实例、关闭待回收实例、按需补充实例"""
+        while not self.stopped.is_set():
+            self.wakeup.wait(CONFIG["pool_maintain_interval"])
+            self.wakeup.clear()
+            if self.stopped.is_set():
+                break
+            try:
+                self.cleanup_inactive()
+                with self.lock:
+                    retiring, self.retiring = self.retiring, []
+                for browser in retiring:  # 先关闭旧实例，释放用户数据目录后再启动新实例
+                    self._release_tab(browser.process, browser.handle)
+                profile_manager.collect_garbage()  # 删除退出时未能删除的副本
+                self._launch(self._spawn_models())  # 并行启动，不阻塞下一轮维护
+            except Exception as e:
+                logger.error(f"浏览器池维护失败: {e}")
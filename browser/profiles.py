@@ -0,0 +1,205 @@
+"""
+Chrome 用户数据目录管理模块：从已登录的模板目录为每个 Chrome 进程复制独立的副本
+
+Chrome 不允许两个进程同时使用同一个用户数据目录，因此每个进程启动前复制一份模板
+（跳过缓存和锁文件，只保留登录状态相关的数据），进程退出后删除副本。
+模板重新登录（如再次运行 login_example.py）后，旧副本所属的进程在空闲时轮换为新副本；
+异常退出遗留的副本由垃圾回收按所有者进程是否存活清理，多个工作进程共用副本目录时互不影响。
+"""
+
+import json
+import os
+import shutil
+import threading
+from itertools import count
+
+import psutil
+
+from config import CONFIG, logger
+
+# 复制模板时跳过的文件和目录：缓存、锁文件和崩溃报告等，与登录状态无关且体积较大
+SKIPPED_PATTERNS = ("Singleton*", "lockfile", "LOCK", "*.tmp", "Cache", "Code Cache", "GPUCache", "DawnCache",
+                    "DawnGraphiteCache", "DawnWebGPUCache", "GraphiteDawnCache", "GrShaderCache", "ShaderCache",
+                    "CacheStorage", "ScriptCache", "Crashpad", "BrowserMetrics*", "component_crx_cache",
+                    "optimization_guide_model_store", "Safe Browsing")
+
+# 保存登录状态的文件和目录，其修改时间的最大值作为模板版本
+AUTH_PATHS = ("Local State", "Default/Cookies", "Default/Network/Cookies", "Default/Login Data",
+              "Default/Local Storage/leveldb", "Default/Session Storage", "Default/IndexedDB")
+
+OWNER_FILE = ".qwen-owner"  # 副本目录中记录所有者进程的文件
+CLONE_PREFIX = "profile-"  # 副本目录名前缀，垃圾回收只处理带该前缀且有所有者记录的目录
+
+def overlaps_template(clone_dir, template_dir):
+    """
+    副本目录是否与模板目录相同、包含模板目录或位于模板目录之内，此时复制和清理副本可能破坏登录模板
+
+    参数：
+        clone_dir: 副本目录
+        template_dir: 模板目录
+
+    返回：
+        两者重叠时返回 True
+    """
+    clone_dir, template_dir = os.path.realpath(clone_dir), os.path.realpath(template_dir)
+    common = os.path.commonpath([clone_dir, template_dir])
+    return common in (clone_dir, template_dir)
+
+def _owner_identity(pid):
+    """
+    进程的身份标识，同时比较进程号和启动时间，避免进程号复用后误判副本仍在使用
+
+    参数：
+        pid: 进程号
+
+    返回：
+        {"pid": 进程号, "started": 启动时间}，进程不存在时返回 None
+    """
+    try:
+        return {"pid": pid, "started": psutil.Process(pid).create_time()}
+    except psutil.Error:
+        return None
+
+class ProfileManager:
+    """
+    为每个 Chrome 进程分配独立的用户数据目录
+
+    配置 profile_clone 为 false 时所有进程直接使用模板目录（此时只能启动一个 Chrome 进程）。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()  # 保护 active 集合
+        self.active = set()  # 本进程正在使用的副本目录
+        self.ids = count(1)  # 副本编号生成器
+        self.owner = _owner_identity(os.getpid())  # 写入副本目录的所有者标识
+
+    def template_dir(self):
+        """模板目录的绝对路径，不存在时创建"""
+        path = os.path.abspath(CONFIG["profile_template_dir"])
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def clone_root(self):
+        """存放副本的目录的绝对路径"""
+        return os.path.abspath(CONFIG["profile_clone_dir"])
+
+    def template_locked(self):
+        """模板是否正被其他 Chrome 进程使用（如正在重新登录），此时复制可能得到不完整的数据"""
+        return os.path.lexists(os.path.join(self.template_dir(), "SingletonLock"))
+
+    def template_version(self):
+        """
+        模板登录状态的版本
+
+        返回：
+            登录状态相关文件修改时间的最大值，模板尚未登录时返回 0
+        """
+        template = self.template_dir()
+        version = 0
+        for name in AUTH_PATHS:
+            try:
+                version = max(version, os.stat(os.path.join(template, name)).st_mtime)
+            except OSError:
+                continue
+        return version
+
+    def acquire(self):
+        """
+        为即将启动的 Chrome 进程准备用户数据目录
+
+        返回：
+            (path, version): path 为用户数据目录，version 为复制时的模板版本；
+            未启用副本时返回 (模板目录, None)
+
+        异常：
+            OSError: 复制模板失败
+        """
+        template = self.template_dir()
+        if not CONFIG["profile_clone"]:
+            return template, None
+        if overlaps_template(self.clone_root(), template):
+            raise OSError(f"profile_clone_dir 不能与 profile_template_dir 相同或互相包含: {self.clone_root()}")
+        if self.template_locked():
+            logger.warning("登录模板正被其他浏览器使用，复制的登录状态可能不完整")
+        version = self.template_version()
+        path = os.path.join(self.clone_root(), f"{CLONE_PREFIX}{os.getpid()}-{next(self.ids)}")
+        with self.lock:
+            self.active.add(path)
+        try:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, OWNER_FILE), "w", encoding="utf-8") as f:
+                json.dump(self.owner, f)  # 先写入所有者，其他进程的垃圾回收不会删除复制中的目录
+            shutil.copytree(template, path, ignore=shutil.ignore_patterns(*SKIPPED_PATTERNS), dirs_exist_ok=True)
+        except Exception:
+            self.release(path)
+            raise
+        return path, version
+
+    def release(self, path):
+        """
+        Chrome 进程退出后删除其副本，模板目录不会被删除
+
+        参数：
+            path: acquire 返回的用户数据目录
+        """
+        with self.lock:
+            if path not in self.active:
+                return
+            self.active.discard(path)
+        shutil.rmtree(path, ignore_errors=True)  # 删除失败（如子进程尚未退出）时留给垃圾回收
+
+    def is_stale(self, version):
+        """
+        副本是否落后于模板；模板正在重新登录时暂不判定，等登录完成后再轮换
+
+        参数：
+            version: acquire 返回的模板版本
+
+        返回：
+            需要换用新副本时返回 True
+        """
+        if version is None or not CONFIG["profile_refresh"] or self.template_locked():
+            return False
+        return self.template_version() > version
+
+    def collect_garbage(self):
+        """
+        删除不再使用的副本：所有者进程已退出，或属于本进程但已不在使用中
+
+        只处理名称以 profile- 开头且带有所有者记录的目录，副本目录中的其他内容一律不动；
+        副本目录与模板目录相同或包含模板目录时不做任何清理。
+
+        返回：
+            删除的副本数量
+        """
+        root = self.clone_root()
+        if overlaps_template(root, self.template_dir()):
+            return 0
+        try:
+            names = os.listdir(root)
+        except OSError:
+            return 0
+        with self.lock:
+            active = set(self.active)
+        removed = 0
+        for name in names:
+            path = os.path.join(root, name)
+            if not name.startswith(CLONE_PREFIX) or path in active or os.path.islink(path) or not os.path.isdir(path):
+                continue
+            try:
+                with open(os.path.join(path, OWNER_FILE), encoding="utf-8") as f:
+                    owner = json.load(f)
+            except (OSError, ValueError):
+                continue  # 没有所有者记录，不是本服务创建的副本（或刚创建尚未写入），不删除
+            if not isinstance(owner, dict) or not isinstance(owner.get("pid"), int):
+                continue
+            if owner != self.owner and _owner_identity(owner["pid"]) == owner:
+                continue  # 其他存活进程（如另一个工作进程）正在使用
+            shutil.rmtree(path, ignore_errors=True)
+            if not os.path.exists(path):
+                removed += 1
+        if removed:
+            logger.info(f"清理了 {removed} 个不再使用的浏览器用户数据副本")
+        return removed
+
+profile_manager = ProfileManager()  # 全局用户数据目录管理器
@@ -0,0 +1,406 @@
+"""
+注入页面执行的 JavaScript 脚本
+"""
+
+# 页面空闲（未在生成回复）时发送按钮的选择器
+IDLE_BUTTON_SELECTOR = 'button#send-message-button[disabled][class*="disabled"]'
+
+# 读取最新一条回复的公共函数：一次遍历得到段落结构（段落、代码块、列表、标题、引用、表格）、
+# 拼接后的文本以及完成状态。baseline 为发送消息前已存在的回复容器数量。
+READ_RESPONSE_JS = """
+function readResponse(baseline) {
+    var containers = document.querySelectorAll('div#response-content-container');
+    var result = {text: '', blocks: [], started: containers.length > baseline, done: false};
+    if (!result.started) { return result; }
+    var latest = containers[containers.length - 1];
+    function clean(text) { return (text || '').replace(/\\u00a0/g, ' ').replace(/\\s+$/, ''); }
+    function push(type, text, extra) {
+        if (!text) { return; }
+        var block = {type: type, text: text};
+        for (var key in extra || {}) { block[key] = extra[key]; }
+        result.blocks.push(block);
+    }
+    function listText(list, depth) {
+        var lines = [];
+        var ordered = list.tagName === 'OL';
+        var number = parseInt(list.getAttribute('start') || '1', 10);
+        var indent = new Array(depth + 1).join('  ');
+        Array.prototype.forEach.call(list.children, function (item) {
+            if (item.tagName !== 'LI') { return; }
+            var own = [];
+            var nested = [];
+            Array.prototype.forEach.call(item.childNodes, function (node) {
+                if (node.nodeType === 1 && (node.tagName === 'UL' || node.tagName === 'OL')) {
+                    nested.push(listText(node, depth + 1));
+                } else {
+                    own.push(node.nodeType === 1 ? node.innerText : node.textContent);
+                }
+            });
+            var marker = ordered ? (number++) + '. ' : '- ';
+            lines.push(indent + marker + clean(own.join('')).trim());
+            nested.forEach(function (text) { if (text) { lines.push(text); } });
+        });
+        return lines.join('\\n');
+    }
+    function tableText(table) {
+        var lines = [];
+        Array.prototype.forEach.call(table.querySelectorAll('tr'), function (row, index) {
+            var cells = Array.prototype.map.call(row.children, function (cell) {
+                return clean(cell.innerText).replace(/\\n/g, ' ');
+            });
+            lines.push('| ' + cells.join(' | ') + ' |');
+            if (index === 0) {
+                lines.push('|' + cells.map(function () { return ' --- '; }).join('|') + '|');
+            }
+        });
+        return lines.join('\\n');
+    }
+    function walk(node) {
+        Array.prototype.forEach.call(node.children, function (el) {
+            var tag = el.tagName;
+            if (tag === 'P') {
+                push('paragraph', clean(el.innerText));
+            } else if (tag === 'PRE') {
+                var code = el.querySelector('code') || el;
+                var match = /language-([\\w+#-]+)/.exec(code.className || '');
+                var language = match ? match[1] : '';
+                var body = (code.textContent || '').replace(/\\n$/, '');
+                push('code', '```' + language + '\\n' + body + '\\n```', {language: language});
+            } else if (tag === 'UL' || tag === 'OL') {
+                push('list', listText(el, 0));
+            } else if (/^H[1-6]$/.test(tag)) {
+                push('heading', new Array(+tag[1] + 1).join('#') + ' ' + clean(el.innerText));
+            } else if (tag === 'BLOCKQUOTE') {
+                push('quote', clean(el.innerText).split('\\n').map(function (line) {
+                    return '> ' + line;
+                }).join('\\n'));
+            } else if (tag === 'TABLE') {
+                push('table', tableText(el));
+            } else {
+                walk(el);
+            }
+        });
+    }
+    walk(latest);
+    result.text = result.blocks.map(function (block) { return block.text; }).join('\\n');
+    result.done = !!document.querySelector('button#send-message-button[disabled][class*="disabled"]');
+    return result;
+}
+"""
+
+# 网络流捕获：包装页面的 window.fetch，将补全请求的 SSE 响应体 tee 成两份，
+# 一份原样交还页面渲染，另一份在页面内逐行解析 data: 事件，累加 choices[0].delta.content。
+# 通过 CDP Page.addScriptToEvaluateOnNewDocument 注册，在页面自身脚本之前执行；
+# 每段数据解析后直接唤醒 window.__qwenStream，无需等待 DOM 渲染。思考阶段（phase 不为 answer）的内容不计入回复。
+# 匹配的请求地址由 window.__qwenTapPattern（正则字符串）指定。
+NETWORK_TAP_JS = """
+(function () {
+    if (window.__qwenTap || !window.fetch) { return; }
+    var pattern = new RegExp(window.__qwenTapPattern || '/api/(v[0-9]+/)?chat/completions');
+    var tap = window.__qwenTap = {count: 0, captures: []};
+    var originalFetch = window.fetch;
+    function notify() {
+        var state = window.__qwenStream;
+        if (state && state.update) { state.update(); }
+    }
+    function handle(capture, line) {
+        if (line.indexOf('data:') !== 0) { return; }
+        var data = line.slice(5).trim();
+        if (data === '[DONE]') { capture.done = true; return; }
+        var event;
+        try { event = JSON.parse(data); } catch (e) { return; }
+        var choice = event.choices && event.choices[0];
+        if (!choice) { return; }
+        var delta = choice.delta || choice.message || {};
+        if (typeof delta.content === 'string' && (!delta.phase || delta.phase === 'answer')) {
+            capture.text += delta.content;
+        }
+        if (choice.finish_reason || delta.status === 'finished') { capture.done = true; }
+    }
+    function consume(body, capture) {
+        var reader = body.getReader();
+        var decoder = new TextDecoder();
+        var buffer = '';
+        function pump() {
+            return reader.read().then(function (result) {
+                if (result.done) {
+                    if (buffer) { handle(capture, buffer); }
+                    capture.done = true;
+                    notify();
+                    return;
+                }
+                buffer += decoder.decode(result.value, {stream: true});
+                var lines = buffer.split(/\\r?\\n/);
+                buffer = lines.pop();
+                lines.forEach(function (line) { handle(capture, line); });
+                notify();
+                return pump();
+            });
+        }
+        pump().catch(function (error) {  // 请求被中止（如点击停止按钮）或连接中断，回退到 DOM
+            capture.error = String(error);
+            notify();
+        });
+    }
+    window.fetch = function (input) {
+        var url = typeof input === 'string' ? input : (input && input.url) || String(input);
+        var promise = originalFetch.apply(this, arguments);
+        if (!pattern.test(url)) { return promise; }
+        return promise.then(function (response) {
+            var type = response.headers.get('content-type') || '';
+            if (!response.body || type.indexOf('event-stream') === -1) { return response; }
+            var branches = response.body.tee();
+            tap.count += 1;
+            var capture = {id: tap.count, text: '', done: false, error: null};
+            tap.captures.push(capture);
+            if (tap.captures.length > 8) { tap.captures.shift(); }  // 只保留最近几次捕获
+            consume(branches[1], capture);
+            return new Response(branches[0], {
+                status: response.status, statusText: response.statusText, headers: response.headers
+            });
+        });
+    };
+})();
+"""
+
+# 在页面中安装 MutationObserver，记录最新一条回复的文本和完成状态。
+# 必须在发送消息之前安装：安装时已存在的回复容器数量作为基线，只关注之后新出现的回复。
+# 页面装有网络流捕获且安装后出现了新的捕获时，优先使用捕获到的文本（source 为 network），
+# 没有捕获、捕获出错或捕获结束却没有内容时回退到读取 DOM（source 为 dom）。
+STREAM_INSTALL_JS = READ_RESPONSE_JS + """
+var old = window.__qwenStream;
+if (old && old.observer) { old.observer.disconnect(); }
+if (window.__qwenGreetingGuard) {  // 即将发送消息，停止清除问候语，避免误删回复内容
+    window.__qwenGreetingGuard.disconnect();
+    window.__qwenGreetingGuard = null;
+}
+var state = {
+    version: 0,
+    text: '',
+    blocks: [],
+    done: false,
+    waiters: [],
+    source: 'dom',
+    baseline: document.querySelectorAll('div#response-content-container').length,
+    captureSince: window.__qwenTap ? window.__qwenTap.count : 0
+};
+function capture() {
+    var tap = window.__qwenTap;
+    var latest = tap && tap.captures[tap.captures.length - 1];
+    if (!latest || latest.id <= state.captureSince || latest.error) { return null; }
+    if (latest.done && !latest.text) { return null; }
+    return latest;
+}
+state.read = function () {
+    var captured = capture();
+    if (captured) {
+        return {text: captured.text, blocks: [{type: 'markdown', text: captured.text}],
+                started: true, done: captured.done, source: 'network'};
+    }
+    var current = readResponse(state.baseline);
+    current.source = 'dom';
+    return current;
+};
+function update() {
+    var current = state.read();
+    if (current.text === state.text && current.done === state.done) { return; }
+    state.text = current.text;
+    state.blocks = current.blocks;
+    state.done = current.done;
+    state.source = current.source;
+    state.version += 1;
+    var waiters = state.waiters;
+    state.waiters = [];
+    waiters.forEach(function (wake) { wake(); });
+}
+state.snapshot = function () {
+    return {version: state.version, text: state.text, blocks: state.blocks, done: state.done, source: state.source};
+};
+state.update = update;
+state.observer = new MutationObserver(update);
+state.observer.observe(document.body, {
+    childList: true, subtree: true, characterData: true,
+    attributes: true, attributeFilter: ['disabled', 'class']
+});
+window.__qwenStream = state;
+return state.baseline;
+"""
+
+# 长轮询：状态版本号与调用方已知版本不同时返回，否则等待变化或超时后返回当前状态。
+# 文本少量增长时在页面内合并：自首次变化起最多再等 coalesceMs 毫秒，或新增字符数达到 flushChars 时返回；
+# 首段文本和完成状态立即返回。页面未安装监听时返回 null。
+# 参数：arguments[0] 已知版本号，arguments[1] 超时毫秒数，arguments[2] 合并等待毫秒数，
+#       arguments[3] 立即返回的新增字符数，arguments[4] 调用方已知文本长度。
+STREAM_POLL_JS = """
+var since = arguments[0];
+var timeoutMs = arguments[1];
+var coalesceMs = arguments[2];
+var flushChars = arguments[3];
+var sinceLength = arguments[4];
+var callback = arguments[arguments.length - 1];
+var state = window.__qwenStream;
+if (!state) { callback(null); return; }
+function ready() {
+    return state.done || sinceLength === 0 || coalesceMs <= 0 ||
+        state.text.length - sinceLength >= flushChars;
+}
+if (state.version !== since && ready()) { callback(state.snapshot()); return; }
+var finished = false;
+var timer = null;
+var flushTimer = null;
+function finish() {
+    if (finished) { return; }
+    finished = true;
+    clearTimeout(timer);
+    clearTimeout(flushTimer);
+    callback(state.snapshot());
+}
+function onChange() {
+    if (finished) { return; }
+    if (ready()) { finish(); return; }
+    if (flushTimer === null) { flushTimer = setTimeout(finish, coalesceMs); }
+    state.waiters.push(onChange);
+}
+timer = setTimeout(finish, timeoutMs);
+if (state.version !== since) { onChange(); } else { state.waiters.push(onChange); }
+"""
+
+# 一次往返提取最新回复：已安装流式监听时沿用其读取方式（网络捕获优先、DOM 回退），否则视页面上所有回复为本次回复。
+EXTRACT_RESPONSE_JS = READ_RESPONSE_JS + """
+var state = window.__qwenStream;
+return state ? state.read() : readResponse(0);
+"""
+
+# 页面仍在生成回复时点击停止按钮（生成期间发送按钮即停止按钮），返回是否点击了按钮。
+# 参数：arguments[0] 页面空闲时发送按钮的选择器。
+STOP_GENERATION_JS = """
+var state = window.__qwenStream;
+if (state && state.done) { return false; }
+var button = document.querySelector('button#send-message-button');
+if (!button || document.querySelector(arguments[0])) { return false; }
+button.click();
+return true;
+"""
+
+# 页面顶部的模型选择按钮和展开后的模型菜单项
+MODEL_BUTTON_SELECTOR = '#model-selector-0-button, button[aria-label="Select a model"]'
+MODEL_ITEM_SELECTOR = 'button[aria-label="model-item"], [role="menuitem"][data-value], [role="option"][data-value]'
+
+# 选择模型，每次调用只推进一步，由调用方轮询直到返回最终状态：
+# selected 当前已是目标模型；opened 已展开模型菜单；clicked 已点击目标菜单项、等待切换生效；
+# missing 菜单中没有目标模型（已收起菜单）；none 页面没有模型选择按钮。
+# 模型名称不区分大小写，与菜单项的 data-value 相等或包含在按钮、菜单项文本中即视为匹配。
+# 参数：arguments[0] 页面模型菜单中的模型名称，arguments[1] 模型选择按钮的选择器，arguments[2] 菜单项的选择器。
+SELECT_MODEL_JS = """
+var label = arguments[0].toLowerCase();
+var button = document.querySelector(arguments[1]);
+if (!button) { return 'none'; }
+function matches(element) {
+    var value = (element.getAttribute('data-value') || '').toLowerCase();
+    return value === label || (element.textContent || '').toLowerCase().indexOf(label) !== -1;
+}
+var items = document.querySelectorAll(arguments[2]);
+if (!items.length) {
+    if (matches(button)) { return 'selected'; }
+    button.click();
+    return 'opened';
+}
+for (var i = 0; i < items.length; i++) {
+    if (matches(items[i])) { items[i].click(); return 'clicked'; }
+}
+button.click();
+return 'missing';
+"""
+
+# 读取页面调用后端接口时使用的登录信息：localStorage 中的 token、浏览器的 User-Agent 和页面来源。
+HARVEST_CREDENTIALS_JS = """
+var token = null;
+try { token = window.localStorage.getItem('token'); } catch (e) {}
+return {token: token, userAgent: navigator.userAgent, origin: location.origin};
+"""
+
+# 新对话是否已就绪：输入框已出现且页面上没有任何回复容器。
+FRESH_CHAT_JS = """
+return !!document.getElementById('chat-input') &&
+    !document.querySelector('div#response-content-container');
+"""
+
+# 重新打开的对话是否已就绪：输入框已出现且已有回复全部渲染，避免发送前统计的回复数量偏少。
+# 参数：arguments[0] 对话中已有的回复数量。
+OPENED_CHAT_JS = """
+return !!document.getElementById('chat-input') &&
+    document.querySelectorAll('div#response-content-container').length >= arguments[0];
+"""
+
+# 清除自动问候语：一次遍历移除文本同时包含 profile 和 Qwen 的元素，并安装监听持续清除之后渲染出的问候语，
+# 监听在安装回复监听（即将发送消息）时断开。返回本次移除的元素数量。
+GREETING_GUARD_JS = """
+function isGreeting(text) { return !!text && text.indexOf('profile') !== -1 && text.indexOf('Qwen') !== -1; }
+function sweep(root) {
+    var walker = document.createTreeWalker(root, NodeFilter.SHOW_TEXT);
+    var found = [];
+    if (root.nodeType === 3 && isGreeting(root.nodeValue)) { found.push(root.parentNode); }
+    while (walker.nextNode()) {
+        if (isGreeting(walker.currentNode.nodeValue)) { found.push(walker.currentNode.parentNode); }
+    }
+    found.forEach(function (element) {
+        if (element && element.parentNode && element !== document.body) { element.parentNode.removeChild(element); }
+    });
+    return found.length;
+}
+var removed = sweep(document.body);
+if (!window.__qwenGreetingGuard) {
+    window.__qwenGreetingGuard = new MutationObserver(function (mutations) {
+        mutations.forEach(function (mutation) {
+            mutation.addedNodes.forEach(function (node) { if (node.parentNode) { sweep(node); } });
+        });
+    });
+    window.__qwenGreetingGuard.observe(document.body, {childList: true, subtree: true});
+}
+return removed;
+"""
+
+# 一次往返写入输入框并触发 input 事件，返回发送按钮是否已可点击。
+# 参数：arguments[0] 输入框元素，arguments[1] 消息文本，为 null 时使用 APPEND_INPUT_JS 分块暂存的文本，
+#       arguments[2] 发送按钮元素。
+SET_INPUT_JS = """
+var input = arguments[0];
+var text = arguments[1];
+if (text === null) {
+    text = (window.__qwenInput || []).join('');
+    window.__qwenInput = null;
+}
+input.value = text;
+input.dispatchEvent(new Event('input', { bubbles: true }));
+var button = arguments[2];
+return !!button && !button.disabled;
+"""
+
+# 超长消息分块暂存到页面中，最后由 SET_INPUT_JS 一次写入输入框，避免单次往返的负载过大。
+# 参数：arguments[0] 文本块，arguments[1] 是否为第一块（清空之前暂存的内容）。
+APPEND_INPUT_JS = """
+if (arguments[1] || !window.__qwenInput) { window.__qwenInput = []; }
+window.__qwenInput.push(arguments[0]);
+"""
+
+# 请求间隙的页面内存整理：清空较早回复容器的内容（保留容器本身，回复计数基线不变）、
+# 断开上一次请求的回复监听、丢弃已结束的网络流捕获，最后触发一次 JS 垃圾回收（需 --expose-gc）。
+# 返回清空的回复数。参数：arguments[0] 保留内容的最近回复数。
+MEMORY_PRUNE_JS = """
+var keep = arguments[0];
+var containers = document.querySelectorAll('div#response-content-container');
+var pruned = 0;
+for (var i = 0; i < containers.length - keep; i++) {
+    if (containers[i].firstChild) {
+        containers[i].textContent = '';
+        pruned += 1;
+    }
+}
+var state = window.__qwenStream;
+if (state && state.observer) { state.observer.disconnect(); }
+window.__qwenStream = null;
+if (window.__qwenTap) { window.__qwenTap.captures = []; }
+window.__qwenInput = null;
+if (window.gc) { window.gc(); }
+return pruned;
+"""
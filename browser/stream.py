@@ -0,0 +1,86 @@
+"""
+流式响应读取模块，通过页面内 MutationObserver（或网络流捕获）推送文本变化
+"""
+
+from time import time as current_time
+
+from config import CONFIG
+from browser.scripts import STREAM_INSTALL_JS, STREAM_POLL_JS
+
+class ResponseStream:
+    """
+    页面回复的流式读取器
+
+    先调用 install() 在页面中安装监听，再发送消息，然后迭代本对象获取 (文本, 是否完成)。
+    每次迭代只需一次 execute_async_script 往返，文本变化时立即返回，不做固定间隔轮询。
+    """
+
+    def __init__(self, browser):
+        """
+        参数：
+            browser: PooledBrowser 实例
+        """
+        self.browser = browser
+        self.driver = browser.driver
+        self.version = 0  # 已读取到的状态版本号
+        self.baseline = 0  # 发送消息前页面中已有的回复数量
+        self.text = ""  # 已读取到的回复文本
+        self.source = None  # 回复文本的来源：network（网络流捕获）或 dom
+        self.installed_at = None  # 安装监听（即将发送消息）的时间
+        self.first_text_at = None  # 首次读到回复文本的时间
+        self.finished_at = None  # 回复生成完成的时间
+
+    def install(self):
+        """在页面中安装 MutationObserver，必须在发送消息前、在 browser.activate() 内调用"""
+        self.baseline = self.driver.execute_script(STREAM_INSTALL_JS)
+        self.version = 0
+        self.text = ""
+        self.source = None
+        self.installed_at = current_time()
+
+    def poll(self):
+        """
+        长轮询一次页面状态
+
+        进程被多个标签页共用时缩短单次等待时间，避免长时间占用活动窗口。
+        少量文本增长在页面内按 stream_flush_interval / stream_flush_chars 合并后再返回，减少往返和 chunk 数量。
+
+        返回：
+            包含 version、text、done、source 的字典
+
+        异常：
+            Exception: 页面中的监听已失效（如页面被刷新）
+        """
+        timeout = CONFIG["tab_long_poll_timeout"] if self.browser.shared() else CONFIG["stream_long_poll_timeout"]
+        with self.browser.activate():
+            snapshot = self.driver.execute_async_script(
+                STREAM_POLL_JS, self.version, int(timeout * 1000),
+                int(CONFIG["stream_flush_interval"] * 1000), CONFIG["stream_flush_chars"], len(self.text))
+        if snapshot is None:
+            raise Exception("页面响应监听已失效")
+        return snapshot
+
+    def __iter__(self):
+        """
+        迭代回复的变化，直到回复完成
+
+        生成：
+            (text, done): 当前完整回复文本和是否已完成
+        """
+        deadline = current_time() + CONFIG["generation_timeout"]
+        while True:
+            if current_time() > deadline:
+                raise TimeoutError("等待回复生成超时")
+            snapshot = self.poll()
+            if snapshot["version"] == self.version:  # 长轮询超时，页面无变化
+                continue
+            self.version = snapshot["version"]
+            self.text = snapshot["text"]
+            self.source = snapshot.get("source", "dom")
+            if self.first_text_at is None and snapshot["text"]:
+                self.first_text_at = current_time()
+            if snapshot["done"]:
+                self.finished_at = current_time()
+            yield snapshot["text"], snapshot["done"]
+            if snapshot["done"]:
+                return
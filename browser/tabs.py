@@ -0,0 +1,130 @@
+"""
+多标签页管理模块，让一个 Chrome 进程同时服务多个对话
+"""
+
+import itertools
+import threading
+from contextlib import contextmanager
+
+import psutil
+
+from config import logger
+from browser.actions import configure_timeouts
+from browser.profiles import profile_manager
+
+class BrowserProcess:
+    """
+    一个 Chrome 进程及其打开的标签页
+
+    WebDriver 同一时刻只能操作一个活动窗口，因此所有标签页共用一把可重入锁：
+    标签页在 activate() 期间独占该进程，必要时先切换到自己的窗口再执行命令。
+    """
+    _ids = itertools.count(1)  # 进程编号生成器
+
+    def __init__(self, driver, wait, profile=None, profile_version=None):
+        """
+        参数：
+            driver: Chrome WebDriver 对象
+            wait: 关联的 WebDriverWait 对象
+            profile: 进程独占的用户数据目录，进程退出后交还 profile_manager
+            profile_version: 复制用户数据目录时的登录模板版本，模板更新后据此轮换进程
+        """
+        self.id = next(self._ids)  # 进程编号，便于日志和统计
+        self.driver = driver
+        self.wait = wait
+        self.profile = profile
+        self.profile_version = profile_version
+        self.lock = threading.RLock()  # 活动窗口调度锁
+        self.current_handle = driver.current_window_handle  # 当前活动窗口
+        self.spare_handle = self.current_handle  # 启动时自带的窗口，第一个标签页直接使用
+        self.tabs = 0  # 已打开（含预留）的标签页数
+        self.draining = False  # 为 True 时不再分配新标签页，所有标签页关闭后退出进程
+
+    @contextmanager
+    def activate(self, handle):
+        """
+        独占进程并切换到指定窗口
+
+        参数：
+            handle: 目标标签页的窗口句柄
+        """
+        with self.lock:
+            if self.current_handle != handle:
+                self.driver.switch_to.window(handle)
+                self.current_handle = handle
+            yield self.driver
+
+    def reconfigure(self):
+        """按当前配置重新设置超时并替换等待对象，进行中的操作继续使用旧的等待对象"""
+        with self.lock:
+            self.wait = configure_timeouts(self.driver)
+
+    def open_tab(self):
+        """
+        打开一个新标签页，调用方需已通过 tabs 计数预留名额
+
+        返回：
+            新标签页的窗口句柄
+        """
+        with self.lock:
+            if self.spare_handle is not None:
+                handle, self.spare_handle = self.spare_handle, None
+                return handle
+            self.driver.switch_to.new_window("tab")
+            self.current_handle = self.driver.current_window_handle
+            return self.current_handle
+
+    def close_tab(self, handle):
+        """
+        关闭一个标签页，最后一个标签页关闭时退出整个进程
+
+        参数：
+            handle: 要关闭的窗口句柄，为 None 表示仅释放预留名额
+
+        返回：
+            进程是否已退出
+        """
+        with self.lock:
+            self.tabs -= 1
+            if self.tabs <= 0:
+                self.quit()
+                return True
+            if handle is None:
+                return False
+            try:
+                if self.current_handle != handle:
+                    self.driver.switch_to.window(handle)
+                self.driver.close()  # 关闭当前窗口
+            except Exception as e:
+                logger.warning(f"关闭标签页失败: {e}")
+            self.current_handle = None  # 关闭后没有活动窗口，下次使用前必须切换
+            return False
+
+    def rss_mb(self):
+        """
+        统计 Chrome 进程树的常驻内存（MB）
+
+        返回：
+            内存占用，无法获取时返回 0
+        """
+        try:
+            root = psutil.Process(self.driver.service.process.pid)  # chromedriver 进程
+            procs = [root] + root.children(recursive=True)  # 包含所有 Chrome 子进程
+            total = 0
+            for proc in procs:
+                try:
+                    total += proc.memory_info().rss
+                except psutil.Error:
+                    continue
+            return total / 1024 / 1024
+        except Exception:
+            return 0
+
+    def quit(self):
+        """退出浏览器进程并删除其用户数据副本，忽略关闭过程中的异常"""
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.warning(f"关闭浏览器进程 {self.id} 失败: {e}")
+        if self.profile is not None:
+            profile_manager.release(self.profile)
@@ -5,44 +5,299 @@
 import yaml
 import logging
 import os
+import threading
+from time import sleep, time as current_time
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('qwen_browser.log'),
-        logging.StreamHandler()
-    ]
-)
+from utils.logs import install_queue_handler, setup_logging
+
+# 配置日志：业务线程只写入内存队列，读取配置后再启动后台写线程
+install_queue_handler()
 logger = logging.getLogger(__name__)
 
 # 默认配置
 DEFAULT_CONFIG = {
+    "chat_url": "https://chat.qwen.ai/",
+    "models": {"qwen-plus": "Qwen2.5-Plus", "qwen-max": "Qwen2.5-Max", "qwen-turbo": "Qwen2.5-Turbo",
+               "qwq-32b": "QwQ-32B"},
+    "default_model": "qwen-plus",
     "headless": True,
-    "page_load_timeout": 20,
-    "wait_timeout": 15,
+    "page_load_timeout": 20.0,
+    "wait_timeout": 15.0,
     "retry_max": 3,
     "retry_delay": 0.5,
+    "retry_max_delay": 4.0,
+    "request_replays": 1,
+    "breaker_failure_threshold": 3,
     "poll_interval": 0.2,
+    "stream_long_poll_timeout": 5.0,
+    "generation_timeout": 300.0,
+    "stream_flush_interval": 0.05,
+    "stream_flush_chars": 64,
+    "network_capture": False,
+    "network_capture_pattern": "/api/(v[0-9]+/)?chat/completions",
+    "direct_transport": False,
+    "direct_api_url": "",
+    "direct_model_map": {},
+    "direct_credentials_ttl": 600.0,
+    "direct_max_concurrency": 16,
+    "context_max_tokens": 0,
+    "input_chunk_chars": 32768,
+    "pool_min_size": 1,
+    "pool_max_size": 1,
+    "pool_warm_spares": 1,
+    "pool_max_requests": 200,
+    "pool_max_rss_mb": 1500,
+    "pool_idle_timeout": 600.0,
+    "memory_maintenance_interval": 10,
+    "memory_keep_replies": 2,
+    "memory_clear_storage": "cache_storage,shader_cache",
+    "blocked_resources": ["analytics", "media"],
+    "blocked_url_patterns": [],
+    "pool_maintain_interval": 5.0,
+    "pool_startup_workers": 4,
+    "ready_min_browsers": 1,
+    "warmup_message": "你好",
+    "pool_prestage_chat": True,
+    "tabs_per_browser": 1,
+    "profile_clone": True,
+    "profile_template_dir": "selenium_user_data",
+    "profile_clone_dir": "selenium_profiles",
+    "profile_refresh": True,
+    "tab_long_poll_timeout": 0.5,
+    "max_queue_size": 5,
+    "max_wait_time": 30.0,
+    "cache_enabled": True,
+    "cache_max_entries": 256,
+    "cache_ttl": 300.0,
+    "affinity_enabled": True,
+    "affinity_max_entries": 1024,
+    "affinity_ttl": 1800.0,
+    "workers": 0,
+    "worker_base_port": 5101,
+    "worker_urls": [],
+    "worker_health_interval": 1.0,
     "host": "0.0.0.0",
-    "port": 5000
+    "port": 5000,
+    "recorder_capacity": 1000,
+    "admin_token": "",
+    "log_level": "INFO",
+    "log_file": "qwen_browser.log",
+    "log_max_bytes": 10485760,
+    "log_backup_count": 5,
+    "log_console_format": "text",
+    "log_rate_limit_window": 60.0,
+    "log_rate_limit_burst": 10,
+    "config_watch_interval": 2.0
+}
+
+CONFIG_FILE = "config.yaml"  # 配置文件路径
+
+# 修改后需要重启进程才能生效的配置项：热加载时保持原值，在 pending_restart 中列出。
+# 地址和路径类配置项也只在重启时生效，避免通过热加载把登录凭据发往其他主机或在任意路径读写文件
+RESTART_REQUIRED_KEYS = frozenset({"host", "port", "headless", "workers", "worker_base_port", "worker_urls",
+                                   "pool_startup_workers", "chat_url", "direct_api_url", "log_file",
+                                   "profile_template_dir", "profile_clone_dir"})
+
+# 取值有限的配置项
+CONFIG_CHOICES = {
+    "log_level": ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"),
+    "log_console_format": ("text", "json"),
 }
 
-# 请求队列配置
-MAX_QUEUE_SIZE = 5  # 定义请求队列最大请求数为 5
-MAX_WAIT_TIME = 30  # 最大等待时间（秒）
+def read_config_file(path=CONFIG_FILE):
+    """
+    读取配置文件并与默认配置合并
+
+    参数：
+        path: 配置文件路径
+
+    返回：
+        完整的配置字典，文件中未出现的配置项取默认值
+
+    异常：
+        Exception: 文件无法读取、不是合法的 YAML 或顶层不是键值映射
+    """
+    with open(path, 'r', encoding='utf-8') as f:  # 明确指定使用 UTF-8 编码
+        config = yaml.safe_load(f) or {}
+    if not isinstance(config, dict):
+        raise ValueError("配置文件的顶层必须是键值映射")
+    # 合并默认配置和文件配置
+    return {**DEFAULT_CONFIG, **config}
 
 def load_config():
-    """加载配置文件，如果失败则使用默认配置"""
+    """加载配置文件，如果失败或校验不通过则使用默认配置"""
     try:
-        with open('config.yaml', 'r', encoding='utf-8') as f:  # 明确指定使用 UTF-8 编码
-            config = yaml.safe_load(f)
-        # 合并默认配置和文件配置
-        return {**DEFAULT_CONFIG, **config}
+        config = read_config_file()
     except Exception as e:
         logger.error(f"加载配置文件失败: {e}")
-        return DEFAULT_CONFIG  # 使用默认配置
+        return dict(DEFAULT_CONFIG)  # 使用默认配置
+    errors = validate_config(config)
+    if errors:
+        logger.error(f"配置无效，使用默认配置: {'; '.join(errors)}")
+        return dict(DEFAULT_CONFIG)  # 与热加载失败时保持当前配置一致，不带着无效取值启动
+    return config
+
+def validate_config(config):
+    """
+    校验完整配置：配置项必须已知，取值类型与默认值一致，数值不能为负
+
+    参数：
+        config: 完整的配置字典
+
+    返回：
+        错误信息列表，为空表示校验通过
+    """
+    errors = []
+    for key, value in config.items():
+        if key not in DEFAULT_CONFIG:
+            errors.append(f"未知的配置项 {key}")
+            continue
+        default = DEFAULT_CONFIG[key]
+        if isinstance(default, bool):
+            valid = isinstance(value, bool)
+        elif isinstance(default, int):  # 数量类配置项必须为整数
+            valid = isinstance(value, int) and not isinstance(value, bool) and value >= 0
+        elif isinstance(default, float):  # 时间类配置项可以为整数或小数
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+        else:
+            valid = isinstance(value, type(default))
+        if not valid:
+            errors.append(f"{key} 的取值 {value!r} 无效，应为与默认值 {default!r} 同类型的值")
+        elif key in CONFIG_CHOICES and str(value).upper() not in (c.upper() for c in CONFIG_CHOICES[key]):
+            errors.append(f"{key} 的取值 {value!r} 无效，可选值为 {', '.join(CONFIG_CHOICES[key])}")
+    if not errors:
+        if config["pool_min_size"] > config["pool_max_size"]:
+            errors.append("pool_min_size 不能大于 pool_max_size")
+        if config["tabs_per_browser"] < 1:
+            errors.append("tabs_per_browser 至少为 1")
+        if config["max_queue_size"] < 1:
+            errors.append("max_queue_size 至少为 1")
+        if config["worker_health_interval"] <= 0:
+            errors.append("worker_health_interval 必须大于 0")
+        clone_dir = os.path.realpath(config["profile_clone_dir"])
+        template_dir = os.path.realpath(config["profile_template_dir"])
+        if os.path.commonpath([clone_dir, template_dir]) in (clone_dir, template_dir):
+            errors.append("profile_clone_dir 不能与 profile_template_dir 相同或互相包含")
+        if not all(isinstance(label, str) for label in config["models"].values()):
+            errors.append("models 的取值应为页面模型菜单中的模型名称")
+        if not all(isinstance(backend, str) for backend in config["direct_model_map"].values()):
+            errors.append("direct_model_map 的取值应为后端接口使用的模型编号")
+        if config["default_model"] not in config["models"]:
+            errors.append(f"default_model {config['default_model']!r} 不在 models 中")
+    return errors
 
 # 加载配置
-CONFIG = load_config() 
\ No newline at end of file
+CONFIG = load_config()
+setup_logging(CONFIG)
+
+config_lock = threading.Lock()  # 串行化配置的校验和应用
+config_listeners = []  # 配置变化时调用的回调，参数为 {配置项: 新值}
+pending_restart = {}  # 已修改但需重启才生效的配置项 -> 新值
+last_reload = {"source": "startup", "time": current_time(), "applied": [], "errors": []}  # 最近一次热加载的结果
+
+def on_config_change(listener):
+    """
+    注册配置变化的回调，各模块借此把新配置应用到已创建的对象（浏览器池、队列、缓存等）
+
+    参数：
+        listener: 回调函数，参数为本次变化的 {配置项: 新值}，在配置已更新后调用
+    """
+    config_listeners.append(listener)
+
+def apply_config(candidate, source):
+    """
+    校验并应用一份完整的新配置
+
+    先整体校验，任一项无效则整份配置都不应用；校验通过后一次性更新 CONFIG，再依次通知各模块。
+    需重启才生效的配置项保持原值，记录在 pending_restart 中。
+
+    参数：
+        candidate: 完整的新配置字典
+        source: 配置来源，如 "file"、"admin"，用于日志和状态报告
+
+    返回：
+        字典，包含 applied（已生效的变化）、pending_restart（需重启的变化）和 errors（校验错误）
+    """
+    with config_lock:
+        errors = validate_config(candidate)
+        if errors:
+            logger.error(f"配置热加载（{source}）失败，保持当前配置: {'; '.join(errors)}")
+            last_reload.update(source=source, time=current_time(), applied=[], errors=errors)
+            return {"applied": {}, "pending_restart": dict(pending_restart), "errors": errors}
+        changed = {key: value for key, value in candidate.items() if CONFIG.get(key) != value}
+        for key in RESTART_REQUIRED_KEYS:
+            if key in changed:
+                pending_restart[key] = changed.pop(key)
+            elif candidate.get(key) == CONFIG.get(key):
+                pending_restart.pop(key, None)  # 已改回当前值
+        CONFIG.update(changed)  # 一次性更新，读取方不会看到只应用了一部分的配置
+        for listener in config_listeners:
+            try:
+                listener(changed)
+            except Exception as e:
+                logger.error(f"应用配置变化失败（{getattr(listener, '__qualname__', listener)}）: {e}")
+        last_reload.update(source=source, time=current_time(), applied=sorted(changed), errors=[])
+        if changed:
+            logger.info(f"配置热加载（{source}）已应用: {', '.join(sorted(changed))}")
+        return {"applied": changed, "pending_restart": dict(pending_restart), "errors": []}
+
+def reload_config(source="file"):
+    """
+    重新读取配置文件并应用，文件中删除的配置项恢复默认值
+
+    返回：
+        同 apply_config，文件无法读取时 errors 中包含读取错误
+    """
+    try:
+        candidate = read_config_file()
+    except Exception as e:
+        logger.error(f"重新加载配置文件失败，保持当前配置: {e}")
+        last_reload.update(source=source, time=current_time(), applied=[], errors=[str(e)])
+        return {"applied": {}, "pending_restart": dict(pending_restart), "errors": [str(e)]}
+    return apply_config(candidate, source)
+
+def patch_config(values, source="admin"):
+    """
+    在当前配置的基础上修改部分配置项并应用（不写入配置文件，配置文件变化时会被文件内容覆盖）
+
+    参数：
+        values: 需要修改的 {配置项: 新值}
+
+    返回：
+        同 apply_config
+    """
+    return apply_config({**CONFIG, **pending_restart, **values}, source)
+
+def start_config_watcher():
+    """
+    启动后台线程，每隔 config_watch_interval 秒检查配置文件的修改时间，变化时重新加载
+
+    config_watch_interval 为 0 时暂停检查，可通过热加载重新开启。
+    """
+    def signature():
+        try:
+            stat = os.stat(CONFIG_FILE)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def watch():
+        last = signature()
+        while True:
+            interval = CONFIG["config_watch_interval"]
+            sleep(interval or 1)
+            if not interval:
+                continue
+            current = signature()
+            if current != last and current is not None:
+                last = current
+                reload_config()
+
+    threading.Thread(target=watch, name="config-watcher", daemon=True).start()
+
+def _apply_logging(changed):
+    """日志相关配置变化时重新启动日志写线程"""
+    if any(key.startswith("log_") for key in changed):
+        setup_logging(CONFIG)
+
+on_config_change(_apply_logging)
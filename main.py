@@ -1,62 +1,67 @@
 """
 主入口文件，负责启动服务器和初始化资源
+
+默认以单进程模式运行；配置了 workers 或 worker_urls 时以调度进程运行，
+请求转发给各工作进程，工作进程由调度进程以 --worker-port 参数启动。
 """
 
+import argparse
 import atexit
-import threading
-import requests
-from time import sleep
-
-from config import CONFIG, logger
-from browser import browser_pool
-from api import app
+import os
+import signal
+import sys
 
-# 导入路由模块，确保路由被注册
-import api.routes
+from config import CONFIG, logger, start_config_watcher
+from utils.logs import setup_logging
 
-def self_call():
-    """
-    自调用函数，在服务器启动后自动发送一次 API 请求，用于测试或预热
+def run_server(host, port):
     """
-    sleep(3)  # 等待 3 秒，确保服务器已启动
-    url = "http://127.0.0.1:5000/v1/chat/completions"  # 自调用的 API URL
-    payload = {  # 构造请求负载
-        "model": "qwen-plus",
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": "你是谁？"}
-        ],
-        "stream": True,
-        "stream_options": {"include_usage": True}
-    }
-    headers = {  # 构造请求头
-        "Content-Type": "application/json",
-        "apikey": "dummy_api_key"
-    }
-    try:
-        response = requests.post(url, json=payload, headers=headers, stream=True)  # 发送 POST 请求，启用流式响应
-        for line in response.iter_lines(decode_unicode=True):  # 逐行迭代响应内容
-            if line:
-                print(line)  # 打印每行响应数据
-    except Exception as e:
-        print("自调用异常：", e)  # 如果请求异常则输出错误信息
-
-def cleanup():
-    """
-    清理资源，在程序退出时关闭所有浏览器实例
+    在当前进程中启动浏览器池和 API 服务
+
+    参数：
+        host: 监听地址
+        port: 监听端口
     """
-    browser_pool.close_all()  # 调用浏览器池的关闭方法关闭所有实例
+    from browser import browser_pool
+    from api import app
+    import api.routes  # 导入路由模块，确保路由被注册
+
+    def cleanup():
+        """
+        清理资源，在程序退出时关闭所有浏览器实例
+        """
+        browser_pool.close_all()  # 调用浏览器池的关闭方法关闭所有实例
 
-if __name__ == "__main__":
     # 注册清理函数，确保程序退出时关闭浏览器
     atexit.register(cleanup)
-    
-    # 启动自调用线程，作为守护线程在后台运行
-    threading.Thread(target=self_call, daemon=True).start()
-    
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # 被调度进程结束时同样执行清理
+    start_config_watcher()  # 配置文件修改后热加载，无需重启浏览器
+
     # 启动 Flask 服务器
     app.run(
-        host=CONFIG["host"],
-        port=CONFIG["port"],
+        host=host,
+        port=port,
         threaded=True
-    ) 
\ No newline at end of file
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="通义千问 OpenAI 兼容接口服务")
+    parser.add_argument("--worker-port", type=int, help="以工作进程模式运行并监听本机指定端口（由调度进程启动）")
+    args = parser.parse_args()
+
+    if args.worker_port:
+        if CONFIG["log_file"]:  # 多个进程轮转同一个文件会互相覆盖，工作进程各自使用独立的日志文件
+            root, ext = os.path.splitext(CONFIG["log_file"])
+            setup_logging(CONFIG, log_file=f"{root}.worker-{args.worker_port}{ext}")
+        run_server("127.0.0.1", args.worker_port)
+    elif CONFIG["workers"] or CONFIG["worker_urls"]:
+        from api.dispatcher import run_dispatcher
+        logger.info(f"以调度模式启动，本机工作进程 {CONFIG['workers']} 个，远程工作进程 {len(CONFIG['worker_urls'])} 个")
+        start_config_watcher()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # 被终止时同样结束本机工作进程
+        run_dispatcher()
+    else:
+        run_server(CONFIG["host"], CONFIG["port"])
+
+if __name__ == "__main__":
+    main()
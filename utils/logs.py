@@ -0,0 +1,174 @@
+"""
+日志模块：业务线程只把日志记录放入内存队列，由后台线程写入控制台和按大小轮转的 JSON 日志文件
+
+每条记录带有当前请求的编号（request_id），请求编号保存在 contextvars 中，
+在 chat_completions 入口设置，同一线程中的浏览器操作和流式输出日志自动继承。
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from time import monotonic
+
+from utils.metrics import Counter
+
+REQUEST_ID = ContextVar("request_id", default="-")  # 当前线程正在处理的请求编号
+
+LOG_DROPPED = Counter("qwen_log_records_dropped_total", "Log records dropped before reaching the log writer",
+                      ["reason"])
+
+# LogRecord 的内置属性，其余属性视为 extra 传入的结构化字段
+RESERVED_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+class JsonFormatter(logging.Formatter):
+    """将日志记录格式化为单行 JSON，extra 传入的字段原样输出"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """
+    警告及以上级别的日志按调用位置限流：每个位置在 window 秒内最多输出 burst 条，
+    超出的记录被丢弃，下一条放行的记录带上 suppressed 字段说明丢弃了多少条
+    """
+
+    def __init__(self, window, burst):
+        """
+        参数：
+            window: 限流窗口（秒），0 表示不限流
+            burst: 每个窗口内每个位置最多输出的条数
+        """
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.sites = {}  # (文件, 行号) -> [窗口开始时间, 已输出条数, 已丢弃条数]
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or not self.window:
+            return True
+        now = monotonic()
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site else 0
+                self.sites[key] = [now, 1, 0]
+            elif site[1] < self.burst:
+                site[1] += 1
+                suppressed, site[2] = site[2], 0
+            else:
+                site[2] += 1
+                LOG_DROPPED.inc(reason="rate_limited")
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class RequestQueueHandler(logging.handlers.QueueHandler):
+    """
+    在业务线程中只做最少的工作：记录请求编号、展开消息和异常文本后放入有界队列，
+    队列已满时直接丢弃，不阻塞调用方
+    """
+
+    def prepare(self, record):
+        record.request_id = REQUEST_ID.get()
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None  # 回溯对象不能跨线程长期持有
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc(reason="queue_full")
+
+log_queue = queue.Queue(maxsize=10000)  # 尚未写出的日志记录
+queue_handler = RequestQueueHandler(log_queue)
+listener = None  # 后台写日志的 QueueListener
+file_override = None  # setup_logging 指定过的日志文件路径，重新配置时沿用
+
+def install_queue_handler(level=logging.INFO):
+    """
+    将根日志记录器的输出改为写入内存队列
+
+    在读取配置前调用，此时产生的记录暂存在队列中，setup_logging 启动写线程后再写出。
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+def setup_logging(config, log_file=None):
+    """
+    按配置启动（或重新启动）后台写日志线程
+
+    参数：
+        config: 配置字典，读取 log_level、log_file、log_max_bytes、log_backup_count、log_console_format、
+                log_rate_limit_window、log_rate_limit_burst
+        log_file: 覆盖配置中的日志文件路径，如工作进程各自使用独立的文件；之后重新配置时沿用
+    """
+    global listener, file_override
+    if log_file:
+        file_override = log_file
+    logging.getLogger().setLevel(config["log_level"].upper())
+    for old in list(queue_handler.filters):
+        queue_handler.removeFilter(old)
+    queue_handler.addFilter(RateLimitFilter(config["log_rate_limit_window"], config["log_rate_limit_burst"]))
+
+    handlers = []
+    console = logging.StreamHandler()
+    if config["log_console_format"] == "json":
+        console.setFormatter(JsonFormatter())
+    else:
+        console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers.append(console)
+    path = (file_override or config["log_file"]) if config["log_file"] else None
+    if path:
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=config["log_max_bytes"], backupCount=config["log_backup_count"], encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    if listener is not None:  # 先写完并关闭旧的输出，再启动新的写线程
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+def stop_logging():
+    """写出队列中剩余的记录并停止写线程，进程退出时自动调用"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
+
+atexit.register(stop_logging)
@@ -0,0 +1,185 @@
+"""
+监控指标模块，提供计数器、仪表和直方图，并输出 Prometheus 文本格式
+"""
+
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+REGISTRY = []  # 所有已注册的指标，按注册顺序输出
+
+def _escape(value):
+    """转义标签值中的反斜杠、双引号和换行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames, values, extra=None):
+    """将标签名和值格式化为 {a="1",b="2"} 形式"""
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    """格式化数值，整数不带小数点"""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric:
+    """指标基类，负责注册和标签处理"""
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        参数：
+            name: 指标名称
+            documentation: 指标说明
+            labelnames: 标签名列表
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()  # 仅保护本指标的数据，读写都不会触及业务锁
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        """按标签名顺序取出标签值"""
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        """输出 HELP 和 TYPE 行"""
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    """单调递增的计数器"""
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        """计数增加 amount"""
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def remove(self, **labels):
+        """删除一组标签值的序列，用于标签对应的对象（如已回收的浏览器）不再存在时，避免序列无限增长"""
+        key = self._key(labels)
+        with self.lock:
+            self.values.pop(key, None)
+
+    def collect(self):
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+class Gauge(Metric):
+    """
+    仪表，数值由回调函数在抓取时提供
+
+    回调返回 {标签值元组: 数值} 字典，只应读取无锁快照，避免抓取时阻塞业务线程。
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def collect(self):
+        try:
+            values = self.callback() if self.callback else {}
+        except Exception:
+            values = {}
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+class Histogram(Metric):
+    """累积分桶直方图"""
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.values = {}  # 标签值元组 -> [各桶计数..., 总和, 总数]
+
+    def observe(self, value, **labels):
+        """记录一个观测值"""
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录代码块的执行耗时（秒）"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def collect(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        lines = []
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-2])}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+def render():
+    """
+    输出所有指标的 Prometheus 文本格式
+
+    返回：
+        文本字符串
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.header())
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+# 请求各阶段耗时：queue_wait 排队、browser_checkout 等待标签页所属进程的活动窗口、
+# new_chat、select_model 在页面中选择模型、clear_auto_greeting、send_message、first_token 首个字符、generation 发送到生成完成；
+# cancel 客户端断开后停止生成并等待页面空闲、cache_wait 等待正在处理的相同请求、direct_connect 直连后端到收到响应头；
+# 实例启动阶段耗时：browser_start 启动 Chrome 进程、page_load 打开聊天页面、warmup 预热对话；
+# prestage 实例归还后预先打开空白新对话、memory 请求间隙的内存维护
+PHASE_SECONDS = Histogram("qwen_phase_seconds", "Latency of each request phase in seconds", ["phase"])
+OUTPUT_CHARS_PER_SECOND = Histogram(
+    "qwen_output_chars_per_second", "Reply characters per second after the first token",
+    buckets=(5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000))
+REQUESTS = Counter("qwen_requests_total", "Chat completion requests by outcome", ["outcome"])
+RETRIES = Counter("qwen_retries_total", "Retried browser actions by error kind", ["function", "kind"])
+REPLAYS = Counter("qwen_request_replays_total", "Requests replayed on another browser by error kind", ["kind"])
+QUARANTINED = Counter("qwen_browsers_quarantined_total", "Browsers pulled from the pool by the circuit breaker", ["kind"])
+BROWSER_REQUESTS = Counter("qwen_browser_requests_total", "Requests served by each pooled browser", ["browser"])
+ABANDONED = Counter("qwen_abandoned_requests_total",
+                    "Streaming requests whose client disconnected before completion", ["stage"])
+# 回复的读取来源：network 解析页面补全请求的响应流，dom 读取页面渲染结果
+REPLY_SOURCE = Counter("qwen_reply_source_total", "Completed replies by where their text was read from", ["source"])
+# 直连后端的请求结果：ok 完成，error 返回内容前失败，其余为改走浏览器的原因（no_credentials、busy、auth、connect、status）
+DIRECT_REQUESTS = Counter("qwen_direct_requests_total", "Requests tried on the browser-free direct transport by result",
+                          ["result"])
+# 空闲实例被调配给其他模型的次数，按调配后的模型统计；持续增长说明池大小不足以让各模型各自保留实例
+MODEL_SWITCHES = Counter("qwen_model_switches_total", "Idle browsers re-pinned to another model", ["model"])
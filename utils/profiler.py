@@ -0,0 +1,87 @@
+"""
+按需采样分析器：在限定时间内定期采集服务进程所有线程的调用栈，统计热点
+
+采样通过 sys._current_frames() 在独立线程中进行，不需要安装钩子，也不影响未被采样时的性能；
+同一时刻只允许一个采样任务。
+"""
+
+import sys
+import threading
+from collections import Counter
+from time import perf_counter, sleep
+
+profile_lock = threading.Lock()  # 保证同一时刻只有一个采样任务
+
+class ProfilerBusyError(Exception):
+    """已有采样任务在进行中"""
+
+def _frame_label(frame):
+    """调用栈中单帧所属函数的显示名称，同一函数的不同行合并统计"""
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+def sample_stacks(seconds, interval, include_idle=False):
+    """
+    在 seconds 秒内每隔 interval 秒采集一次所有线程的调用栈
+
+    参数：
+        seconds: 采样总时长（秒）
+        interval: 采样间隔（秒）
+        include_idle: 是否保留停在等待锁、条件变量、select 等空闲调用上的栈
+
+    返回：
+        (stacks, samples): stacks 为 {"线程名;外层帧;...;内层帧": 次数}（折叠栈格式，可直接生成火焰图），
+        samples 为采样轮数
+
+    异常：
+        ProfilerBusyError: 已有采样任务在进行中
+    """
+    if not profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("已有采样任务在进行中")
+    try:
+        own = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = perf_counter() + seconds
+        while perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if not include_idle and frame.f_code.co_name in ("wait", "select", "poll", "accept", "acquire",
+                                                                  "_wait_for_tstate_lock", "sleep"):
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            sleep(interval)
+        return stacks, samples
+    finally:
+        profile_lock.release()
+
+def top_functions(stacks, count):
+    """
+    按自身耗时（位于栈顶的采样次数）和累计耗时（出现在栈中的采样次数）统计热点函数
+
+    参数：
+        stacks: sample_stacks 返回的折叠栈计数
+        count: 返回的函数数量
+
+    返回：
+        字典列表，按自身采样次数从多到少排序
+    """
+    own = Counter()
+    total = Counter()
+    for stack, hits in stacks.items():
+        frames = stack.split(";")[1:]  # 第一段是线程名
+        if not frames:
+            continue
+        own[frames[-1]] += hits
+        for frame in set(frames):
+            total[frame] += hits
+    ranked = sorted(total, key=lambda frame: (own[frame], total[frame]), reverse=True)
+    return [{"function": frame, "self": own[frame], "total": total[frame]} for frame in ranked[:count]]
@@ -0,0 +1,178 @@
+"""
+慢请求飞行记录仪：在内存环形缓冲区中保留最近请求的逐阶段时间线
+
+每个请求一条时间线，记录排队、领取浏览器、新建对话、发送消息、首字、生成完成、归还等阶段的
+开始时间和耗时，以及重试、重放事件和使用过的浏览器编号。当前请求的时间线保存在 contextvars 中，
+浏览器操作和重试装饰器无需传参即可写入。记录只有几次列表追加，可在生产环境常开。
+"""
+
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import time as current_time
+
+from utils.metrics import PHASE_SECONDS
+
+CURRENT_TIMELINE = ContextVar("timeline", default=None)  # 当前线程正在处理的请求的时间线
+
+class Timeline:
+    """
+    单个请求的时间线，时间均为相对请求开始的秒数
+    """
+    __slots__ = ("request_id", "started_at", "events", "browsers", "outcome", "duration")
+
+    def __init__(self, request_id):
+        """
+        参数：
+            request_id: 请求编号
+        """
+        self.request_id = request_id
+        self.started_at = current_time()  # 请求开始的时间戳
+        self.events = []  # (名称, 开始时间, 耗时或 None, 附加信息或 None)
+        self.browsers = []  # 依次使用过的浏览器编号（重放时会有多个）
+        self.outcome = None  # 请求结果，与 qwen_requests_total 的 outcome 一致
+        self.duration = None  # 请求总耗时，结束前为 None
+
+    def add(self, name, start, duration=None, **info):
+        """
+        追加一个阶段或事件
+
+        参数：
+            name: 阶段或事件名称
+            start: 开始时间戳
+            duration: 耗时（秒），瞬时事件为 None
+            info: 附加信息，如浏览器编号、错误类型
+        """
+        self.events.append((name, start - self.started_at, duration, info or None))
+
+    def mark(self, name, **info):
+        """记录一个发生在当前时刻的事件"""
+        self.add(name, current_time(), **info)
+
+    def elapsed(self):
+        """请求已持续或总共持续的时间（秒）"""
+        return self.duration if self.duration is not None else current_time() - self.started_at
+
+    def to_dict(self):
+        """转换为可序列化为 JSON 的字典，事件按开始时间排序"""
+        events = []
+        for name, offset, duration, info in sorted(self.events, key=lambda event: event[1]):
+            event = {"name": name, "at": round(offset, 4)}
+            if duration is not None:
+                event["duration"] = round(duration, 4)
+            if info:
+                event.update(info)
+            events.append(event)
+        return {
+            "request_id": self.request_id,
+            "started_at": self.started_at,
+            "duration": round(self.elapsed(), 4),
+            "outcome": self.outcome,
+            "browsers": list(self.browsers),
+            "events": events,
+        }
+
+class FlightRecorder:
+    """
+    保留最近 capacity 个已结束请求的时间线，以及所有进行中的请求
+    """
+
+    def __init__(self, capacity):
+        """
+        参数：
+            capacity: 保留的已结束时间线数量
+        """
+        self.finished = deque(maxlen=capacity)  # 已结束的时间线，超出容量时丢弃最早的
+        self.active = {}  # id(时间线) -> 进行中的时间线；请求编号可由客户端指定，可能重复，不能作为键
+        self.lock = threading.Lock()  # 保护 active 字典
+
+    def resize(self, capacity):
+        """调整保留的已结束时间线数量，保留最近的记录"""
+        self.finished = deque(self.finished, maxlen=capacity)
+
+    def start(self, request_id):
+        """
+        开始记录一个请求，并设为当前线程的时间线
+
+        参数：
+            request_id: 请求编号
+
+        返回：
+            Timeline 实例
+        """
+        timeline = Timeline(request_id)
+        with self.lock:
+            self.active[id(timeline)] = timeline
+        CURRENT_TIMELINE.set(timeline)
+        return timeline
+
+    def finish(self, timeline, outcome=None):
+        """
+        结束记录，放入环形缓冲区，可重复调用
+
+        参数：
+            timeline: Timeline 实例
+            outcome: 请求结果，为 None 时保留已记录的结果
+        """
+        with self.lock:
+            if self.active.pop(id(timeline), None) is None:
+                return
+        if outcome is not None:
+            timeline.outcome = outcome
+        timeline.duration = current_time() - timeline.started_at
+        self.finished.append(timeline)
+
+    def slowest(self, count, include_active=True):
+        """
+        返回耗时最长的若干条时间线
+
+        参数：
+            count: 返回的条数
+            include_active: 是否包含仍在进行中的请求（按已持续时间参与排序）
+
+        返回：
+            字典列表，按耗时从长到短排序
+        """
+        timelines = list(self.finished)
+        if include_active:
+            with self.lock:
+                timelines.extend(self.active.values())
+        timelines.sort(key=lambda timeline: timeline.elapsed(), reverse=True)
+        return [timeline.to_dict() for timeline in timelines[:count]]
+
+def mark(name, **info):
+    """在当前请求的时间线上记录一个事件，不在请求中时忽略"""
+    timeline = CURRENT_TIMELINE.get()
+    if timeline is not None:
+        timeline.mark(name, **info)
+
+def record_phase(name, start, duration, **info):
+    """
+    记录已知开始时间和耗时的阶段：写入 qwen_phase_seconds 直方图，并追加到当前请求的时间线
+
+    参数：
+        name: 阶段名称，同时作为直方图的 phase 标签
+        start: 开始时间戳
+        duration: 耗时（秒）
+        info: 写入时间线的附加信息
+    """
+    PHASE_SECONDS.observe(duration, phase=name)
+    timeline = CURRENT_TIMELINE.get()
+    if timeline is not None:
+        timeline.add(name, start, duration, **info)
+
+@contextmanager
+def phase(name, **info):
+    """
+    记录代码块的耗时：写入 qwen_phase_seconds 直方图，并追加到当前请求的时间线
+
+    参数：
+        name: 阶段名称，同时作为直方图的 phase 标签
+        info: 写入时间线的附加信息
+    """
+    start = current_time()
+    try:
+        yield
+    finally:
+        record_phase(name, start, current_time() - start, **info)
@@ -1,32 +1,99 @@
 """
-重试装饰器模块，提供自动重试功能
+重试装饰器模块，提供按错误类型区分的自动重试功能
 """
 
+import random
 from time import sleep
+
+from selenium.common.exceptions import (InvalidSessionIdException, NoSuchElementException, NoSuchWindowException,
+                                        StaleElementReferenceException, TimeoutException, WebDriverException)
+
 from config import CONFIG
+from utils.metrics import RETRIES
+from utils.recorder import mark
+
+# 浏览器会话已失效时 WebDriver 错误信息中常见的片段
+SESSION_DEAD_MARKERS = ("invalid session id", "session deleted", "chrome not reachable", "disconnected",
+                        "no such window", "target window already closed", "connection refused")
+
+# 各类错误在同一浏览器上的最多尝试次数（含首次），None 表示使用 CONFIG["retry_max"]
+#   stale: 元素因页面重新渲染而失效，立即重新查找即可恢复
+#   missing: 元素暂未出现，退避后重试
+#   timeout: 已等待满 wait_timeout，原地重试只会再等一轮，交由上层换浏览器重放
+#   session: 浏览器会话已失效，重试没有意义
+#   other: 其他错误，退避后重试
+RETRY_ATTEMPTS = {"stale": None, "missing": None, "timeout": 1, "session": 1, "other": None}
+
+def classify_error(error):
+    """
+    判断异常的类型
+
+    参数：
+        error: 异常对象
+
+    返回：
+        "stale"、"missing"、"timeout"、"session" 或 "other"
+    """
+    if isinstance(error, StaleElementReferenceException):
+        return "stale"
+    if isinstance(error, (InvalidSessionIdException, NoSuchWindowException, ConnectionError)):
+        return "session"
+    if isinstance(error, (TimeoutException, TimeoutError)):
+        return "timeout"
+    if isinstance(error, NoSuchElementException):
+        return "missing"
+    message = str(error).lower()
+    if isinstance(error, WebDriverException) or "urllib3" in type(error).__module__:
+        if any(marker in message for marker in SESSION_DEAD_MARKERS):
+            return "session"
+    return "other"
+
+def backoff_delay(attempt, base=None, cap=None):
+    """
+    计算带随机抖动的指数退避时间
+
+    参数：
+        attempt: 已失败的次数，从 0 开始
+        base: 首次退避的基准时间（默认为 CONFIG["retry_delay"]）
+        cap: 退避时间上限（默认为 CONFIG["retry_max_delay"]）
+
+    返回：
+        等待秒数，在 [0.5, 1.5) 倍的指数退避时间内随机取值
+    """
+    base = CONFIG["retry_delay"] if base is None else base
+    cap = CONFIG["retry_max_delay"] if cap is None else cap
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.5)
 
 def retry_on_failure(func, max_retries=None, delay=None):
     """
-    重试装饰器，用于在函数调用失败时自动重试指定次数
+    重试装饰器，按错误类型决定是否在原地重试
+
+    元素失效立即重试；超时和会话失效不重试，直接抛出交由上层在其他浏览器上重放整个请求；
+    其他错误按带抖动的指数退避重试。重试次数和延迟在每次调用时读取配置。
 
     参数：
         func: 需要重试的目标函数
-        max_retries: 最大重试次数（默认为 CONFIG["retry_max"]）
-        delay: 重试之间的延迟时间（默认为 CONFIG["retry_delay"]）
+        max_retries: 最大尝试次数（默认为 CONFIG["retry_max"]）
+        delay: 首次退避的基准时间（默认为 CONFIG["retry_delay"]）
 
     返回：
-        包装后的函数，在调用时如果出现异常会自动重试
+        包装后的函数，在调用时如果出现异常会按错误类型自动重试
     """
-    max_retries = max_retries or CONFIG["retry_max"]  # 若未提供重试次数，则使用默认值
-    delay = delay or CONFIG["retry_delay"]  # 若未提供延迟时间，则使用默认值
-
     def wrapper(*args, **kwargs):  # 定义包装函数
-        for attempt in range(max_retries):  # 尝试执行最多 max_retries 次
+        attempt = 0
+        while True:
             try:
                 return func(*args, **kwargs)  # 尝试调用目标函数，成功则返回结果
             except Exception as e:  # 捕获异常
-                if attempt == max_retries - 1:  # 如果已达到最大重试次数
-                    raise e  # 抛出异常
-                sleep(delay)  # 否则等待一段时间后重试
-        return None  # 如果全部重试后仍失败，返回 None
-    return wrapper  # 返回包装后的函数 
\ No newline at end of file
+                kind = classify_error(e)
+                limit = RETRY_ATTEMPTS[kind] or max_retries or CONFIG["retry_max"]
+                if attempt + 1 >= limit:  # 已达到该类错误的最大尝试次数
+                    raise
+                RETRIES.inc(function=func.__name__, kind=kind)  # 记录重试次数
+                mark("retry", function=func.__name__, kind=kind)  # 写入当前请求的时间线
+                if kind != "stale":  # 元素失效时立即重新查找，其他错误退避后重试
+                    sleep(backoff_delay(attempt, delay))
+                attempt += 1
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper  # 返回包装后的函数
@@ -2,6 +2,12 @@
 文本处理相关的工具函数
 """
 
+import re
+
+ASTRAL_CHARS = re.compile("[\U00010000-\U0010FFFF]")  # 页面输入框不支持的 BMP 以外字符（如 emoji）
+CJK_CHARS = re.compile("[\u2e80-\u9fff\uac00-\ud7af]")  # 中日韩字符，估算 token 时每字约 1 个 token
+ROLE_PREFIXES = {"system": "System: ", "user": "Human: ", "assistant": "Assistant: "}  # 合并消息时的角色前缀
+
 def sanitize_text(text):
     """
     清洗文本，移除或替换不支持的字符
@@ -11,31 +17,169 @@ def sanitize_text(text):
     返回：
         处理后的文本字符串
     """
-    # 过滤掉 Unicode 编码大于 0x10000 的字符
-    return ''.join(char for char in text if ord(char) < 0x10000)
+    if text.isascii():  # 纯 ASCII 文本无需处理
+        return text
+    # 过滤掉 Unicode 编码大于等于 0x10000 的字符
+    return ASTRAL_CHARS.sub("", text)
+
+def content_text(content):
+    """
+    取出消息内容中的文本
+
+    参数：
+        content: 字符串，或 OpenAI 列表格式的内容片段，如 [{"type": "text", "text": "..."}]；
+                 非文本片段（如图片）会被忽略
+    返回：
+        文本字符串，多个文本片段之间用换行连接
+    """
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if isinstance(part, str):
+                parts.append(part)
+            elif isinstance(part, dict) and part.get("type", "text") == "text":
+                parts.append(part.get("text") or "")
+        return "\n".join(part for part in parts if part)
+    return str(content)
 
 def merge_messages(messages):
     """
     合并消息列表，并添加角色前缀
 
     参数：
-        messages: 包含多条消息的列表，每条消息为字典，包含 "role" 和 "content"
+        messages: 包含多条消息的列表，每条消息为字典，包含 "role" 和 "content"（字符串或内容片段列表）
     返回：
         合并后的消息字符串，每条消息之间用双换行分隔
     """
     merged_parts = []  # 初始化存储合并结果的列表
     for msg in messages:  # 遍历每条消息
-        role = msg.get("role")  # 获取消息角色
-        content = msg.get("content", "").strip()  # 获取消息内容并去除首尾空白
+        content = content_text(msg.get("content")).strip()  # 获取消息内容并去除首尾空白
         if not content:  # 如果内容为空则跳过
             continue
-        content = sanitize_text(content)  # 清洗消息内容
-        if role == "system":  # 如果角色为 system
-            merged_parts.append(f"System: {content}")  # 添加带有角色标识的消息
-        elif role == "user":  # 如果角色为 user
-            merged_parts.append(f"Human: {content}")  # 添加带有角色标识的消息
-        elif role == "assistant":  # 如果角色为 assistant
-            merged_parts.append(f"Assistant: {content}")  # 添加带有角色标识的消息
+        # 添加带有角色标识的消息，其他角色直接添加内容
+        merged_parts.append(ROLE_PREFIXES.get(msg.get("role"), "") + content)
+    return sanitize_text("\n\n".join(merged_parts))  # 使用双换行符连接所有消息，整体清洗一次
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的 token 数：中日韩字符每字约 1 个 token，其余字符约 4 个字符 1 个 token
+
+    参数：
+        text: 文本字符串
+    返回：
+        估算的 token 数
+    """
+    if not text:
+        return 0
+    if text.isascii():
+        return (len(text) + 3) // 4
+    cjk = len(text) - len(CJK_CHARS.sub("", text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def truncate_tokens(text, max_tokens):
+    """
+    截取估算 token 数不超过 max_tokens 的最长前缀
+
+    参数：
+        text: 文本字符串
+        max_tokens: token 上限
+    返回：
+        截断后的文本，未超出上限时原样返回
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if text.isascii():
+        return text[:max_tokens * 4]
+    low, high = 0, len(text)  # 前缀越长估算值越大，二分查找满足上限的最长前缀
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
         else:
-            merged_parts.append(content)  # 其他角色直接添加内容
-    return "\n\n".join(merged_parts)  # 使用双换行符连接所有消息 
\ No newline at end of file
+            high = middle - 1
+    return text[:low]
+
+def truncate_middle(text, max_tokens):
+    """
+    保留文本首尾、省略中间部分，使估算的 token 数不超过 max_tokens
+
+    参数：
+        text: 文本字符串
+        max_tokens: token 上限
+    返回：
+        截断后的文本，未超出上限时原样返回
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = max(int(len(text) * max_tokens / tokens) - 16, 0) // 2  # 按比例换算成字符数，预留省略标记
+    return text[:keep] + "\n……（中间内容已省略）……\n" + text[len(text) - keep:]
+
+def trim_messages(messages, max_tokens):
+    """
+    按 token 预算裁剪对话历史
+
+    system 消息和最后一条消息始终保留；超出预算时从最早的对话开始整条丢弃，并在原位置插入省略说明；
+    仍超出预算时（如单条消息过长），从最长的消息开始保留首尾、省略中间内容。
+
+    参数：
+        messages: 消息列表
+        max_tokens: 合并后文本的 token 上限，0 或 None 表示不裁剪
+    返回：
+        裁剪后的新消息列表，未超出预算时返回原列表
+    """
+    if not max_tokens or not messages:
+        return messages
+    costs = [estimate_tokens(content_text(msg.get("content"))) + 4 for msg in messages]  # 4 为角色前缀和分隔符
+    total = sum(costs)
+    if total <= max_tokens:
+        return messages
+
+    last = len(messages) - 1
+    dropped = set()
+    for index, msg in enumerate(messages):  # 从最早的对话开始丢弃
+        if total <= max_tokens:
+            break
+        if index == last or msg.get("role") == "system":
+            continue
+        dropped.add(index)
+        total -= costs[index]
+
+    trimmed = []
+    for index, msg in enumerate(messages):
+        if index in dropped:
+            if index - 1 not in dropped:  # 连续丢弃的消息只插入一条说明
+                count = next((i for i in range(index, len(messages)) if i not in dropped), len(messages)) - index
+                trimmed.append({"role": "system", "content": f"（为控制上下文长度，已省略较早的 {count} 条消息）"})
+                total += 16
+            continue
+        trimmed.append({"role": msg.get("role"), "content": content_text(msg.get("content"))})
+
+    while total > max_tokens:  # 仍超出预算，截断最长的消息
+        index = max(range(len(trimmed)), key=lambda i: len(trimmed[i]["content"]))
+        content = trimmed[index]["content"]
+        before = estimate_tokens(content)
+        budget = max(before - (total - max_tokens), 0)
+        shortened = truncate_middle(content, budget)
+        after = estimate_tokens(shortened)
+        if after >= before:  # 无法继续缩短
+            break
+        trimmed[index] = dict(trimmed[index], content=shortened)
+        total -= before - after
+    return trimmed
+
+def split_chunks(text, size):
+    """
+    将文本按固定字符数切分
+
+    参数：
+        text: 文本字符串
+        size: 每块的字符数
+    返回：
+        文本块列表
+    """
+    return [text[i:i + size] for i in range(0, len(text), size)]